@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Messages per second packed and unpacked by the codecs generated by
+# fidl_parser.codec, compared with packing each message by walking
+# the converted dictionaries.
+#
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parse_tree, codec
+
+fidl_text = """
+package bench
+typeCollection Types {
+    enumeration Mode { IDLE RUNNING STOPPED }
+    struct Position { Double x Double y Double z }
+    struct Sample { UInt8 channel Int16 offset UInt32 sequence Position position Mode mode Boolean valid }
+    struct Frame { UInt32 id String source Sample sample UInt32[] values Position[] track }
+}
+"""
+
+samples = {
+    'Types.Sample': { 'channel': 3, 'offset': -12, 'sequence': 123456,
+                      'position': { 'x': 1.0, 'y': 2.0, 'z': 3.0 }, 'mode': 1, 'valid': True },
+}
+samples['Types.Frame'] = { 'id': 7, 'source': 'sensor-0',
+                           'sample': samples['Types.Sample'],
+                           'values': list(range(256)),
+                           'track': [ { 'x': float(i), 'y': 0.0, 'z': -1.0 } for i in range(16) ] }
+
+
+#
+# Packing by walking the converted dictionaries
+#
+def walk_pack(dict_tree, value):
+    if isinstance(dict_tree, str):
+        if dict_tree == 'string':
+            data = value.encode('utf-8')
+            return struct.pack('<I', len(data)) + data
+
+        return struct.pack(f"<{codec.wire_codes[dict_tree]}", value)
+
+    if dict_tree.get('type') == 'enumeration':
+        return struct.pack('<i', value)
+
+    # Members, without the alignment of the generated codecs
+    parts = []
+    for member in dict_tree['members']:
+        member_value = value[member['name']]
+        resolved = member['_resolved_datatype']
+        if member.get('array_size') is not None:
+            parts.append(struct.pack('<I', len(member_value)))
+            parts.extend([ walk_pack(resolved, elem) for elem in member_value ])
+        else:
+            parts.append(walk_pack(resolved, member_value))
+
+    return b''.join(parts)
+
+
+def rate(func, value, seconds):
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for _ in range(100):
+            func(value)
+        count += 100
+
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+    result = parse_tree.convert_fidl_text(fidl_text)
+    datatypes = { f"Types.{datatype['name']}": datatype for datatype in result['types']['datatypes'] }
+
+    start = time.perf_counter()
+    codecs = codec.create_codecs(result)
+    print(f"codec generation: {(time.perf_counter() - start)*1000:.2f} ms")
+
+    print(f"{'message':<14}{'bytes':>7}{'walk pack/s':>14}{'pack/s':>12}{'unpack/s':>12}")
+    for (name, value) in samples.items():
+        message_codec = codecs[name]
+        packed = message_codec.pack(value)
+        walk_rate = rate(lambda value: walk_pack(datatypes[name], value), value, seconds)
+        pack_rate = rate(message_codec.pack, value, seconds)
+        unpack_rate = rate(message_codec.unpack, packed, seconds)
+        print(f"{name:<14}{len(packed):>7}{walk_rate:>14,.0f}{pack_rate:>12,.0f}{unpack_rate:>12,.0f}")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Parse time of a comment heavy model with the structured comment
+# terminal of the grammar, and with the lazy (.|\n)+? pattern it
+# replaced, and the time to reject an unterminated comment.
+#
+# Usage: bench_comments.py [methods]
+#
+import os
+import sys
+import time
+import lark
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parser, parse_tree
+
+lazy_comment = '%ignore "<**" /(.|\\n)+?/ "**>"\n'
+
+
+def fidl_model(method_count):
+    lines = [ "package bench", "interface Service {" ]
+    for i in range(method_count):
+        lines.append(f"  <** @description: Method m{i}, with a longer description of what it does")
+        lines.append("      and of its arguments. Stars * and ** and arrows -> are allowed.")
+        lines.append("      @author: bench **>")
+        lines.append(f"  method m{i} {{ in {{ <** @description: Argument x{i} **> UInt32 x{i} }} }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def lazy_grammar():
+    # The grammar with the structured comment terminal replaced by
+    # the lazy pattern
+    grammar = parser.grammar_text()
+    start = grammar.index('FIDL_STRUCTURED_COMMENT:')
+    end = grammar.index('%ignore FIDL_STRUCTURED_COMMENT')
+    end = grammar.index('\n', end) + 1
+    return grammar[:start] + lazy_comment + grammar[end:]
+
+
+def parse_time(lark_parser, text, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        try:
+            lark_parser.parse(text)
+        except lark.exceptions.LarkError:
+            pass
+
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = fidl_model(count)
+    unterminated = "package bench\n<** " + "unterminated comment * text " * (len(text) // 28)
+
+    parsers = [
+        ('terminal', parser.get_parser()),
+        ('lazy', lark.Lark(lazy_grammar(), **parser.parser_options())),
+    ]
+
+    print(f"{len(text) // 1024} kB, {2 * count} structured comments")
+    print(f"{'comment':>10} {'parse ms':>10} {'unterminated ms':>16}")
+    for (name, lark_parser) in parsers:
+        print(f"{name:>10} {parse_time(lark_parser, text, 3) * 1000:>10.1f}"
+              f" {parse_time(lark_parser, unterminated, 3) * 1000:>16.1f}")
+
+    start = time.perf_counter()
+    parse_tree.convert_fidl_text(text)
+    print(f"convert_fidl_text() with comments attached: {(time.perf_counter() - start) * 1000:.1f} ms")
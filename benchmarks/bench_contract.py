@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Events per second validated by contract.TraceChecker, for random
+# valid traces of the contracts of the test cases.
+#
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parse_tree, contract
+
+testcases = os.path.join(os.path.dirname(__file__), '..', 'testcases', 'core_tests', 'contracts')
+
+
+def random_trace(machine, length, values):
+    # Walk the table with a random allowed event in each state.
+    # values(event name) returns the values of a guarded event.
+    width = len(machine.events)
+    trace = []
+    state = machine.initial
+    checker = machine.checker()
+    while len(trace) < length:
+        row = machine.table[state * width:(state + 1) * width]
+        event = random.choice([ event for (event, target) in enumerate(row) if target != contract.REJECT ])
+        if row[event] >= 0:
+            trace.append(event)
+        else:
+            trace.append((event, values(machine.events[event])))
+
+        checker.feed(trace[-1:])
+        state = machine.state_id(checker.state)
+
+    return trace
+
+
+def rate(machine, trace, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        machine.check(trace)
+
+    return len(trace) * rounds / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(1)
+
+    cases = [
+        ('OverloadedMethodsInContract.fidl', 'SomeInterface', lambda event: {}),
+        ('ValidUsageOfErrorKeywords.fidl', 'InterfaceTest', lambda event: { 'errorval': random.randrange(2) }),
+    ]
+
+    print(f"{'contract':<16}{'states':>8}{'events':>8}{'trace':>10}{'compile ms':>12}{'events/s':>14}")
+    for (file_name, interface, values) in cases:
+        with open(os.path.join(testcases, file_name)) as f:
+            result = parse_tree.convert_fidl_text(f.read())
+
+        start = time.perf_counter()
+        machine = contract.compile_contract([ res for res in parse_tree.declarations(result, 'interfaces') if res['name'] == interface ][0])
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        trace = random_trace(machine, length, values)
+        print(f"{interface:<16}{len(machine.states):>8}{len(machine.events):>8}{len(trace):>10}"
+              f"{compile_ms:>12.3f}{rate(machine, trace, 3):>14,.0f}")
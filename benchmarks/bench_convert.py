@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Measure how convert_fidl_tree() scales with the number of members
+# in a type collection. The time per member should stay flat as the
+# size of the type collection grows.
+#
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import get_parser, parse_tree
+
+
+def type_collection(member_count):
+    lines = [ "package bench", "typeCollection Types {" ]
+    lines.append("  struct Big {")
+    lines.extend([ f"    UInt32 member{i}" for i in range(member_count) ])
+    lines.append("  }")
+    lines.append("  enumeration BigEnum {")
+    lines.extend([ f"    E{i} = {i}" for i in range(member_count) ])
+    lines.append("  }")
+    lines.extend([ f"  struct S{i} {{ Big value{i} }}" for i in range(member_count) ])
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def best_of(count, func):
+    best = None
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+if __name__ == "__main__":
+    lark_parser = get_parser()
+    print(f"{'members':>8} {'parse ms':>10} {'convert ms':>11} {'convert us/member':>18}")
+    for member_count in (1000, 2000, 4000, 8000):
+        fidl_text = type_collection(member_count)
+        tree = lark_parser.parse(fidl_text)
+        parse_time = best_of(3, lambda: lark_parser.parse(fidl_text))
+        convert_time = best_of(3, lambda: parse_tree.convert_fidl_tree(tree))
+        print(f"{member_count:>8} {parse_time*1000:>10.1f} {convert_time*1000:>11.1f} "
+              f"{convert_time*1000000/(member_count*3):>18.2f}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Time loading and binding a deployment of a synthetic model from
+# generate_model.py. A .fdepl file is generated for each model file,
+# deploying its interface, each method, broadcast and argument, and
+# its type collection with each struct and struct field.
+#
+# Usage: bench_deployment.py [files]
+#
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import deployment
+from fidl_parser.project import Project
+import generate_model
+
+specification = """
+specification gen.Spec {
+  for interfaces { ServiceId: Integer; }
+  for methods { MethodId: Integer; Reliable: Boolean (default: false); }
+  for broadcasts { EventId: Integer; EventGroups: Integer[] (optional); }
+  for arguments { Label: String (optional); }
+  for strings { Encoding: {utf8, utf16} (default: utf8); }
+  for integers { Endianness: {le, be} (default: be); }
+  for structs { Packed: Boolean (default: false); }
+  for struct_fields { Offset: Integer (optional); }
+  for enumerations { Width: Integer (default: 4); }
+  for instances { InstanceId: Integer; }
+}
+"""
+
+
+def fdepl_file(index, structs=20, members=4, methods=20):
+    lines = [ f"package gen.deploy{index}", "import \"spec.fdepl\"", f"import \"f{index}.fidl\"", "" ]
+
+    lines.append(f"define gen.Spec for interface gen.p{index}.Service{index} {{")
+    lines.append(f"  ServiceId = {index}")
+    for k in range(methods):
+        lines.append(f"  method m{k} {{ MethodId = {k} in {{ id{k} {{ Label = \"id\" }} }} }}")
+        lines.append(f"  broadcast b{k} {{ EventId = {0x8000 + k} EventGroups = {{ 1, {k} }}")
+        lines.append(f"    out {{ text{k} {{ Encoding = utf16 }} }} }}")
+    lines.append("}")
+
+    lines.append(f"define gen.Spec for typeCollection gen.p{index}.Types{index} {{")
+    for k in range(structs):
+        fields = " ".join([ f"a{k}_{m} {{ Offset = {m * 4} }}" for m in range(0, members, 4) ])
+        lines.append(f"  struct S{index}_{k} {{ Packed = true {fields} }}")
+    lines.append("}")
+
+    lines.append(f"define gen.Spec for provider as Server{index} {{")
+    lines.append(f"  instance gen.p{index}.Service{index} {{ InstanceId = {index} }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_model.generate_project(directory, files)
+        with open(os.path.join(directory, "spec.fdepl"), "w") as f:
+            f.write(specification)
+
+        root_files = []
+        for index in range(files):
+            root_files.append(os.path.join(directory, f"d{index}.fdepl"))
+            with open(root_files[-1], "w") as f:
+                f.write(fdepl_file(index))
+
+        # Build the parser before measuring
+        deployment.convert_fdepl_text("package warmup")
+
+        start = time.perf_counter()
+        depl = deployment.Deployment(root_files).load()
+        load_time = time.perf_counter() - start
+
+        project = Project(depl.model_files).load()
+
+        start = time.perf_counter()
+        binding = depl.bind(project.namespace)
+        bind_time = time.perf_counter() - start
+
+    print(f"{files} model files, {len(depl.files)} deployment files")
+    print(f"load deployment: {load_time * 1000:>8.1f} ms")
+    print(f"bind:            {bind_time * 1000:>8.1f} ms, {len(binding.properties)} elements with properties")
+    print(f"errors:          {len(binding.errors)}")
+    for error in binding.errors[:10]:
+        print(f"  {error}")
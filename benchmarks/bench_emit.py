@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Compare time, peak memory and output size of json.dumps() with the
+# streaming emitters of fidl_parser.emitter, writing a converted model
+# to /dev/null. Each struct of the model has a member of the previous
+# struct, so json.dumps() repeats a growing chain of resolved types.
+# Each method has an inline error enumeration, the same for all
+# methods, written once by the table emitter.
+#
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parse_tree, emitter
+
+
+def fidl_model(type_count, depth):
+    lines = [ "package bench", "typeCollection Types {" ]
+    for i in range(type_count):
+        previous = f" S{i-1} s{i}" if i % depth else ""
+        lines.append(f"  struct S{i} {{ UInt32 a{i} String b{i}{previous} }}")
+    lines.append("}")
+    lines.append("interface Service {")
+    for i in range(type_count):
+        lines.append(f"  method m{i} {{ in {{ Types.S{i} x{i} }} error {{ FAILED BUSY }} }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+class CountingFile:
+    # Counts the characters written to /dev/null
+    def __init__(self, out):
+        self._out = out
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+        return self._out.write(text)
+
+
+def dumps(result, out):
+    out.write(json.dumps(result, indent=2))
+
+
+def stream_inline(result, out):
+    emitter.JsonEmitter(out, 2, references=False).write(result)
+
+
+def stream_references(result, out):
+    emitter.JsonEmitter(out, 2).write(result)
+
+
+def stream_compact(result, out):
+    emitter.JsonEmitter(out).write(result)
+
+
+def stream_records(result, out):
+    emitter.RecordEmitter(out).write(result)
+
+
+def stream_table(result, out):
+    emitter.TableEmitter(out).write(result)
+
+
+def measure(func, result):
+    with open(os.devnull, 'w') as devnull:
+        out = CountingFile(devnull)
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(result, out)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (elapsed, peak, out.size)
+
+
+if __name__ == "__main__":
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print(f"{'types':>7} {'mode':>12} {'time ms':>9} {'peak MB':>9} {'output MB':>10}")
+    for count in (500, 1000, 2000):
+        result = parse_tree.convert_fidl_text(fidl_model(count, depth))
+        for (name, func) in (('json.dumps', dumps), ('inline', stream_inline),
+                             ('references', stream_references), ('compact', stream_compact),
+                             ('jsonl', stream_records), ('table', stream_table)):
+            (elapsed, peak, size) = measure(func, result)
+            print(f"{count:>7} {name:>12} {elapsed*1000:>9.1f} {peak/1048576:>9.1f} {size/1048576:>10.1f}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Compare the memory retained by the dictionaries returned by
+# convert_fidl_text() with the memory retained by the typed model
+# built from them by model.build_model().
+#
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parse_tree, model
+
+
+def fidl_model(member_count):
+    # Structs with five members each, referring to the previous struct
+    # and enumeration, and one method per struct.
+    struct_count = member_count // 5
+    lines = [ "package bench", "typeCollection Types {" ]
+    for i in range(struct_count):
+        lines.append(f"  enumeration E{i} {{ A{i} = {i} B{i} }}")
+        if i == 0:
+            lines.append(f"  struct S{i} {{ UInt32 a String b Boolean c UInt8[] d Int64 e }}")
+        else:
+            lines.append(f"  struct S{i} {{ UInt32 a String b S{i-1} c E{i-1} d UInt8[] e }}")
+    lines.append("}")
+    lines.append("interface Service {")
+    for i in range(struct_count):
+        lines.append(f"  method m{i} {{ in {{ Types.S{i} x }} out {{ Types.E{i} y }} }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def build(result):
+    builder = model.ModelBuilder()
+    package = builder.build(result)
+    builder.link()
+    return package
+
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+if __name__ == "__main__":
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    fidl_text = fidl_model(member_count)
+
+    # Build the parser before measuring
+    parse_tree.convert_fidl_text("package warmup")
+
+    result = parse_tree.convert_fidl_text(fidl_text)
+    start = time.perf_counter()
+    build(result)
+    build_time = time.perf_counter() - start
+    del result
+
+    tracemalloc.start()
+    base = traced()
+    result = parse_tree.convert_fidl_text(fidl_text)
+    dict_size = traced() - base
+
+    # Keep only the model
+    package = build(result)
+    del result
+    model_size = traced() - base
+    tracemalloc.stop()
+
+    print(f"members:    {member_count}")
+    print(f"dicts:      {dict_size/1048576:>8.1f} MB")
+    print(f"model:      {model_size/1048576:>8.1f} MB")
+    print(f"build time: {build_time*1000:>8.1f} ms")
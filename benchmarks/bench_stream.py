@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Compare time and peak memory of reading a large generated .fidl file
+# and converting it with convert_fidl_text(), with converting it in
+# chunks with convert_fidl_stream(). The file holds a type collection
+# and an interface using it per index.
+#
+# Usage: bench_stream.py [type collections] [jobs]
+#
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import parse_tree, stream
+
+
+def declarations(index, types=20, methods=20):
+    lines = [ f"typeCollection Types{index} {{" ]
+    for k in range(types):
+        lines.append(f"  struct S{k} {{ UInt32 a{k} String b{k} Boolean[] c{k} }}")
+        lines.append(f"  enumeration E{k} {{ A{k} = {k} * 2 B{k} C{k} }}")
+    lines.append("}")
+    lines.append(f"interface Service{index} {{")
+    for k in range(methods):
+        lines.append(f"  method m{k} {{ in {{ Types{index}.S{k % types} x{k} }} out {{ Types{index}.E{k % types} e{k} }} }}")
+        lines.append(f"  broadcast b{k} {{ out {{ Int64 v{k} }} }}")
+    lines.append("}")
+    return lines
+
+
+def write_model(file_name, count):
+    with open(file_name, 'w') as f:
+        f.write("package gen\n\n")
+        for index in range(count):
+            f.write("\n".join(declarations(index)) + "\n\n")
+
+
+def read_and_convert(file_name):
+    with open(file_name) as f:
+        return parse_tree.convert_fidl_text(f.read())
+
+
+def measure(func, *args, **options):
+    tracemalloc.start()
+    func(*args, **options)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    func(*args, **options)
+    return (time.perf_counter() - start, peak)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    # Build the parser before measuring
+    parse_tree.convert_fidl_text("package warmup")
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "model.fidl")
+        write_model(file_name, count)
+        print(f"{count * 2} declarations, {os.path.getsize(file_name) / 1048576:.1f} MB")
+        print(f"{'mode':>16} {'time ms':>9} {'peak MB':>9}")
+
+        runs = [ ('read', read_and_convert, {}),
+                 ('stream', stream.convert_fidl_stream, {}),
+                 ('stream 64k', stream.convert_fidl_stream, { 'chunk_size': 1 << 16 }) ]
+        for (name, func, options) in runs:
+            (elapsed, peak) = measure(func, file_name, **options)
+            print(f"{name:>16} {elapsed * 1000:>9.1f} {peak / 1048576:>9.1f}")
+
+        # The peak memory of worker processes is not traced
+        start = time.perf_counter()
+        stream.convert_fidl_stream(file_name, jobs=jobs, chunk_size=1 << 18)
+        print(f"{f'stream -j {jobs}':>16} {(time.perf_counter() - start) * 1000:>9.1f}")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Compare time and peak memory of the two phase conversion
+# (parse to a lark tree, then convert_fidl_tree()) with the tree-less
+# conversion in convert_fidl_text().
+#
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import get_parser, parse_tree
+
+
+def fidl_model(type_count, method_count):
+    lines = [ "package bench", "typeCollection Types {" ]
+    for i in range(type_count):
+        lines.append(f"  struct S{i} {{ UInt32 a{i} String b{i} Boolean[] c{i} }}")
+        lines.append(f"  enumeration E{i} {{ A{i} = {i} B{i} C{i} }}")
+    lines.append("}")
+    lines.append("interface Service {")
+    for i in range(method_count):
+        lines.append(f"  method m{i} {{ in {{ UInt32 x{i} String y{i} }} out {{ Double z{i} }} }}")
+        lines.append(f"  broadcast b{i} {{ out {{ Int64 v{i} }} }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def two_phase(fidl_text):
+    return parse_tree.convert_fidl_tree(get_parser().parse(fidl_text))
+
+
+def tree_less(fidl_text):
+    return parse_tree.convert_fidl_text(fidl_text)
+
+
+def measure(func, fidl_text):
+    # Peak memory is measured on a first run. tracemalloc slows down
+    # allocation, so the time is measured on a second, untraced run.
+    tracemalloc.start()
+    func(fidl_text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    func(fidl_text)
+    return (time.perf_counter() - start, peak)
+
+
+if __name__ == "__main__":
+    # Build both parsers before measuring
+    two_phase("package warmup")
+    tree_less("package warmup")
+
+    print(f"{'decls':>7} {'mode':>10} {'time ms':>9} {'peak MB':>9}")
+    for count in (500, 1000, 2000, 4000):
+        fidl_text = fidl_model(count, count)
+        for name, func in (('two-phase', two_phase), ('tree-less', tree_less)):
+            (elapsed, peak) = measure(func, fidl_text)
+            print(f"{count*4:>7} {name:>10} {elapsed*1000:>9.1f} {peak/1048576:>9.1f}")
@@ -0,0 +1,44 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Options of the pytest-benchmark suite. The model is either given as
+# root files, whose imports are followed, or generated at the scale
+# given by the options of generate_model.py.
+#
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+scale_options = ('files', 'structs', 'enums', 'members', 'methods')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('model', "Benchmarked FIDL model")
+    group.addoption('--model-root', action='append', default=[],
+                    help="Root file of the model. Can be given more than once")
+    for name in scale_options:
+        group.addoption(f'--model-{name}', type=int, default=None,
+                        help=f"Number of {name} of the generated model, as for generate_model.py")
+
+
+@pytest.fixture(scope='session')
+def model_roots(request):
+    return request.config.getoption('--model-root')
+
+
+@pytest.fixture(scope='session')
+def model_scale(request):
+    # Options of generate_model.generate_project() given on the command line
+    res = {}
+    for name in scale_options:
+        value = request.config.getoption(f'--model-{name}')
+        if value is not None:
+            res[name] = value
+
+    return res
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Generate a synthetic multi-file FIDL model.
+#
+# File f<i>.fidl holds package gen.p<i> with type collection Types<i>
+# and interface Service<i>. It imports the type collections of files
+# i-1 and i/2, so that the last file, which is printed, imports the
+# whole model.
+#
+# Type collections hold enumerations with constant expressions,
+# enumerations and structs extending each other, and structs using
+# local and imported types. Interfaces hold methods, broadcasts and a
+# contract walking through the methods.
+#
+import getopt
+import os
+import sys
+
+
+def usage(name):
+    print(f"Usage: {name} [-f files] [-s structs] [-e enums] [-m members] [-M methods] <directory>")
+    print("  -f, --files=N      Number of files (default 10)")
+    print("  -s, --structs=N    Structs per type collection (default 20)")
+    print("  -e, --enums=N      Enumerations per type collection (default 10)")
+    print("  -m, --members=N    Members per struct (default 4)")
+    print("  -M, --methods=N    Methods and broadcasts per interface (default 20)")
+
+
+def imported_files(index):
+    return sorted(set([ j for j in (index - 1, index // 2) if 0 <= j < index ]))
+
+
+# Types are referred to by members and arguments through their base
+# types, which do not extend any other type.
+def base_enum(n, enums):
+    return 2 * (n % ((enums + 1) // 2))
+
+
+def base_struct(n, structs):
+    return 3 * (n % ((structs + 2) // 3))
+
+
+def type_collection(index, structs, enums, members):
+    lines = [ f"typeCollection Types{index} {{" ]
+
+    for k in range(enums):
+        if k % 2 == 0:
+            lines.append(f"  enumeration E{index}_{k} {{")
+        else:
+            lines.append(f"  enumeration E{index}_{k} extends E{index}_{k-1} {{")
+
+        lines.append(f"    A{k}_0 = {k}")
+        lines.append(f"    A{k}_1 = {k} * 4 + 1")
+        lines.append(f"    A{k}_2 = (1 + {k}) * 2")
+        lines.append(f"    A{k}_3")
+        lines.append("  }")
+
+    imported = [ f"S{j}_0" for j in imported_files(index) ] if structs > 0 else []
+    for k in range(structs):
+        if k % 3 == 0:
+            lines.append(f"  struct S{index}_{k} {{")
+        else:
+            lines.append(f"  struct S{index}_{k} extends S{index}_{k-1} {{")
+
+        for m in range(members):
+            kind = m % 4
+            if kind == 0:
+                lines.append(f"    UInt32 a{k}_{m}")
+            elif kind == 1:
+                lines.append(f"    String b{k}_{m}")
+            elif kind == 2 and enums > 0:
+                lines.append(f"    E{index}_{base_enum(k + m, enums)} e{k}_{m}")
+            elif kind == 3 and imported:
+                lines.append(f"    {imported[(k + m) % len(imported)]} i{k}_{m}")
+            else:
+                lines.append(f"    UInt8[] d{k}_{m}")
+
+        lines.append("  }")
+
+    lines.append("}")
+    return lines
+
+
+def interface(index, structs, enums, methods):
+    lines = [ f"interface Service{index} {{" ]
+    for k in range(methods):
+        lines.append(f"  method m{k} {{")
+        lines.append("    in {")
+        lines.append(f"      UInt32 id{k}")
+        if structs > 0:
+            lines.append(f"      Types{index}.S{index}_{base_struct(k, structs)} arg{k}")
+        lines.append("    }")
+        lines.append("    out {")
+        if enums > 0:
+            lines.append(f"      Types{index}.E{index}_{base_enum(k, enums)} status{k}")
+        lines.append(f"      Boolean ok{k}")
+        lines.append("    }")
+        lines.append("  }")
+        lines.append(f"  broadcast b{k} {{ out {{ UInt64 seq{k} String text{k} }} }}")
+
+    if methods > 0:
+        lines.append("  contract {")
+        lines.append("    PSM {")
+        lines.append("      initial s0")
+        for k in range(methods):
+            lines.append(f"      state s{k} {{")
+            lines.append(f"        on call m{k} -> w{k}")
+            lines.append(f"        on signal b{k} -> s{k}")
+            lines.append("      }")
+            lines.append(f"      state w{k} {{")
+            lines.append(f"        on respond m{k} -> s{(k + 1) % methods}")
+            lines.append(f"        on error m{k} -> s0")
+            lines.append("      }")
+        lines.append("    }")
+        lines.append("  }")
+
+    lines.append("}")
+    return lines
+
+
+def generate_file(index, structs=20, enums=10, members=4, methods=20):
+    lines = [ "// Generated by generate_model.py", f"package gen.p{index}", "" ]
+    lines.extend([ f"import gen.p{j}.Types{j}.* from \"f{j}.fidl\"" for j in imported_files(index) ])
+    lines.append("")
+    lines.extend(type_collection(index, structs, enums, members))
+    lines.append("")
+    lines.extend(interface(index, structs, enums, methods))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def generate_project(directory, files=10, structs=20, enums=10, members=4, methods=20):
+    # Returns the name of the root file, which imports all others
+    os.makedirs(directory, exist_ok=True)
+    for index in range(files):
+        with open(os.path.join(directory, f"f{index}.fidl"), "w") as f:
+            f.write(generate_file(index, structs, enums, members, methods))
+
+    return os.path.join(directory, f"f{files-1}.fidl")
+
+
+if __name__ == "__main__":
+    try:
+        options, remainder = getopt.getopt(
+            sys.argv[1:],
+            'f:s:e:m:M:',
+            ['files=', 'structs=', 'enums=', 'members=', 'methods='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage(sys.argv[0])
+        sys.exit(1)
+
+    scale = { 'files': 10, 'structs': 20, 'enums': 10, 'members': 4, 'methods': 20 }
+    names = { '-f': 'files', '-s': 'structs', '-e': 'enums', '-m': 'members', '-M': 'methods' }
+    for opt, arg in options:
+        name = names.get(opt, opt[2:])
+        try:
+            scale[name] = int(arg)
+        except ValueError:
+            scale[name] = -1
+
+        if scale[name] < 0 or (name == 'files' and scale[name] == 0):
+            print(f"Invalid {name}: {arg}")
+            sys.exit(1)
+
+    if len(remainder) != 1:
+        usage(sys.argv[0])
+        sys.exit(1)
+
+    print(generate_project(remainder[0], **scale))
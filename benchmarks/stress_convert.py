@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Convert every test case in many threads at once, with the tree-less,
+# two phase and unresolved conversions, and compare each result with
+# that of a serial conversion. Exits with status 1 on any difference.
+#
+# Usage: stress_convert.py [threads] [rounds]
+#
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fidl_parser import get_parser, parse_tree
+
+testcases = os.path.join(os.path.dirname(__file__), '..', 'testcases')
+
+
+def tree_less(fidl_text):
+    return parse_tree.convert_fidl_text(fidl_text)
+
+
+def two_phase(fidl_text):
+    return parse_tree.convert_fidl_tree(get_parser().parse(fidl_text))
+
+
+def unresolved(fidl_text):
+    return parse_tree.convert_fidl_file(fidl_text)[0]
+
+
+def records(fidl_text):
+    # Declarations passed to the declared() callback, in order
+    declarations = []
+    parse_tree.convert_fidl_text(fidl_text, declared=lambda rule, res, ns: declarations.append((rule, res)))
+    return declarations
+
+
+conversions = (tree_less, two_phase, unresolved, records)
+
+
+def convert(conversion, fidl_text):
+    # JSON text of the result, or the error
+    try:
+        return json.dumps(conversion(fidl_text))
+    except Exception as err:
+        return f"{type(err).__name__}: {err}"
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    texts = {}
+    for file_name in sorted(glob.glob(os.path.join(testcases, '**', '*.fidl'), recursive=True)):
+        with open(file_name) as f:
+            texts[os.path.relpath(file_name, testcases)] = f.read()
+
+    jobs = [ (conversion, file_name) for conversion in conversions for file_name in texts ]
+    expected = { (conversion, file_name): convert(conversion, texts[file_name]) for (conversion, file_name) in jobs }
+
+    start = time.perf_counter()
+    failures = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        work = jobs * rounds
+        results = executor.map(lambda job: convert(job[0], texts[job[1]]), work)
+        for ((conversion, file_name), res) in zip(work, results):
+            if res != expected[(conversion, file_name)]:
+                failures += 1
+                print(f"{conversion.__name__} {file_name}: differs from serial conversion")
+                print(f"  {res[:200]}")
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(work)} conversions of {len(texts)} files in {threads} threads, "
+          f"{elapsed:.2f} s, {failures} failures")
+    sys.exit(1 if failures else 0)
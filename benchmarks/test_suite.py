@@ -0,0 +1,123 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Time each phase of loading a multi-file model with pytest-benchmark,
+# and record the peak memory allocated during each phase.
+#
+#   lex      Tokenize all files with the standard lexer
+#   parse    LALR parse all files into lark trees. Includes lexing,
+#            which the LALR parser does with its contextual lexer.
+#   convert  parse_tree.convert_fidl_tree_file() on all trees
+#   resolve  Merge the namespaces of all files into a project and
+#            resolve datatypes across files
+#
+# The input of each phase is prepared outside of the timed rounds.
+# Peak memory is measured with tracemalloc in a separate untimed
+# round, since tracing slows down allocation, and is stored as
+# peak_bytes in the extra_info of the benchmark.
+#
+import gc
+import tracemalloc
+
+import lark
+import pytest
+
+from fidl_parser import get_parser, parse_tree
+from fidl_parser.project import Project
+import generate_model
+
+
+@pytest.fixture(scope='module')
+def texts(model_roots, model_scale, tmp_path_factory):
+    # File name -> FIDL text for all files of the model
+    root_files = model_roots
+    if not root_files:
+        root_files = [ generate_model.generate_project(str(tmp_path_factory.mktemp('model')), **model_scale) ]
+
+    project = Project(root_files, workers=1)
+    project.load()
+    res = {}
+    for file_name in project.files:
+        with open(file_name) as f:
+            res[file_name] = f.read()
+
+    return res
+
+
+@pytest.fixture(scope='module')
+def lark_parser():
+    return get_parser()
+
+
+def peak_bytes(func, *args):
+    # Peak memory allocated by func(*args) on top of what was allocated
+    # before the call
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def run(benchmark, texts, func, setup=None, rounds=3):
+    # Time func, called with the arguments returned by setup, if given,
+    # which is run before each round
+    benchmark.extra_info['files'] = len(texts)
+    benchmark.extra_info['bytes'] = sum(len(text) for text in texts.values())
+    if setup is None:
+        benchmark.extra_info['peak_bytes'] = peak_bytes(func)
+        return benchmark.pedantic(func, rounds=rounds)
+
+    benchmark.extra_info['peak_bytes'] = peak_bytes(func, *setup())
+    return benchmark.pedantic(func, setup=lambda: (setup(), {}), rounds=rounds)
+
+
+def lex(lexer, texts):
+    for text in texts.values():
+        list(lark.lexer.LexerThread(lexer, text).lex(None))
+
+
+def parse(lark_parser, texts):
+    return { file_name: lark_parser.parse(text) for (file_name, text) in texts.items() }
+
+
+def convert(trees):
+    return { file_name: parse_tree.convert_fidl_tree_file(tree) for (file_name, tree) in trees.items() }
+
+
+def resolve(converted):
+    project = Project(list(converted))
+    for (file_name, result) in converted.items():
+        project.add_file(file_name, result)
+
+    project.resolve()
+    return project
+
+
+def test_lex(benchmark, lark_parser, texts):
+    # Lark.lex() builds a new lexer on each call with the
+    # contextual lexer used by the parser. Build it once.
+    lexer = lark_parser._build_lexer()
+    run(benchmark, texts, lambda: lex(lexer, texts))
+
+
+def test_parse(benchmark, lark_parser, texts):
+    trees = run(benchmark, texts, lambda: parse(lark_parser, texts))
+    assert len(trees) == len(texts)
+
+
+def test_convert(benchmark, lark_parser, texts):
+    converted = run(benchmark, texts, convert, setup=lambda: (parse(lark_parser, texts),))
+    assert len(converted) == len(texts)
+
+
+def test_resolve(benchmark, lark_parser, texts):
+    # Resolving changes the converted results, so each round gets its own
+    project = run(benchmark, texts, resolve, setup=lambda: (convert(parse(lark_parser, texts)),))
+    assert len(project.files) == len(texts)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import getopt
+import sys
+from fidl_parser.project import Project
+from fidl_parser.cache import ParseCache
+from fidl_parser.daemon import Daemon
+from fidl_parser import watcher
+
+def usage(name):
+    print(f"Usage: {name} [-S socket] [-p] [-j jobs] <root-idl-file> ...")
+    print("  -S, --socket=PATH  Answer queries on a unix domain socket instead of stdio")
+    print("  -p, --poll         Poll for file changes instead of using inotify")
+    print("  -I, --interval=S   Seconds between polls (default 0.5)")
+    print("  -j, --jobs=N       Load the project in N worker processes")
+    print("  -c, --no-cache     Do not use the conversion cache")
+
+if __name__ == "__main__":
+    try:
+        options, remainder = getopt.getopt(
+            sys.argv[1:],
+            'S:pI:j:c',
+            ['socket=', 'poll', 'interval=', 'jobs=', 'no-cache'])
+    except getopt.GetoptError as err:
+        print(err)
+        usage(sys.argv[0])
+        sys.exit(1)
+
+    socket_path = None
+    polling = False
+    interval = 0.5
+    jobs = None
+    cache = ParseCache()
+    for opt, arg in options:
+        if opt in ('-S', '--socket'):
+            socket_path = arg
+        elif opt in ('-p', '--poll'):
+            polling = True
+        elif opt in ('-I', '--interval'):
+            try:
+                interval = float(arg)
+            except ValueError:
+                interval = 0
+
+            if interval <= 0:
+                print(f"Invalid interval: {arg}")
+                sys.exit(255)
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                jobs = 0
+
+            if jobs < 1:
+                print(f"Invalid number of jobs: {arg}")
+                usage(sys.argv[0])
+                sys.exit(255)
+        elif opt in ('-c', '--no-cache'):
+            cache = None
+
+    if len(remainder) < 1:
+        print("\nMising filename")
+        usage(sys.argv[0])
+        sys.exit(255)
+
+    project = Project(remainder, workers=jobs, cache=cache).load()
+    daemon = Daemon(project, watcher.create_watcher(polling, interval))
+    print(f"Loaded {len(project.files)} files", file=sys.stderr)
+
+    try:
+        if socket_path is not None:
+            daemon.serve_socket(socket_path)
+        else:
+            daemon.serve_stdio()
+    except KeyboardInterrupt:
+        pass
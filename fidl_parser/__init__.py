@@ -0,0 +1 @@
+from .parser import get_parser
@@ -0,0 +1,192 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Conversion cache
+#
+#  Stores the result of parse_tree.convert_fidl_file() on disk, keyed
+#  by a hash of the file content and of the converter version. The
+#  converter version covers the grammar, the sources of all modules
+#  used by the conversion and the lark version, so that any change to
+#  them invalidates the cache.
+#
+#  Entries are pickled and compressed. The cache is capped in size.
+#  evict() removes the least recently used entries until the cache is
+#  below its cap, using the file modification time, which is updated
+#  on every hit.
+#
+import hashlib
+import os
+import pickle
+import zlib
+import lark
+from . import comment
+from . import contract
+from . import diagnostics
+from . import expression
+from . import parse_tree
+from . import parser
+from . import usage
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Modules whose sources are part of the converter version
+converter_modules = (parse_tree, parse_tree.type_manager, parser, diagnostics, expression, comment, usage, contract)
+
+_converter_version = None
+
+
+def converter_version() -> str:
+    global _converter_version
+    if _converter_version is not None:
+        return _converter_version
+
+    version = hashlib.sha256()
+    version.update(parser.grammar_text().encode('utf-8'))
+    for module in converter_modules:
+        with open(module.__file__, 'rb') as f:
+            version.update(f.read())
+    version.update(lark.__version__.encode('utf-8'))
+
+    _converter_version = version.hexdigest()
+    return _converter_version
+
+
+class ParseCache:
+    def __init__(self, directory: str = None, max_size: int = DEFAULT_MAX_SIZE):
+        # An empty directory disables the cache
+        if directory is None:
+            directory = parser.cache_dir()
+            if directory:
+                directory = os.path.join(directory, 'models')
+
+        self._directory = directory
+        self._max_size = max_size
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    def count(self, hit: bool):
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+
+    def key(self, fidl_bytes: bytes) -> str:
+        key = hashlib.sha256(converter_version().encode('utf-8'))
+        key.update(fidl_bytes)
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, f"{key}.model")
+
+    def load(self, key):
+        if not self._directory:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            res = pickle.loads(zlib.decompress(data))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return res
+
+    def store(self, key, value):
+        if not self._directory:
+            return None
+
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return None
+
+    def evict(self):
+        if not self._directory or not os.path.isdir(self._directory):
+            return None
+
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith('.model'):
+                continue
+
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        # Remove least recently used entries first
+        entries.sort()
+        for (_, size, path) in entries:
+            if total_size <= self._max_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total_size -= size
+            self._evictions += 1
+
+        return None
+
+    def lookup(self, fidl_bytes: bytes):
+        # Returns if the result was found in the cache, and the result
+        # of parse_tree.convert_fidl_file(). Does not count hits and
+        # misses, which lets worker processes report them through count().
+        key = self.key(fidl_bytes)
+        res = self.load(key)
+        if res is not None:
+            return (True, res)
+
+        res = parse_tree.convert_fidl_file(fidl_bytes.decode('utf-8'))
+        self.store(key, res)
+        return (False, res)
+
+    def convert_fidl_file(self, fidl_bytes: bytes):
+        # Same as parse_tree.convert_fidl_file(), using the cache
+        (hit, res) = self.lookup(fidl_bytes)
+        self.count(hit)
+        return res
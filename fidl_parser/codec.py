@@ -0,0 +1,563 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Binary wire codecs
+#
+#  CodecGenerator computes the wire layout of each resolved datatype
+#  returned by the converter once, and generates pack and unpack
+#  functions for it. The functions use precompiled struct.Struct
+#  objects and do not look at the converted dictionaries again.
+#
+#  The wire format is little endian:
+#
+#  - Native integers, floats and booleans have their C size and are
+#    aligned to it. Integer(min, max) is the smallest native integer
+#    holding the range. Enumerations are Int32.
+#  - A struct whose members all have a fixed size is laid out as a C
+#    struct, with padding, and with its size rounded up to its
+#    alignment. Inherited members come first.
+#  - Other structs are the sequence of their members. Consecutive fixed
+#    size members are laid out together as a C struct.
+#  - Strings, in UTF-8, and byte buffers are a UInt32 byte count
+#    followed by the bytes.
+#  - Arrays are a UInt32 element count followed by the elements.
+#  - Unions are the UInt32 index of the member, counting inherited
+#    members first, followed by the member.
+#
+#  Values are dictionaries, lists and native Python values. A union
+#  value is a dictionary with the name of its member as single key.
+#  Arrays of native numbers are packed and unpacked in bulk, and are
+#  unpacked to array.array. With zero_copy, on little endian hosts,
+#  they are unpacked to memoryview objects over the unpacked buffer.
+#
+import array
+import struct
+import sys
+from .expression import native_ranges
+from .parse_tree import declarations, type_token_names
+
+# struct codes of the native datatypes with a fixed size
+wire_codes = {
+    'int8': 'b',
+    'uint8': 'B',
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'int64': 'q',
+    'uint64': 'Q',
+    'float': 'f',
+    'double': 'd',
+    'boolean': '?',
+}
+
+# Native datatypes with a variable size
+variable_datatypes = frozenset([ 'string', 'binary' ])
+
+if set(wire_codes) | variable_datatypes != set(type_token_names.values()):
+    raise Exception("Wire codes do not match the native datatypes of the converter")
+
+# Codes that array.array stores with the same size as struct
+bulk_codes = frozenset([ code for code in wire_codes.values()
+                         if code != '?' and array.array(code).itemsize == struct.calcsize(f"<{code}") ])
+
+swap_bytes = sys.byteorder != 'little'
+
+count = struct.Struct('<I')
+
+
+#
+# Helpers called by the generated functions
+#
+def pack_string(value):
+    data = value.encode('utf-8')
+    return count.pack(len(data)) + data
+
+
+def unpack_string(buf, offset):
+    (length,) = count.unpack_from(buf, offset)
+    offset += 4
+    return (str(buf[offset:offset + length], 'utf-8'), offset + length)
+
+
+def pack_binary(value):
+    return count.pack(len(value)) + bytes(value)
+
+
+def unpack_binary(buf, offset):
+    (length,) = count.unpack_from(buf, offset)
+    offset += 4
+    return (bytes(buf[offset:offset + length]), offset + length)
+
+
+def pack_native_array(code, value):
+    data = array.array(code, value)
+    if swap_bytes:
+        data.byteswap()
+
+    return count.pack(len(data)) + data.tobytes()
+
+
+def unpack_native_array(code, size, buf, offset):
+    (length,) = count.unpack_from(buf, offset)
+    offset += 4
+    end = offset + length * size
+    res = array.array(code)
+    res.frombytes(memoryview(buf)[offset:end])
+    if swap_bytes:
+        res.byteswap()
+
+    return (res, end)
+
+
+def view_native_array(code, size, buf, offset):
+    (length,) = count.unpack_from(buf, offset)
+    offset += 4
+    end = offset + length * size
+    return (memoryview(buf)[offset:end].cast(code), end)
+
+
+class Layout:
+    # Wire layout of a type. size and align are None for layouts
+    # with a variable size.
+    __slots__ = ('kind', 'name', 'size', 'align', 'code', 'fields', 'element', 'pack_name', 'unpack_name')
+
+    def __init__(self, kind, name, size=None, align=None):
+        # native, string, binary, struct, union or array
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.align = align
+
+        # struct code of native layouts
+        self.code = None
+
+        # [ (name, layout, offset) ] of structs and unions. The offset
+        # is None for layouts with a variable size.
+        self.fields = None
+
+        # Element layout of arrays
+        self.element = None
+
+        # Names of the generated functions
+        self.pack_name = None
+        self.unpack_name = None
+
+    @property
+    def fixed(self):
+        return self.size is not None
+
+    def __repr__(self):
+        return f"Layout({self.kind} {self.name} size={self.size})"
+
+
+def align_up(offset, align):
+    return (offset + align - 1) // align * align
+
+
+def place(name, fields):
+    # Fixed size struct layout of [ (name, layout) ]
+    layout = Layout('struct', name)
+    layout.fields = []
+    offset = 0
+    align = 1
+    for (field_name, field) in fields:
+        offset = align_up(offset, field.align)
+        layout.fields.append((field_name, field, offset))
+        offset += field.size
+        align = max(align, field.align)
+
+    layout.size = align_up(offset, align)
+    layout.align = align
+    return layout
+
+
+def fixed_format(layout):
+    # struct format, and value paths, of a fixed size layout
+    if layout.kind == 'native':
+        return (layout.code, [ () ])
+
+    formats = []
+    paths = []
+    position = 0
+    for (name, field, offset) in layout.fields:
+        if offset > position:
+            formats.append(f"{offset - position}x")
+
+        (field_format, field_paths) = fixed_format(field)
+        formats.append(field_format)
+        paths.extend([ (name,) + path for path in field_paths ])
+        position = offset + field.size
+
+    if layout.size > position:
+        formats.append(f"{layout.size - position}x")
+
+    return (''.join(formats), paths)
+
+
+def path_expression(var, path):
+    return var + ''.join([ f"[{name!r}]" for name in path ])
+
+
+def value_expression(layout, names):
+    # Expression building the value of a fixed size layout
+    # from the unpacked variables in names
+    if layout.kind == 'native':
+        return next(names)
+
+    return "{ " + ", ".join([ f"{name!r}: {value_expression(field, names)}"
+                              for (name, field, _) in layout.fields ]) + " }"
+
+
+def variable_names(start, length):
+    return [ f"_{i}" for i in range(start, start + length) ]
+
+
+def unpack_target(names):
+    # Tuple target for struct.unpack_from()
+    return f"({', '.join(names)},)"
+
+
+class Codec:
+    def __init__(self, name, layout, pack, unpack_from):
+        self._name = name
+        self._layout = layout
+
+        # The generated functions are called directly
+        self.pack = pack
+        self.unpack_from = unpack_from
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def size(self):
+        # Size of a packed value, or None if it varies
+        return self._layout.size
+
+    def unpack(self, buf):
+        (value, end) = self.unpack_from(buf, 0)
+        if end != len(buf):
+            raise Exception(f"{len(buf) - end} bytes left after unpacking {self._name}")
+
+        return value
+
+
+class CodecGenerator:
+    def __init__(self, zero_copy: bool = False):
+        self._zero_copy = zero_copy and not swap_bytes
+
+        # id(datatype dictionary) -> (dictionary, layout)
+        self._layouts = {}
+        self._natives = {}
+        # id(element layout) -> array layout
+        self._arrays = {}
+
+        # Globals of the generated functions
+        self._namespace = {
+            'count': count,
+            'pack_string': pack_string,
+            'unpack_string': unpack_string,
+            'pack_binary': pack_binary,
+            'unpack_binary': unpack_binary,
+            'pack_native_array': pack_native_array,
+            'unpack_native_array': view_native_array if self._zero_copy else unpack_native_array,
+        }
+        self._function_count = 0
+        self._pending = []
+
+    #
+    # Layouts
+    #
+    def native(self, datatype):
+        layout = self._natives.get(datatype)
+        if layout is not None:
+            return layout
+
+        if datatype in variable_datatypes:
+            layout = Layout(datatype, datatype)
+        elif datatype in wire_codes:
+            size = struct.calcsize(f"<{wire_codes[datatype]}")
+            layout = Layout('native', datatype, size, size)
+            layout.code = wire_codes[datatype]
+        else:
+            raise Exception(f"No wire layout for datatype {datatype}")
+
+        self._natives[datatype] = layout
+        return layout
+
+    def integer_range(self, range):
+        # Smallest native integer holding range
+        for datatype in ('uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32', 'uint64', 'int64'):
+            (min_range, max_range) = native_ranges[datatype]
+            if min_range <= range['min_range'] and range['max_range'] <= max_range:
+                return self.native(datatype)
+
+        raise Exception(f"No native integer for range [{range['min_range']}, {range['max_range']}]")
+
+    def array(self, element):
+        layout = self._arrays.get(id(element))
+        if layout is None:
+            layout = self._arrays[id(element)] = Layout('array', f"{element.name}[]")
+            layout.element = element
+
+        return layout
+
+    def reference(self, dict_tree):
+        # Layout of the datatype of a member, typedef or array
+        if 'range' in dict_tree:
+            layout = self.integer_range(dict_tree['range'])
+        else:
+            resolved = dict_tree.get('_resolved_datatype')
+            if resolved is None:
+                raise Exception(f"Datatype of {dict_tree.get('name')} is not resolved")
+
+            layout = self.native(resolved) if isinstance(resolved, str) else self.layout(resolved)
+
+        if dict_tree.get('array_size') is not None:
+            layout = self.array(layout)
+
+        return layout
+
+    def layout(self, dict_tree):
+        # Layout of a datatype dictionary returned by the converter
+        entry = self._layouts.get(id(dict_tree))
+        if entry is not None:
+            return entry[1]
+
+        type_tag = dict_tree.get('type')
+        if type_tag == 'enumeration':
+            layout = self.native('int32')
+        elif type_tag in ('struct', 'union') and 'members' in dict_tree:
+            layout = self._compound(dict_tree)
+        elif type_tag is None or type_tag == 'union':
+            # Arrays, and typedefs that the converter tags as unions
+            layout = self.reference(dict_tree)
+        else:
+            raise Exception(f"No wire layout for {type_tag} {dict_tree.get('name')}")
+
+        self._layouts[id(dict_tree)] = (dict_tree, layout)
+        return layout
+
+    def _compound(self, dict_tree):
+        # Registered before the members, for types that refer
+        # to themselves through arrays
+        layout = Layout(dict_tree['type'], dict_tree['name'])
+        self._layouts[id(dict_tree)] = (dict_tree, layout)
+
+        members = []
+        base = dict_tree
+        while base is not None:
+            members[0:0] = base['members']
+            base = base.get('_resolved_extends')
+
+        fields = [ (member['name'], self.reference(member)) for member in members ]
+        if layout.kind == 'struct' and all([ field.fixed for (_, field) in fields ]):
+            placed = place(layout.name, fields)
+            (layout.fields, layout.size, layout.align) = (placed.fields, placed.size, placed.align)
+        else:
+            layout.fields = [ (name, field, None) for (name, field) in fields ]
+
+        return layout
+
+    #
+    # Generated functions
+    #
+    def _names(self, layout):
+        # Names of the pack and unpack functions of layout
+        if layout.pack_name is None:
+            if layout.kind in variable_datatypes:
+                (layout.pack_name, layout.unpack_name) = (f"pack_{layout.kind}", f"unpack_{layout.kind}")
+            else:
+                self._function_count += 1
+                layout.pack_name = f"_pack_{self._function_count}"
+                layout.unpack_name = f"_unpack_{self._function_count}"
+                self._pending.append(layout)
+
+        return (layout.pack_name, layout.unpack_name)
+
+    def _struct(self, format):
+        self._function_count += 1
+        struct_name = f"_struct_{self._function_count}"
+        self._namespace[struct_name] = struct.Struct(f"<{format}")
+        return struct_name
+
+    def _fixed_source(self, layout):
+        (pack_name, unpack_name) = self._names(layout)
+        (format, paths) = fixed_format(layout)
+        struct_name = self._struct(format)
+        names = variable_names(0, len(paths))
+        return [
+            f"def {pack_name}(v):",
+            f"    return {struct_name}.pack({', '.join([ path_expression('v', path) for path in paths ])})",
+            f"def {unpack_name}(buf, offset):",
+            f"    {unpack_target(names)} = {struct_name}.unpack_from(buf, offset)",
+            f"    return ({value_expression(layout, iter(names))}, offset + {layout.size})",
+        ]
+
+    def _struct_source(self, layout):
+        # Struct with members of variable size. Consecutive fixed size
+        # members are packed as one block.
+        (pack_name, unpack_name) = self._names(layout)
+        pack_parts = []
+        unpack_lines = []
+        values = []
+        variable_count = 0
+        block = []
+
+        def end_block():
+            nonlocal variable_count
+            if not block:
+                return None
+
+            placed = place(layout.name, block)
+            (format, paths) = fixed_format(placed)
+            struct_name = self._struct(format)
+            names = variable_names(variable_count, len(paths))
+            variable_count += len(paths)
+            pack_parts.append(f"{struct_name}.pack({', '.join([ path_expression('v', path) for path in paths ])})")
+            unpack_lines.append(f"    {unpack_target(names)} = {struct_name}.unpack_from(buf, offset)")
+            unpack_lines.append(f"    offset += {placed.size}")
+            names = iter(names)
+            values.extend([ (name, value_expression(field, names)) for (name, field, _) in placed.fields ])
+            block.clear()
+            return None
+
+        for (name, field, _) in layout.fields:
+            if field.fixed:
+                block.append((name, field))
+                continue
+
+            end_block()
+            (field_pack, field_unpack) = self._names(field)
+            value_name = f"_{variable_count}"
+            variable_count += 1
+            pack_parts.append(f"{field_pack}({path_expression('v', (name,))})")
+            unpack_lines.append(f"    ({value_name}, offset) = {field_unpack}(buf, offset)")
+            values.append((name, value_name))
+
+        end_block()
+        value = "{ " + ", ".join([ f"{name!r}: {expr}" for (name, expr) in values ]) + " }"
+        return [
+            f"def {pack_name}(v):",
+            f"    return b''.join([ {', '.join(pack_parts)} ])",
+            f"def {unpack_name}(buf, offset):",
+        ] + unpack_lines + [
+            f"    return ({value}, offset)",
+        ]
+
+    def _union_source(self, layout):
+        (pack_name, unpack_name) = self._names(layout)
+        pack_lines = []
+        unpack_lines = []
+        for (index, (name, field, _)) in enumerate(layout.fields):
+            (field_pack, field_unpack) = self._names(field)
+            pack_lines.extend([
+                f"    if name == {name!r}:",
+                f"        return count.pack({index}) + {field_pack}(value)",
+            ])
+            unpack_lines.extend([
+                f"    if index == {index}:",
+                f"        (value, offset) = {field_unpack}(buf, offset)",
+                f"        return ({{ {name!r}: value }}, offset)",
+            ])
+
+        return [
+            f"def {pack_name}(v):",
+            "    ((name, value),) = v.items()",
+        ] + pack_lines + [
+            f"    raise Exception(f\"Unknown member {{name}} of union {layout.name}\")",
+            f"def {unpack_name}(buf, offset):",
+            "    (index,) = count.unpack_from(buf, offset)",
+            "    offset += 4",
+        ] + unpack_lines + [
+            f"    raise Exception(f\"Unknown member index {{index}} of union {layout.name}\")",
+        ]
+
+    def _array_source(self, layout):
+        (pack_name, unpack_name) = self._names(layout)
+        element = layout.element
+        if element.kind == 'native' and element.code in bulk_codes:
+            return [
+                f"def {pack_name}(v):",
+                f"    return pack_native_array({element.code!r}, v)",
+                f"def {unpack_name}(buf, offset):",
+                f"    return unpack_native_array({element.code!r}, {element.size}, buf, offset)",
+            ]
+
+        if element.fixed:
+            (format, paths) = fixed_format(element)
+            struct_name = self._struct(format)
+            names = variable_names(0, len(paths))
+            return [
+                f"def {pack_name}(v):",
+                f"    return count.pack(len(v)) + b''.join([ {struct_name}.pack("
+                f"{', '.join([ path_expression('e', path) for path in paths ])}) for e in v ])",
+                f"def {unpack_name}(buf, offset):",
+                "    (length,) = count.unpack_from(buf, offset)",
+                "    offset += 4",
+                f"    end = offset + length * {element.size}",
+                f"    return ([ {value_expression(element, iter(names))} for {unpack_target(names)} in "
+                f"{struct_name}.iter_unpack(memoryview(buf)[offset:end]) ], end)",
+            ]
+
+        (element_pack, element_unpack) = self._names(element)
+        return [
+            f"def {pack_name}(v):",
+            f"    return count.pack(len(v)) + b''.join([ {element_pack}(e) for e in v ])",
+            f"def {unpack_name}(buf, offset):",
+            "    (length,) = count.unpack_from(buf, offset)",
+            "    offset += 4",
+            "    res = []",
+            "    for _ in range(length):",
+            f"        (e, offset) = {element_unpack}(buf, offset)",
+            "        res.append(e)",
+            "    return (res, offset)",
+        ]
+
+    def _generate(self):
+        lines = []
+        while self._pending:
+            layout = self._pending.pop()
+            if layout.fixed:
+                lines.extend(self._fixed_source(layout))
+            elif layout.kind == 'struct':
+                lines.extend(self._struct_source(layout))
+            elif layout.kind == 'union':
+                lines.extend(self._union_source(layout))
+            else:
+                lines.extend(self._array_source(layout))
+
+        if lines:
+            exec(compile("\n".join(lines) + "\n", "<fidl codecs>", 'exec'), self._namespace)
+
+        return None
+
+    def codec(self, dict_tree, name=None) -> Codec:
+        # Codec for a datatype dictionary returned by the converter
+        layout = self.layout(dict_tree)
+        (pack_name, unpack_name) = self._names(layout)
+        self._generate()
+        return Codec(name if name is not None else layout.name, layout,
+                     self._namespace[pack_name], self._namespace[unpack_name])
+
+
+def create_codecs(result: dict, zero_copy: bool = False) -> dict:
+    # Codec for each struct, union, enumeration, typedef and array of
+    # the type collections of a resolved result, by "Collection.Type"
+    generator = CodecGenerator(zero_copy)
+    return { f"{collection['name']}.{datatype['name']}":
+             generator.codec(datatype, f"{collection['name']}.{datatype['name']}")
+             for collection in declarations(result, 'types')
+             for datatype in collection['datatypes']
+             if datatype.get('type') not in ('map', 'constant') }
@@ -0,0 +1,152 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Structured comments
+#
+#  The lexer matches a structured comment <** ... **> as a single
+#  FIDL_STRUCTURED_COMMENT token, which is ignored by the parser. The
+#  parser passes each of these tokens to lexed(), which adds it to the
+#  CommentIndex of the conversion in progress, if any.
+#
+#  While converting, a comment is attached to the declaration that
+#  follows it, as the 'comment' entry of the converted dictionary.
+#  Only whitespace, ordinary comments and the keywords of the
+#  declaration may be between the two:
+#
+#    <** @description: A method **>
+#    method callme { ... }
+#
+#  Each comment is attached to a single declaration. Comments that do
+#  not precede a declaration are dropped.
+#
+#  A Comment is the text between <** and **>. Its tags are parsed when
+#  first read.
+#
+import bisect
+import contextvars
+import re
+
+# Whitespace and comments between a structured comment and the
+# declaration it is attached to. The alternatives start with different
+# characters, whitespace is matched one character at a time, and a
+# line comment always extends to the end of its line, so that a failed
+# match backtracks in linear time.
+_gap = r'(?:\s|//[^\n]*(?![^\n])|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/|<\*\*[^*]*(?:\*(?!\*>)[^*]*)*\*\*>)*'
+
+_keywords = '|'.join([ 'interface', 'typeCollection', 'struct', 'union', 'enumeration', 'map',
+                       'typedef', 'array', 'const', 'method', 'broadcast', 'attribute' ])
+
+# Text from the end of a comment to the first token of a declaration
+declaration_header = re.compile(f"{_gap}(?:(?:{_keywords}){_gap})?(?:Integer{_gap}(?:\\({_gap})?)?")
+
+# Text from the end of a comment to the first token of a method error,
+# an enumeration name or the first error enumerator
+error_header = re.compile(f"{_gap}error{_gap}(?:\\{{{_gap})?")
+
+# Start of a tag, at the start of the comment or after whitespace
+_tag = re.compile(r'(?:^|(?<=\s))@([A-Za-z_]\w*)\s*:?')
+
+
+def parse_tags(text: str) -> list:
+    # (tag, value) tuples of a comment text. The lines of a value are
+    # stripped. Text before the first tag is returned with tag None.
+    parts = _tag.split(text)
+    tags = [ (None, parts[0]) ] + list(zip(parts[1::2], parts[2::2]))
+    return [ (tag, '\n'.join([ line.strip() for line in value.strip().splitlines() ]))
+             for (tag, value) in tags
+             if tag is not None or value.strip() ]
+
+
+class Comment(str):
+    # Text of a structured comment, without its delimiters
+
+    @property
+    def tags(self) -> list:
+        # (tag, value) tuples, in order
+        tags = self.__dict__.get('_tags')
+        if tags is None:
+            tags = self.__dict__['_tags'] = parse_tags(self)
+
+        return tags
+
+    def tag(self, name: str):
+        # Value of the first tag with name, or None
+        for (tag, value) in self.tags:
+            if tag == name:
+                return value
+
+        return None
+
+    @property
+    def description(self):
+        return self.tag('description')
+
+
+class CommentIndex:
+    def __init__(self, text: str):
+        self._text = text
+        # Comment tokens and their end positions, in file order
+        self._tokens = []
+        self._ends = []
+        self._taken = set()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def add(self, token):
+        # Tokens of ignored terminals have no end position
+        self._tokens.append(token)
+        self._ends.append(token.start_pos + len(token.value))
+
+    def take(self, position: int, header=declaration_header):
+        # The last comment not yet taken that ends before position,
+        # with only a text matching header between the two, or None
+        index = bisect.bisect_right(self._ends, position)
+        while index > 0:
+            index -= 1
+            if index in self._taken:
+                continue
+
+            if header.fullmatch(self._text, self._ends[index], position) is None:
+                return None
+
+            self._taken.add(index)
+            return Comment(self._tokens[index].value[3:-3].strip())
+
+        return None
+
+
+# CommentIndex of the conversion in progress in the current thread or
+# asyncio task
+current_comments = contextvars.ContextVar('current_comments', default=None)
+
+
+def lexed(token):
+    # Lexer callback for FIDL_STRUCTURED_COMMENT
+    comments = current_comments.get()
+    if comments is not None:
+        comments.add(token)
+
+    return token
+
+
+def parse(lark_parser, fidl_text: str, profiler=None):
+    # Parse fidl_text with lark_parser. Returns the tree and the
+    # CommentIndex to pass to parse_tree.convert_fidl_tree().
+    # The parse is timed by profiler, a profile.Profiler, if given.
+    comments = CommentIndex(fidl_text)
+    collecting = current_comments.set(comments)
+    try:
+        if profiler is None:
+            tree = lark_parser.parse(fidl_text)
+        else:
+            tree = profiler.parse(lark_parser, fidl_text)
+    finally:
+        current_comments.reset(collecting)
+
+    return (tree, comments)
@@ -0,0 +1,395 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Contract state machines
+#
+#  compile_contract() compiles the PSM of the contract of a resolved
+#  interface into a StateMachine. The events of the machine are the
+#  triggers of all elements of the interface, inherited ones first:
+#
+#    "call m1", "respond m1", "error m1"   for method m1
+#    "call m1:a", ...                      for method m1 with selector a
+#    "signal b1"                           for broadcast b1
+#    "set attr"                            for attribute attr
+#
+#  The transitions are compiled into a dense table of integers with a
+#  row of one entry per event for each state. An entry is the index of
+#  the target state, REJECT if the event is not allowed in the state,
+#  or the index of a list of guarded transitions, encoded as -2 - index.
+#
+#  Guards are compiled once, when the machine is compiled. Names of
+#  constants and enumerators, and errordef.Enumerator for the error
+#  enumeration of the method of an error transition, are replaced by
+#  their values. The remaining names are contract variables, arguments
+#  of the event, and errorval for error transitions. They are looked
+#  up in the values of the event, and in the variables of the checker.
+#  Enumerators without a value are numbered as in C.
+#
+#  TraceChecker validates a trace of event ids against the table. An
+#  event of a guarded transition is given as (event id, values). Events
+#  without a guard cost a single table lookup. Transition actions are
+#  not executed.
+#
+import array
+from .expression import build, named_value, uses_names
+from .parse_tree import declarations
+
+REJECT = -1
+
+
+def enumerator_values(enumeration: dict) -> dict:
+    # Enumerator name -> value, for a resolved enumeration dictionary
+    chain = []
+    while enumeration is not None:
+        chain.append(enumeration)
+        enumeration = enumeration.get('_resolved_extends')
+
+    values = {}
+    value = -1
+    for enumeration in reversed(chain):
+        for member in enumeration['members']:
+            value = member['value'] if member.get('value') is not None else value + 1
+            values[member['name']] = value
+
+    return values
+
+
+def error_enumeration(method: dict):
+    # Resolved error enumeration of a method dictionary, or None
+    error = method.get('error')
+    while isinstance(error, dict) and error.get('type') != 'enumeration':
+        error = error.get('_resolved_datatype')
+
+    return error if isinstance(error, dict) else None
+
+
+def element_name(element: dict) -> str:
+    if element.get('selector') is not None:
+        return f"{element['name']}:{element['selector']}"
+
+    return element['name']
+
+
+def argument_names(args) -> tuple:
+    if args is None:
+        return ()
+
+    return tuple([ member['name'] for member in args['members'] ])
+
+
+def interface_events(interface: dict) -> dict:
+    # Event name -> (names of the event values, error enumeration) for
+    # all elements of a resolved interface, inherited ones first
+    chain = []
+    while interface is not None:
+        chain.append(interface)
+        interface = interface.get('_resolved_extends')
+
+    events = {}
+    for interface in reversed(chain):
+        for method in interface.get('methods', []):
+            name = element_name(method)
+            events[f"call {name}"] = (argument_names(method.get('in')), None)
+            events[f"respond {name}"] = (argument_names(method.get('out')), None)
+            events[f"error {name}"] = (('errorval',), error_enumeration(method))
+
+        for broadcast in interface.get('events', []):
+            events[f"signal {element_name(broadcast)}"] = (argument_names(broadcast.get('out')), None)
+
+        for attribute in interface.get('attributes', []):
+            events[f"set {attribute['name']}"] = ((attribute['name'],), None)
+
+    return events
+
+
+def fold(node, value_of):
+    # Replace the name nodes of node for which value_of(name) returns
+    # a node, typically a constant node
+    kind = node[0]
+    if kind == 'const':
+        return node
+
+    if kind == 'name':
+        return value_of(node[1])
+
+    if kind == 'struct':
+        return ('struct', tuple([ (field, fold(field_node, value_of)) for (field, field_node) in node[1] ]))
+
+    if kind == 'array':
+        return ('array', tuple([ fold(elem_node, value_of) for elem_node in node[1] ]))
+
+    return (kind,) + tuple([ fold(operand, value_of) for operand in node[1:] ])
+
+
+class StateMachine:
+    def __init__(self, name: str, contract: dict, events: dict):
+        # events is returned by interface_events()
+        self._name = name
+        self._events = list(events)
+        self._event_ids = { event: event_id for (event_id, event) in enumerate(self._events) }
+        self._states = [ state['name'] for state in contract.get('states', []) ]
+        self._state_ids = { state: state_id for (state_id, state) in enumerate(self._states) }
+        if len(self._state_ids) != len(self._states):
+            raise Exception(f"Duplicate state in contract of {name}")
+
+        if not self._states:
+            raise Exception(f"No states in contract of {name}")
+
+        initial = contract.get('initial', self._states[0])
+        if initial not in self._state_ids:
+            raise Exception(f"Unknown initial state {initial} in contract of {name}")
+
+        self._initial = self._state_ids[initial]
+        self._variables = [ variable['name'] for variable in contract.get('variables', []) ]
+
+        # Guarded transitions, as lists of (guard function or None, target state)
+        self._guarded = []
+        width = len(self._events)
+        self._table = array.array('i', [ REJECT ]) * (len(self._states) * width)
+        for (state_id, state) in enumerate(contract.get('states', [])):
+            transitions = {}
+            for transition in state.get('transitions', []):
+                event = f"{transition['trigger']} {element_name(transition)}"
+                if event not in self._event_ids:
+                    raise Exception(f"Unknown event {event} in state {state['name']} of contract of {name}")
+
+                target = transition['target']
+                if target not in self._state_ids:
+                    raise Exception(f"Unknown target state {target} in state {state['name']} of contract of {name}")
+
+                guard = None
+                if transition.get('guard') is not None:
+                    guard = self._compile_guard(transition['guard'], event, events[event])
+
+                # Transitions that never hold, or follow one that always
+                # holds, are dropped
+                targets = transitions.setdefault(event, [])
+                if guard is not False and not (targets and targets[-1][0] is None):
+                    targets.append((guard, self._state_ids[target]))
+
+            for (event, targets) in transitions.items():
+                if not targets:
+                    continue
+
+                entry = state_id * width + self._event_ids[event]
+                if len(targets) == 1 and targets[0][0] is None:
+                    self._table[entry] = targets[0][1]
+                    continue
+
+                self._table[entry] = -2 - len(self._guarded)
+                self._guarded.append(targets)
+
+        # The table with row offsets instead of state indexes, for
+        # the checkers
+        self._offsets = [ entry * width if entry >= 0 else entry for entry in self._table ]
+
+    def _compile_guard(self, guard, event, event_info):
+        (value_names, errors) = event_info
+        runtime_names = frozenset(self._variables) | frozenset(value_names)
+
+        def value_of(name):
+            if name.split('->')[0] in runtime_names:
+                return ('name', name)
+
+            (prefix, _, enumerator) = name.partition('.')
+            if prefix == 'errordef':
+                if errors is None:
+                    raise Exception(f"No error enumeration for {name} in guard {guard} of {event}")
+
+                values = enumerator_values(errors)
+                if enumerator not in values:
+                    raise Exception(f"Unknown error {enumerator} in guard {guard} of {event}")
+
+                return ('const', values[enumerator])
+
+            if guard.resolve_name is None:
+                raise Exception(f"Could not resolve {name} in guard {guard} of {event}")
+
+            (enumeration_name, _, enumerator) = name.rpartition('.')
+            if enumeration_name:
+                res_dt = guard.resolve_name(enumeration_name)
+                if res_dt and res_dt.info.get('type') == 'enumeration':
+                    values = enumerator_values(res_dt.info)
+                    if enumerator in values:
+                        return ('const', values[enumerator])
+
+            try:
+                return ('const', named_value(name, guard.resolve_name))
+            except Exception as e:
+                raise Exception(f"Could not resolve {name} in guard {guard} of {event}: {e}")
+
+        # A guard without runtime names is evaluated once. It is None
+        # if it always holds, and False if it never does.
+        node = fold(guard.node, value_of)
+        if not uses_names(node):
+            return None if build(node)(None) else False
+
+        return build(node)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def states(self) -> list:
+        return self._states
+
+    @property
+    def events(self) -> list:
+        return self._events
+
+    @property
+    def variables(self) -> list:
+        return self._variables
+
+    @property
+    def initial(self) -> int:
+        return self._initial
+
+    @property
+    def table(self) -> array.array:
+        # table[state * len(events) + event]
+        return self._table
+
+    def state_id(self, state: str) -> int:
+        return self._state_ids[state]
+
+    def event_id(self, event: str) -> int:
+        if event not in self._event_ids:
+            raise Exception(f"Unknown event {event} for contract of {self._name}")
+
+        return self._event_ids[event]
+
+    def encode(self, events) -> list:
+        # Event ids of a trace of event names, or of (event name, values)
+        return [ self.event_id(event) if isinstance(event, str) else (self.event_id(event[0]), event[1])
+                 for event in events ]
+
+    def checker(self, variables: dict = None):
+        return TraceChecker(self, variables)
+
+    def check(self, events, variables: dict = None):
+        # Check a complete trace from the initial state. Returns the
+        # checker, in the final state.
+        return self.checker(variables).feed(events)
+
+
+class TraceChecker:
+    def __init__(self, machine: StateMachine, variables: dict = None):
+        self._machine = machine
+        self._width = len(machine.events)
+        self._offset = machine.initial * self._width
+        self._position = 0
+        self._values = None
+        self._variables = { name: None for name in machine.variables }
+        if variables is not None:
+            self._variables.update(variables)
+
+    @property
+    def state(self) -> str:
+        return self._machine.states[self._offset // self._width]
+
+    @property
+    def position(self) -> int:
+        # Number of events checked
+        return self._position
+
+    @property
+    def variables(self) -> dict:
+        # Contract variables, used by guards. Updated by the caller.
+        return self._variables
+
+    def feed(self, events):
+        # Check the next events of the trace. An event not allowed in
+        # the current state raises an exception, and the checker stays
+        # in the state before the event.
+        offsets = self._machine._offsets
+        step = self._step
+        width = self._width
+        offset = self._offset
+        position = self._position
+        try:
+            for event in events:
+                try:
+                    target = offsets[offset + event]
+                except TypeError:
+                    target = step(offset, event[0], event[1], position)
+                except IndexError:
+                    target = step(offset, event, None, position)
+                else:
+                    # An id outside of the row of the state indexes
+                    # another row, and is rejected by _step()
+                    if target < 0 or event >= width or event < 0:
+                        target = step(offset, event, None, position)
+
+                offset = target
+                position += 1
+        finally:
+            self._offset = offset
+            self._position = position
+
+        return self
+
+    def _lookup(self, name):
+        # Value of a name in a guard, from the values of the current
+        # event or from the variables
+        path = name.split('->')
+        if self._values is not None and path[0] in self._values:
+            value = self._values[path[0]]
+        elif path[0] in self._variables:
+            value = self._variables[path[0]]
+        else:
+            raise Exception(f"No value for {path[0]} in guard at position {self._position}")
+
+        for member in path[1:]:
+            value = value[member]
+
+        return value
+
+    def _step(self, offset, event, values, position):
+        machine = self._machine
+        if not isinstance(event, int):
+            raise Exception(f"Invalid event {event!r} at position {position}")
+
+        state = machine.states[offset // self._width]
+        if event < 0 or event >= self._width:
+            # Not an event of the machine, so not allowed in any state
+            raise Exception(f"Event {event} at position {position} not allowed in state {state}")
+
+        target = machine._offsets[offset + event]
+        if target >= 0:
+            return target
+
+        if target == REJECT:
+            raise Exception(f"Event {machine.events[event]} at position {position} not allowed in state {state}")
+
+        self._values = values
+        self._position = position
+        lookup = self._lookup
+        for (guard, target_state) in machine._guarded[-2 - target]:
+            if guard is None or guard(lookup):
+                return target_state * self._width
+
+        raise Exception(f"No guard of event {machine.events[event]} at position {position} holds in state {state}")
+
+
+def compile_contract(interface: dict):
+    # StateMachine for the contract of a resolved interface dictionary,
+    # or None if the interface has no contract
+    if 'contract' not in interface:
+        return None
+
+    return StateMachine(interface['name'], interface['contract'], interface_events(interface))
+
+
+def compile_contracts(result: dict) -> dict:
+    # StateMachine for each interface with a contract in a resolved
+    # result, by interface name
+    return { interface['name']: compile_contract(interface)
+             for interface in declarations(result, 'interfaces')
+             if 'contract' in interface }
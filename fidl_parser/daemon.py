@@ -0,0 +1,293 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Model daemon
+#
+#  Keeps a loaded project.Project in memory, watches its files and
+#  reloads each changed file through Project.reload(), which only
+#  re-resolves the files depending on it.
+#
+#  Queries are JSON objects, one per line, read from stdin or from
+#  clients of a unix domain socket. Each query gets a single line JSON
+#  response with "ok" set to true and a "result", or to false and an
+#  "error". An "id" given in the query is returned in the response.
+#
+#    { "query": "status" }
+#    { "query": "files" }
+#    { "query": "file", "file": "model/Service.fidl" }
+#    { "query": "type", "name": "org.example.Types.MyStruct" }
+#    { "query": "dependents", "file": "model/Types.fidl" }
+#    { "query": "users", "type": "org.example.Types.MyStruct" }
+#    { "query": "impact", "type": "org.example.Types.MyStruct" }
+#    { "query": "reload", "file": "model/Types.fidl" }
+#    { "query": "shutdown" }
+#
+import json
+import os
+import selectors
+import socket
+import sys
+import time
+from . import watcher
+
+
+class Daemon:
+    def __init__(self, project, file_watcher=None, log=None):
+        self._project = project
+        self._watcher = file_watcher if file_watcher is not None else watcher.create_watcher()
+        self._log = log if log is not None else (lambda message: print(message, file=sys.stderr))
+        self._selector = selectors.DefaultSelector()
+        self._running = False
+        self._reloads = 0
+        self._last_reload = None
+
+        # Absolute file name -> file name in project
+        self._watched = {}
+        self._watch_files()
+
+        self._queries = {
+            'status': self._query_status,
+            'files': self._query_files,
+            'file': self._query_file,
+            'type': self._query_type,
+            'dependents': self._query_dependents,
+            'users': self._query_users,
+            'impact': self._query_impact,
+            'reload': self._query_reload,
+            'shutdown': self._query_shutdown,
+        }
+
+    @property
+    def project(self):
+        return self._project
+
+    def _watch_files(self):
+        new_files = [ file_name for file_name in list(self._project.files) + list(self._project.errors)
+                      if os.path.abspath(file_name) not in self._watched ]
+        self._watched.update([ (os.path.abspath(file_name), file_name) for file_name in new_files ])
+        self._watcher.watch(new_files)
+
+    #
+    # Reloading
+    #
+    def reload(self, file_names) -> dict:
+        start = time.perf_counter()
+        resolved = []
+        for file_name in file_names:
+            resolved.extend([ name for name in self._project.reload(file_name) if name not in resolved ])
+
+        self._watch_files()
+        self._reloads += 1
+        self._last_reload = {
+            'files': list(file_names),
+            'resolved': resolved,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            'errors': self._project.errors
+        }
+        self._log(f"Reloaded {', '.join(file_names)}: {len(resolved)} files resolved "
+                  f"in {self._last_reload['ms']} ms, {len(self._project.errors)} errors")
+        return self._last_reload
+
+    def _on_changes(self):
+        changed = sorted([ self._watched[file_name] for file_name in self._watcher.changes()
+                           if file_name in self._watched ])
+        if changed:
+            self.reload(changed)
+
+    #
+    # Queries
+    #
+    def _query_status(self, query):
+        return {
+            'files': len(self._project.files),
+            'errors': self._project.errors,
+            'reloads': self._reloads,
+            'last_reload': self._last_reload,
+            'watcher': type(self._watcher).__name__
+        }
+
+    def _query_files(self, query):
+        return list(self._project.files)
+
+    def _file_name(self, query):
+        file_name = os.path.normpath(query['file'])
+        if file_name not in self._project.files:
+            raise Exception(f"File not in project: {query['file']}")
+
+        return file_name
+
+    def _query_file(self, query):
+        return self._project.files[self._file_name(query)].result
+
+    def _query_type(self, query):
+        type = self._project.namespace.resolve_type(query['name'])
+        if type is None:
+            raise Exception(f"Unknown type: {query['name']}")
+
+        return { 'name': type.qualified_name, 'file': self._project.owner(type), 'info': type.info }
+
+    def _query_dependents(self, query):
+        return sorted(self._project.dependents(self._file_name(query)))
+
+    def _query_users(self, query):
+        return [ usage.to_dict() for usage in self._project.usage.users(query['type']) ]
+
+    def _query_impact(self, query):
+        return [ usage.to_dict() for usage in self._project.usage.impact(query['type']) ]
+
+    def _query_reload(self, query):
+        return self.reload([ os.path.normpath(query['file']) ])
+
+    def _query_shutdown(self, query):
+        self._running = False
+        return None
+
+    def handle(self, line: str) -> str:
+        # Returns the response line for a query line
+        response = {}
+        try:
+            query = json.loads(line)
+            if not isinstance(query, dict):
+                raise Exception("Query is not a JSON object")
+
+            if 'id' in query:
+                response['id'] = query['id']
+
+            handler = self._queries.get(query.get('query'))
+            if handler is None:
+                raise Exception(f"Unknown query: {query.get('query')}")
+
+            response['result'] = handler(query)
+            response['ok'] = True
+        except KeyError as e:
+            response['ok'] = False
+            response['error'] = f"Missing query argument: {e}"
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = str(e)
+
+        return json.dumps(response, default=str)
+
+    #
+    # Event loop
+    #
+    def _read_lines(self, fd, buffer, write):
+        # Reads from fd, answers complete lines through write().
+        # Returns the remaining partial line, or None at end of file.
+        data = os.read(fd, 65536)
+        if not data:
+            return None
+
+        buffer += data
+        while b'\n' in buffer and self._running:
+            (line, buffer) = buffer.split(b'\n', 1)
+            if line.strip():
+                write((self.handle(line.decode('utf-8')) + "\n").encode('utf-8'))
+
+        return buffer
+
+    def _run(self):
+        fd = self._watcher.fileno()
+        if fd is not None:
+            self._selector.register(fd, selectors.EVENT_READ, ('watcher', None))
+
+        self._running = True
+        while self._running:
+            for (key, _) in self._selector.select(self._watcher.interval):
+                (kind, data) = key.data
+                if kind == 'watcher':
+                    self._on_changes()
+                else:
+                    data(key)
+
+            if fd is None:
+                self._on_changes()
+
+    def serve_stdio(self, inp=None, out=None):
+        inp_fd = (inp if inp is not None else sys.stdin).fileno()
+        out_fd = (out if out is not None else sys.stdout).fileno()
+        buffer = [ b'' ]
+
+        def write(data):
+            while data:
+                data = data[os.write(out_fd, data):]
+
+        def on_input(key):
+            buffer[0] = self._read_lines(inp_fd, buffer[0], write)
+            if buffer[0] is None:
+                self._running = False
+
+        self._selector.register(inp_fd, selectors.EVENT_READ, ('stdio', on_input))
+        try:
+            self._run()
+        finally:
+            self._close()
+
+    def serve_socket(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        server.setblocking(False)
+
+        def on_client(client):
+            # Clients are not blocking. Responses are buffered in output
+            # until the client reads them, and the client is not read
+            # from while it has responses to read, so that a slow
+            # client neither stalls the daemon nor makes it buffer
+            # responses without bounds.
+            (buffer, output) = ([ b'' ], bytearray())
+
+            def handler(key):
+                try:
+                    if not output:
+                        buffer[0] = self._read_lines(client.fileno(), buffer[0], output.extend)
+
+                    if output:
+                        del output[:client.send(output)]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    buffer[0] = None
+                    output.clear()
+
+                # A client at end of file is closed once it has read
+                # its responses
+                if buffer[0] is None and not output:
+                    self._selector.unregister(client)
+                    client.close()
+                    return
+
+                events = selectors.EVENT_WRITE if output else selectors.EVENT_READ
+                if key.events != events:
+                    self._selector.modify(client, events, key.data)
+
+            return handler
+
+        def on_accept(key):
+            (client, _) = server.accept()
+            client.setblocking(False)
+            self._selector.register(client, selectors.EVENT_READ, ('client', on_client(client)))
+
+        self._selector.register(server, selectors.EVENT_READ, ('server', on_accept))
+        self._log(f"Listening on {path}")
+        try:
+            self._run()
+        finally:
+            for key in list(self._selector.get_map().values()):
+                if isinstance(key.fileobj, socket.socket):
+                    key.fileobj.close()
+
+            os.remove(path)
+            self._close()
+
+    def _close(self):
+        self._selector.close()
+        self._watcher.close()
@@ -0,0 +1,633 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Franca deployment files
+#
+#  A .fdepl file is parsed with the francadepl.lark grammar, through
+#  the same cached LALR parsers as .fidl files, and converted into a
+#  dictionary by the conversion engine of parse_tree.
+#
+#  Deployment specifications declare the properties that may be given
+#  for each kind of element (the host), with their type, and if they
+#  are optional or have a default value. Deployment definitions give
+#  the properties of an interface, a type collection or a provider,
+#  and of the elements inside them.
+#
+#  A Binding binds the properties of the definitions to the elements
+#  of a resolved model, such as project.Project.namespace. The elements
+#  given by a definition are indexed by their fully qualified name,
+#  such as org.example.Service.callme.in.id. The elements of the target
+#  of the definition are then found in the model through the qualified
+#  name index of the namespace tree and the name indexes of each type.
+#  Each element is looked up once in the definition index, making the
+#  time taken linear in the size of the deployed model.
+#
+#  Errors, such as elements not in the model, unknown properties and
+#  missing mandatory properties, are collected instead of raised.
+#
+import os
+import lark
+from .parse_tree import (MapCompiler, process_lark_tree, process_lark_tree_entry, create_entry,
+                         create_target_dictionary, create_target_list, aggregate_list,
+                         process_one_of, create_static_entry, fidl_string)
+from .usage import element_kind
+from .tracer import Tracer
+from .parser import get_parser
+
+DEPLOYMENT_GRAMMAR = 'francadepl.lark'
+
+# Property values by token type
+value_tokens = {
+    'FDEPL_INT': int,
+    'FDEPL_HEX': lambda value: int(value, 16),
+    'FDEPL_STRING': fidl_string,
+    'FDEPL_TRUE': lambda value: True,
+    'FDEPL_FALSE': lambda value: False,
+    'FDEPL_NAME': str
+}
+
+
+def convert_value(node):
+    if isinstance(node, lark.Tree):
+        return [ convert_value(child) for child in node.children ]
+
+    return value_tokens[node.type](node.value)
+
+
+def create_value(compiler, target_entry):
+    # The value given last in lark_tree
+    def handler(state, lark_tree, index):
+        if not lark_tree.children:
+            return None
+
+        return { target_entry: convert_value(lark_tree.children[-1]) }
+
+    return handler
+
+
+def create_property_dictionary(compiler, lark_entry, target_entry):
+    # Property name -> value of all lark_entry properties
+    def handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
+
+        res = {}
+        for entry in entries:
+            name = entry.children[0].value
+            if name in res:
+                raise Exception(f"Property {name} given twice, line {entry.children[0].line}")
+
+            res[name] = convert_value(entry.children[-1])
+
+        return { target_entry: res }
+
+    return handler
+
+
+def create_token_list(compiler, lark_entry, target_entry):
+    # Values of the tokens of the lark_entry subtree
+    def handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
+
+        return { target_entry: [ token.value for token in entries[0].children ] }
+
+    return handler
+
+
+def create_flag(compiler, lark_entry, target_entry):
+    def handler(state, lark_tree, index):
+        if lark_entry not in index[0]:
+            return None
+
+        return { target_entry: True }
+
+    return handler
+
+
+specification_map = [
+    ( create_entry, "FDEPL_NAME", "name" ),
+    ( create_entry, "FDEPL_SPEC_BASE", "extends" ),
+    ( create_target_list, "host_declaration", "hosts", [
+        ( create_entry, "FDEPL_HOST", "host" ),
+        ( create_target_list, "property_declaration", "properties", [
+            ( create_entry, "FDEPL_NAME", "name" ),
+            ( process_lark_tree_entry, "property_type", [
+                ( process_one_of, [
+                    ( create_entry, "FDEPL_NAME", "type" ),
+                    ( create_static_entry, "type", "enumeration" )
+                ]),
+                ( create_token_list, "enumerator_list", "enumerators" ),
+                ( create_entry, "FDEPL_ARRAY", "array", bool )
+            ]),
+            ( process_lark_tree_entry, "property_flags", [
+                ( create_flag, "optional_flag", "optional" ),
+                ( process_lark_tree_entry, "default_flag", [
+                    ( create_value, "default" )
+                ])
+            ])
+        ])
+    ])
+]
+
+# Named elements with properties only
+element_map = [
+    ( create_entry, "FDEPL_NAME", "name" ),
+    ( create_property_dictionary, "property", "properties" )
+]
+
+# Arguments, struct and union fields, and enumerators
+member_list_map = ( create_target_list, "element_definition", "members", element_map )
+
+# The type of each datatype is named as by usage.element_kind()
+datatype_maps = [
+    ( create_target_list, f"{kind}_definition", "datatypes",
+      [ ( create_static_entry, "type", kind ) ] + element_map + [ member_list_map ] )
+    for kind in ('struct', 'union', 'enumeration', 'array', 'typedef', 'map')
+]
+
+interface_definition_map = [
+    ( create_static_entry, "type", "interface" ),
+    ( create_entry, "FDEPL_NAME", "specification" ),
+    ( create_entry, "FDEPL_TARGET", "target" ),
+    ( create_entry, "FDEPL_AS_NAME", "name" ),
+    ( create_property_dictionary, "property", "properties" ),
+    ( create_target_list, "attribute_definition", "attributes", element_map ),
+    ( create_target_list, "method_definition", "methods", element_map + [
+        ( create_entry, "FDEPL_SELECTOR", "selector" ),
+        ( create_target_dictionary, "in_arguments", "in", [ member_list_map ] ),
+        ( create_target_dictionary, "out_arguments", "out", [ member_list_map ] )
+    ]),
+    # Broadcasts are listed as events, as in the converted model
+    ( create_target_list, "broadcast_definition", "events", element_map + [
+        ( create_entry, "FDEPL_SELECTOR", "selector" ),
+        ( create_target_dictionary, "out_arguments", "out", [ member_list_map ] )
+    ]),
+    ( aggregate_list, "datatypes", datatype_maps, True )
+]
+
+type_collection_definition_map = [
+    ( create_static_entry, "type", "typeCollection" ),
+    ( create_entry, "FDEPL_NAME", "specification" ),
+    ( create_entry, "FDEPL_TARGET", "target" ),
+    ( create_entry, "FDEPL_AS_NAME", "name" ),
+    ( create_property_dictionary, "property", "properties" ),
+    ( aggregate_list, "datatypes", datatype_maps, True )
+]
+
+provider_definition_map = [
+    ( create_static_entry, "type", "provider" ),
+    ( create_entry, "FDEPL_NAME", "specification" ),
+    ( create_entry, "FDEPL_AS_NAME", "name" ),
+    ( create_property_dictionary, "property", "properties" ),
+    ( create_target_list, "instance_definition", "instances", [
+        ( create_entry, "FDEPL_TARGET", "target" ),
+        ( create_entry, "FDEPL_AS_NAME", "name" ),
+        ( create_property_dictionary, "property", "properties" )
+    ])
+]
+
+conversion_map = [
+    ( create_entry, "FDEPL_NAME", "name" ), # Package name
+    ( create_target_list, "import_file", "imports", [
+        ( create_entry, "FDEPL_FILE_NAME", "file", fidl_string )
+    ]),
+    ( create_target_list, "specification", "specifications", specification_map ),
+    ( aggregate_list, "definitions", [
+        ( create_target_list, "interface_definition", "definitions", interface_definition_map ),
+        ( create_target_list, "type_collection_definition", "definitions", type_collection_definition_map ),
+        ( create_target_list, "provider_definition", "definitions", provider_definition_map )
+    ], True)
+]
+
+conversion_handlers = MapCompiler().compile(conversion_map)
+
+
+def convert_fdepl_tree(lark_tree: lark.Tree, tracer: Tracer = None):
+    if tracer is None or not tracer.enabled:
+        return process_lark_tree({}, lark_tree, conversion_handlers)
+
+    return process_lark_tree({}, lark_tree, MapCompiler(tracer).compile(conversion_map))
+
+
+def convert_fdepl_text(fdepl_text: str, tracer: Tracer = None, profiler=None):
+    # With profiler, a profile.Profiler, the parse and the conversion
+    # are timed
+    if profiler is None:
+        return convert_fdepl_tree(get_parser(DEPLOYMENT_GRAMMAR).parse(fdepl_text), tracer)
+
+    lark_tree = profiler.parse(get_parser(DEPLOYMENT_GRAMMAR), fdepl_text)
+    return profiler.call('convert', convert_fdepl_tree, lark_tree, tracer)
+
+
+#
+# Binding
+#
+
+# Host of the properties of each kind of element
+kind_hosts = {
+    'interface': 'interfaces',
+    'typeCollection': 'typeCollections',
+    'attribute': 'attributes',
+    'method': 'methods',
+    'broadcast': 'broadcasts',
+    'argument': 'arguments',
+    'struct': 'structs',
+    'union': 'unions',
+    'enumeration': 'enumerations',
+    'array': 'arrays',
+    'typedef': 'typedefs',
+    'map': 'maps',
+    'struct_field': 'struct_fields',
+    'union_field': 'union_fields',
+    'enumerator': 'enumerators',
+    'provider': 'providers',
+    'instance': 'instances'
+}
+
+# Additional hosts of attributes, arguments and fields by native datatype
+datatype_hosts = {
+    'int8': ('integers', 'numbers'),
+    'uint8': ('integers', 'numbers'),
+    'int16': ('integers', 'numbers'),
+    'uint16': ('integers', 'numbers'),
+    'int32': ('integers', 'numbers'),
+    'uint32': ('integers', 'numbers'),
+    'int64': ('integers', 'numbers'),
+    'uint64': ('integers', 'numbers'),
+    'float': ('floats', 'numbers'),
+    'double': ('floats', 'numbers'),
+    'boolean': ('booleans',),
+    'string': ('strings',),
+    'binary': ('byte_buffers',)
+}
+
+# Kind of the members of each kind of datatype
+member_kinds = {
+    'struct': 'struct_field',
+    'union': 'union_field',
+    'enumeration': 'enumerator'
+}
+
+# Python type of the values of each property type
+value_types = {
+    'Integer': int,
+    'String': str,
+    'Boolean': bool
+}
+
+
+def check_single_value(declaration, value):
+    if declaration['type'] == 'enumeration':
+        if value not in declaration['enumerators']:
+            return f"{value} is not one of {', '.join(declaration['enumerators'])}"
+
+        return None
+
+    # Other types, such as references to interfaces, are not checked
+    expected = value_types.get(declaration['type'])
+    if expected is not None and type(value) is not expected:
+        return f"{value!r} is not of type {declaration['type']}"
+
+    return None
+
+
+def check_value(declaration, value):
+    # Error message if value does not match the property declaration,
+    # or None
+    if not declaration.get('array'):
+        if isinstance(value, list):
+            return f"expected a single {declaration['type']}"
+
+        return check_single_value(declaration, value)
+
+    if not isinstance(value, list):
+        return f"expected a list of {declaration['type']}"
+
+    for elem in value:
+        res = check_single_value(declaration, elem)
+        if res is not None:
+            return res
+
+    return None
+
+
+def element_name(element):
+    # Name of a method or broadcast, with its selector
+    if 'selector' in element:
+        return f"{element['name']}:{element['selector']}"
+
+    return element['name']
+
+
+class Binding:
+    def __init__(self, namespace, specifications: dict):
+        self._namespace = namespace
+        self._specifications = specifications
+
+        # Specification name -> host -> property name -> declaration
+        self._hosts = {}
+
+        # (specification name, kind, datatype) -> (hosts, declarations,
+        # defaults, mandatory)
+        self._declarations = {}
+
+        self._properties = {}
+        self._elements = {}
+        self._errors = []
+
+    @property
+    def properties(self) -> dict:
+        # Qualified name -> property name -> value, for each element
+        # with properties, including defaults
+        return self._properties
+
+    @property
+    def errors(self) -> list:
+        return self._errors
+
+    def element(self, qualified_name: str):
+        # The model dictionary of a deployed element, or the
+        # type_manager.NameSpace of a type collection, or None
+        return self._elements.get(qualified_name)
+
+    def _spec_hosts(self, name):
+        hosts = self._hosts.get(name)
+        if hosts is not None:
+            return hosts
+
+        spec = self._specifications.get(name)
+        if spec is None:
+            raise Exception(f"Unknown deployment specification {name}")
+
+        if name in self._hosts:
+            raise Exception(f"Cyclic extension of deployment specification {name}")
+
+        # Declarations of a specification override those of its base
+        self._hosts[name] = None
+        try:
+            base = self._spec_hosts(spec['extends']) if 'extends' in spec else {}
+        finally:
+            del self._hosts[name]
+
+        hosts = { host: dict(declarations) for (host, declarations) in base.items() }
+        for host in spec.get('hosts', []):
+            hosts.setdefault(host['host'], {}).update([ (prop['name'], prop) for prop in host.get('properties', []) ])
+
+        self._hosts[name] = hosts
+        return hosts
+
+    def _host_declarations(self, spec_name, kind, datatype):
+        # Hosts of an element of the given kind and native datatype,
+        # the declarations of its properties, their default values,
+        # and the mandatory properties
+        key = (spec_name, kind, datatype)
+        res = self._declarations.get(key)
+        if res is not None:
+            return res
+
+        hosts = (kind_hosts[kind],) + datatype_hosts.get(datatype, ())
+        spec_hosts = self._spec_hosts(spec_name)
+        declarations = {}
+        for host in reversed(hosts):
+            declarations.update(spec_hosts.get(host, {}))
+
+        defaults = { name: declaration['default'] for (name, declaration) in declarations.items()
+                     if 'default' in declaration }
+        mandatory = [ name for (name, declaration) in declarations.items()
+                      if 'default' not in declaration and not declaration.get('optional') ]
+
+        res = self._declarations[key] = (hosts, declarations, defaults, mandatory)
+        return res
+
+    def _bind_element(self, report, spec_name, qualified_name, kind, info, properties):
+        # Attributes, arguments and fields of a native datatype
+        # have the hosts of that datatype as well
+        datatype = info.get('_resolved_datatype') if type(info) is dict else None
+        if not isinstance(datatype, str):
+            datatype = None
+
+        (hosts, declarations, defaults, mandatory) = self._host_declarations(spec_name, kind, datatype)
+        self._elements[qualified_name] = info
+        if not properties and not mandatory:
+            if defaults:
+                self._properties[qualified_name] = dict(defaults)
+            return None
+
+        res = dict(defaults)
+        for (name, value) in properties.items():
+            declaration = declarations.get(name)
+            if declaration is None:
+                report(f"{qualified_name}: Property {name} is not defined for {', '.join(hosts)}")
+                continue
+
+            error = check_value(declaration, value)
+            if error is not None:
+                report(f"{qualified_name}: Property {name}: {error}")
+                continue
+
+            res[name] = value
+
+        for name in mandatory:
+            if name not in properties:
+                report(f"{qualified_name}: Missing mandatory property {name}")
+
+        if res:
+            self._properties[qualified_name] = res
+
+        return None
+
+    def bind_file(self, file_name: str, result: dict):
+        # Bind the definitions of a file converted by convert_fdepl_text()
+        def report(message):
+            self._errors.append(f"{file_name}: {message}")
+
+        for definition in result.get('definitions', []):
+            try:
+                self._spec_hosts(definition['specification'])
+                if definition['type'] == 'provider':
+                    self._bind_provider(report, result.get('name'), definition)
+                else:
+                    self._bind_definition(report, definition)
+            except Exception as e:
+                report(str(e))
+
+        return self
+
+    def _interface(self, name):
+        type = self._namespace.resolve_type(name)
+        # Interfaces are the types that have a namespace of their own
+        if type is None or type.name not in type.parent.namespaces:
+            return None
+
+        return type
+
+    def _bind_definition(self, report, definition):
+        # Elements of the target in the model, as (qualified name,
+        # kind, info) tuples
+        elements = []
+        target = definition['target']
+        if definition['type'] == 'interface':
+            type = self._interface(target)
+            if type is None:
+                raise Exception(f"No interface {target} in the model")
+
+            self._interface_elements(type, elements)
+        else:
+            ns = self._namespace.find_namespace(target.split('.'))
+            if ns is None or ns.parent is None or ns.name in ns.parent.types:
+                raise Exception(f"No type collection {target} in the model")
+
+            elements.append((ns.qualified_name, 'typeCollection', ns))
+            self._datatype_elements(ns, elements)
+
+        given = self._given(report, elements[0][0], definition)
+        spec_name = definition['specification']
+        for (qualified_name, kind, info) in elements:
+            (given_kind, properties) = given.pop(qualified_name, (kind, {}))
+            if given_kind != kind:
+                report(f"{qualified_name}: Deployed as {given_kind}, but is {kind}")
+                continue
+
+            self._bind_element(report, spec_name, qualified_name, kind, info, properties)
+
+        for (qualified_name, (kind, _)) in given.items():
+            report(f"{qualified_name}: No {kind} in the model")
+
+    def _interface_elements(self, type, elements):
+        prefix = type.qualified_name
+        elements.append((prefix, 'interface', type.info))
+        elements.extend([ (f"{prefix}.{attribute['name']}", 'attribute', attribute)
+                          for attribute in type.flattened('attributes') ])
+
+        for (list_name, kind) in (('methods', 'method'), ('events', 'broadcast')):
+            for elem in type.flattened(list_name):
+                name = f"{prefix}.{element_name(elem)}"
+                elements.append((name, kind, elem))
+                for direction in ('in', 'out'):
+                    elements.extend([ (f"{name}.{direction}.{arg['name']}", 'argument', arg)
+                                      for arg in elem.get(direction, {}).get('members', []) ])
+
+        self._datatype_elements(type.parent.namespaces[type.name], elements)
+
+    def _datatype_elements(self, ns, elements):
+        for type in ns.types.values():
+            kind = element_kind('datatypes', type.info)
+            if kind == 'constant':
+                continue
+
+            elements.append((type.qualified_name, kind, type.info))
+            member_kind = member_kinds.get(kind)
+            if member_kind is not None:
+                elements.extend([ (f"{type.qualified_name}.{member['name']}", member_kind, member)
+                                  for member in type.flattened('members') ])
+
+    def _given(self, report, prefix, definition):
+        # Qualified name -> (kind, properties) of the elements
+        # given by a definition
+        given = {}
+
+        def add(qualified_name, kind, element):
+            if qualified_name in given:
+                report(f"{qualified_name}: Deployed twice")
+            given[qualified_name] = (kind, element.get('properties', {}))
+
+        add(prefix, definition['type'], definition)
+        for attribute in definition.get('attributes', []):
+            add(f"{prefix}.{attribute['name']}", 'attribute', attribute)
+
+        for (list_name, kind) in (('methods', 'method'), ('events', 'broadcast')):
+            for elem in definition.get(list_name, []):
+                name = f"{prefix}.{element_name(elem)}"
+                add(name, kind, elem)
+                for direction in ('in', 'out'):
+                    for arg in elem.get(direction, {}).get('members', []):
+                        add(f"{name}.{direction}.{arg['name']}", 'argument', arg)
+
+        for datatype in definition.get('datatypes', []):
+            name = f"{prefix}.{datatype['name']}"
+            add(name, datatype['type'], datatype)
+            for member in datatype.get('members', []):
+                add(f"{name}.{member['name']}", member_kinds.get(datatype['type'], 'member'), member)
+
+        return given
+
+    def _bind_provider(self, report, package, definition):
+        spec_name = definition['specification']
+        prefix = f"{package}.{definition['name']}" if package else definition['name']
+        self._bind_element(report, spec_name, prefix, 'provider', definition, definition.get('properties', {}))
+
+        for instance in definition.get('instances', []):
+            type = self._interface(instance['target'])
+            if type is None:
+                report(f"{prefix}: No interface {instance['target']} in the model")
+                continue
+
+            self._bind_element(report, spec_name, f"{prefix}.{instance.get('name', instance['target'])}",
+                               'instance', type.info, instance.get('properties', {}))
+
+
+class Deployment:
+    def __init__(self, root_files):
+        self._root_files = [ os.path.normpath(file_name) for file_name in root_files ]
+
+        # File name -> converted file, in discovery order
+        self._files = {}
+        self._model_files = []
+
+    @property
+    def files(self) -> dict:
+        return self._files
+
+    @property
+    def model_files(self) -> list:
+        # The .fidl files imported by the deployment files
+        return self._model_files
+
+    @property
+    def specifications(self) -> dict:
+        # Name -> deployment specification, of all files
+        return { spec['name']: spec
+                 for result in self._files.values()
+                 for spec in result.get('specifications', []) }
+
+    def load(self):
+        # Load the root files and the .fdepl files they import.
+        # Imports by URI, such as platform:/plugin/..., are not followed.
+        pending = list(self._root_files)
+        while pending:
+            file_name = pending.pop(0)
+            if file_name in self._files:
+                continue
+
+            with open(file_name) as f:
+                result = self._files[file_name] = convert_fdepl_text(f.read())
+
+            for imp in result.get('imports', []):
+                if ':/' in imp['file']:
+                    continue
+
+                import_name = os.path.normpath(os.path.join(os.path.dirname(file_name), imp['file']))
+                if import_name.endswith('.fdepl'):
+                    pending.append(import_name)
+                elif import_name not in self._model_files:
+                    self._model_files.append(import_name)
+
+        return self
+
+    def bind(self, namespace) -> Binding:
+        # Bind the definitions of all files to the elements of
+        # namespace, such as the namespace of a project.Project
+        # loaded from model_files
+        binding = Binding(namespace, self.specifications)
+        for (file_name, result) in self._files.items():
+            binding.bind_file(file_name, result)
+
+        return binding
@@ -0,0 +1,355 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Diagnostics
+#
+#  In collecting mode, syntax, conversion and resolution errors are
+#  reported to a Diagnostics object instead of being raised, and
+#  parsing and conversion continue, so that a single pass over a
+#  file or a project reports all its errors.
+#
+#  Syntax errors are recovered from by the on_error hook of the LALR
+#  parser. A token that cannot follow the input so far is dropped,
+#  unless inserting closing braces, brackets or parentheses makes the
+#  parser accept it, as for a missing }. Errors following an error
+#  before any token was accepted are part of the same error and are
+#  not reported again.
+#
+#  Each diagnostic has the file name, line and column of the token it
+#  refers to. Datatype names and the names of extended types are kept
+#  as Located strings, holding the position of their token, and the
+#  position of each converted element is recorded with locate().
+#
+import lark
+from lark.exceptions import UnexpectedInput, UnexpectedToken, UnexpectedCharacters
+from lark.parsers.lalr_analysis import Shift
+from .parser import start_parse
+
+
+class Located(str):
+    # A name with the position of the token it was read from
+    def __new__(cls, value: str, line: int = None, column: int = None):
+        located = super().__new__(cls, value)
+        located.line = line
+        located.column = column
+        return located
+
+    def __reduce__(self):
+        return (Located, (str(self), self.line, self.column))
+
+
+class Diagnostic:
+    def __init__(self, message: str, file_name: str = None, line: int = None, column: int = None):
+        self._message = message
+        self._file_name = file_name
+        self._line = line
+        self._column = column
+
+    @property
+    def message(self):
+        return self._message
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def line(self):
+        return self._line
+
+    @property
+    def column(self):
+        return self._column
+
+    def __str__(self):
+        # file:line:column: message, as printed by compilers
+        location = [ str(part) for part in (self._file_name, self._line, self._column) if part is not None ]
+        return ': '.join([ ':'.join(location), self._message ]) if location else self._message
+
+    def __repr__(self):
+        return f"Diagnostic({str(self)!r})"
+
+    def to_dict(self) -> dict:
+        return { 'file': self._file_name, 'line': self._line, 'column': self._column, 'message': self._message }
+
+
+class Diagnostics:
+    def __init__(self, file_name: str = None):
+        self._file_name = file_name
+        self._diagnostics = []
+
+        # id(element) -> (element, line, column) of converted elements
+        self._positions = {}
+
+    def __reduce__(self):
+        # The positions are keyed by the id of each element, which
+        # changes when the elements are unpickled
+        return (_restore_diagnostics, (self._file_name, self._diagnostics, list(self._positions.values())))
+
+    def __len__(self):
+        return len(self._diagnostics)
+
+    def __iter__(self):
+        return iter(self._diagnostics)
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def diagnostics(self) -> list:
+        # Diagnostics in the order they were reported
+        return self._diagnostics
+
+    def sorted(self) -> list:
+        # Diagnostics by position in the file
+        return sorted(self._diagnostics, key=lambda diagnostic: (diagnostic.line or 0, diagnostic.column or 0))
+
+    def extend(self, other):
+        # Add the diagnostics and positions of other, such as those of
+        # a part of the same file converted in another process
+        self._diagnostics.extend(other.diagnostics)
+        self._positions.update(other._positions)
+
+    def truncate(self, length: int):
+        # Remove the diagnostics reported after the first length ones
+        del self._diagnostics[length:]
+
+    def locate(self, element, token):
+        # Record the position of the token element was converted from
+        if id(element) not in self._positions:
+            self._positions[id(element)] = (element, token.line, token.column)
+
+    def position(self, where):
+        # (line, column) of a token, a Located name or a converted
+        # element, or (None, None)
+        if isinstance(where, (lark.Token, Located)):
+            return (where.line, where.column)
+
+        position = self._positions.get(id(where))
+        if position is None:
+            return (None, None)
+
+        return position[1:]
+
+    def report(self, message: str, where=None):
+        (line, column) = self.position(where)
+        self._diagnostics.append(Diagnostic(message, self._file_name, line, column))
+
+
+def _restore_diagnostics(file_name, diagnostics, positions):
+    res = Diagnostics(file_name)
+    res._diagnostics = diagnostics
+    res._positions = { id(element): (element, line, column) for (element, line, column) in positions }
+    return res
+
+
+def first_token(lark_tree):
+    return next(lark_tree.scan_values(lambda value: isinstance(value, lark.Token)), None)
+
+
+#
+# Syntax error recovery
+#
+
+# Terminals inserted to close open blocks and their values
+closing_terminals = {
+    'RBRACE': '}',
+    'RSQB': ']',
+    'RPAR': ')'
+}
+
+# Most closing terminals inserted before a single token
+max_inserted = 16
+
+
+def advance(parse_conf, stack, terminal) -> bool:
+    # Run the LALR actions for terminal on stack, a copy of the state
+    # stack of a parser, up to and including the shift of terminal.
+    # Returns if terminal was accepted. No callbacks are called, so
+    # the parser and its transformer are not affected.
+    states = parse_conf.states
+    while True:
+        action = states[stack[-1]].get(terminal)
+        if action is None:
+            return False
+
+        (kind, arg) = action
+        if kind is Shift:
+            stack.append(arg)
+            return True
+
+        size = len(arg.expansion)
+        if size:
+            del stack[-size:]
+
+        stack.append(states[stack[-1]][arg.origin.name][1])
+        if terminal == '$END' and stack[-1] == parse_conf.end_state:
+            return True
+
+
+class ErrorRecovery:
+    # on_error hook for lark.Lark.parse(), reporting each syntax error
+    # to diagnostics and recovering from it
+    def __init__(self, lark_parser: lark.Lark, diagnostics: Diagnostics):
+        self._diagnostics = diagnostics
+        self._stack = None
+
+        # Terminals given by a string, such as }, by name
+        self._literals = { terminal.name: repr(terminal.pattern.value) for terminal in lark_parser.terminals
+                           if isinstance(terminal.pattern, lark.lexer.PatternStr) }
+
+    def describe(self, token) -> str:
+        if token.type == '$END':
+            return 'end of file'
+
+        return repr(token.value)
+
+    def expected(self, terminals) -> str:
+        # Terminals given by a regular expression are named, except
+        # for the anonymous ones
+        expected = sorted([ self._literals.get(name, name) for name in terminals
+                            if not name.startswith('__') and name != '$END' ])
+        if len(expected) > 8:
+            expected = expected[:8] + [ '...' ]
+
+        return ', '.join(expected)
+
+    def _skip_first(self, interactive, token):
+        # Lex the text of a dropped token again from its second
+        # character. A token of a terminal such as the statement of a
+        # contract transition may span several tokens that are valid
+        # where the error is.
+        line_ctr = interactive.lexer_state.state.line_ctr
+        line_ctr.char_pos = token.start_pos
+        line_ctr.line = token.line
+        line_ctr.line_start_pos = token.start_pos - token.column + 1
+        line_ctr.feed(token.value[0])
+
+    def _closing(self, parser_state, token):
+        # The closing terminals that, inserted before token, make the
+        # parser accept it, or None
+        parse_conf = parser_state.parse_conf
+        stack = list(parser_state.state_stack)
+        inserted = []
+        while not advance(parse_conf, list(stack), token.type):
+            if len(inserted) == max_inserted:
+                return None
+
+            closing = next((name for name in closing_terminals if advance(parse_conf, list(stack), name)), None)
+            if closing is None:
+                return None
+
+            advance(parse_conf, stack, closing)
+            inserted.append(closing)
+
+        return inserted
+
+    def __call__(self, error) -> bool:
+        interactive = error.interactive_parser
+        parser_state = interactive.parser_state
+
+        # Nothing was accepted since the last error
+        continued = self._stack == parser_state.state_stack
+
+        if isinstance(error, UnexpectedCharacters):
+            # The character is skipped
+            if not continued:
+                self._diagnostics.report(f"Unexpected character {error.char!r}",
+                                         lark.Token('ERROR', error.char, line=error.line, column=error.column))
+            self._stack = list(parser_state.state_stack)
+            return True
+
+        if not isinstance(error, UnexpectedToken):
+            return False
+
+        token = error.token
+        inserted = self._closing(parser_state, token)
+
+        # A dropped token spanning several words is lexed again
+        relex = len(token.value) > 1 and any([ char.isspace() for char in token.value ])
+        if not continued:
+            if inserted:
+                missing = ' '.join([ repr(closing_terminals[name]) for name in inserted ])
+                self._diagnostics.report(f"Missing {missing} before {self.describe(token)}", token)
+            else:
+                unexpected = repr(token.value[0]) if inserted is None and relex else self.describe(token)
+                self._diagnostics.report(f"Unexpected {unexpected}, expected {self.expected(error.expected)}",
+                                         token)
+
+        if inserted is None:
+            # Drop the token. The end of the file cannot be dropped.
+            self._stack = list(parser_state.state_stack)
+            if token.type == '$END':
+                return False
+
+            if relex:
+                self._skip_first(interactive, token)
+
+            return True
+
+        for name in inserted:
+            interactive.feed_token(lark.Token.new_borrow_pos(name, closing_terminals[name], token))
+
+        # The parser feeds the end of the file once resumed
+        if token.type != '$END':
+            interactive.feed_token(token)
+
+        self._stack = list(parser_state.state_stack)
+        return True
+
+
+def parse(lark_parser: lark.Lark, text: str, diagnostics: Diagnostics, line: int = 1, profiler=None):
+    # Parse text, with its lines numbered from line, recovering from
+    # syntax errors. Returns the result of the parser, or None if the
+    # parser could not recover. The lexer is profiled by profiler,
+    # if given, as by parser.start_parse().
+    on_error = ErrorRecovery(lark_parser, diagnostics)
+    try:
+        if line == 1 and profiler is None:
+            return lark_parser.parse(text, on_error=on_error)
+
+        return resume(start_parse(lark_parser, text, line, profiler), on_error)
+    except UnexpectedInput as e:
+        # Raised when the file ends in the middle of a declaration
+        # that could not be closed, and already reported
+        if not len(diagnostics):
+            diagnostics.report(f"Syntax error: {type(e).__name__}", getattr(e, 'token', None))
+        return None
+
+
+def resume(interactive, on_error):
+    # interactive.resume_parse(), recovering from errors with on_error
+    # as lark_parser.parse(text, on_error=on_error) does
+    try:
+        return interactive.resume_parse()
+    except UnexpectedInput as e:
+        error = e
+
+    while True:
+        if isinstance(error, UnexpectedCharacters):
+            lexer_state = error.interactive_parser.lexer_state.state
+            position = lexer_state.line_ctr.char_pos
+
+        if not on_error(error):
+            raise error
+
+        # Skip the character, unless on_error did
+        if isinstance(error, UnexpectedCharacters) and position == lexer_state.line_ctr.char_pos:
+            lexer_state.line_ctr.feed(lexer_state.text[position:position + 1])
+
+        try:
+            return error.interactive_parser.resume_parse()
+        except UnexpectedToken as e:
+            # The end of the file was not accepted after recovering
+            if isinstance(error, UnexpectedToken) and error.token.type == e.token.type == '$END' and \
+               error.interactive_parser == e.interactive_parser:
+                raise e
+            error = e
+        except UnexpectedCharacters as e:
+            error = e
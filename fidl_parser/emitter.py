@@ -0,0 +1,401 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# JSON emitters
+#
+#  The converted result shares the dictionary of a datatype between
+#  the datatype and every _resolved_datatype and _resolved_extends
+#  entry referring to it. json.dumps() writes the shared subtree again
+#  for each reference, and builds the text of the whole result.
+#
+#  The emitters write to a file object one declaration at a time, so
+#  only the text of a single declaration is held in memory. Entries
+#  referring to a named datatype or interface are written as
+#
+#    "_resolved_datatype": { "$ref": "Types.MyStruct" }
+#
+#  with the qualified name of the type, as resolved by its namespace.
+#  Native datatypes are still written as their name.
+#
+#  JsonEmitter writes the result as a single JSON object, with the
+#  same layout as json.dumps(). Without references its output is the
+#  same as that of json.dumps() with the same indent.
+#
+#  RecordEmitter writes JSON Lines, one record per datatype and
+#  interface, followed by a record for the package:
+#
+#    { "kind": "struct", "name": "Types.MyStruct", "declaration": { ... } }
+#    { "kind": "package", "name": "org.example", "import_models": [ ... ] }
+#
+#  RecordEmitter.declared() is passed to parse_tree.convert_fidl_text()
+#  to write the records of each declaration as soon as it is converted.
+#
+#  TableEmitter writes each datatype and interface once, in a symbol
+#  table keyed by qualified name, and only references elsewhere:
+#
+#    { "name": "org.example",
+#      "symbols": { "Types.MyStruct": { ... }, "~0": { ... }, ... },
+#      "types": [ { "name": "Types", "datatypes": [ { "$ref": "Types.MyStruct" } ] } ],
+#      "interfaces": [ { "$ref": "MyInterface" } ] }
+#
+#  Structurally identical anonymous types, such as the inline error
+#  enumerations of methods, are written once in the table under a
+#  name starting with "~". load_table() returns the result of a symbol
+#  table document, with a single dictionary shared by all references
+#  to a symbol, as converted.
+#
+import json
+from . import parse_tree
+from .usage import element_kind
+
+reference_keys = frozenset([ '_resolved_datatype', '_resolved_extends' ])
+
+# Entries of the result holding type collections and interfaces
+declaration_keys = frozenset([ 'types', 'interfaces' ])
+
+
+class References:
+    def __init__(self):
+        # id(dictionary) -> (dictionary, qualified name). The
+        # dictionary is kept so that its id is not reused.
+        self._names = {}
+
+    def add(self, dict_tree, name):
+        self._names[id(dict_tree)] = (dict_tree, name)
+
+    def add_types(self, types):
+        # type_manager.Type objects, such as those of a namespace
+        for type in types:
+            self.add(type.info, type.qualified_name)
+
+    def add_result(self, result: dict):
+        # Datatypes and interfaces of a result converted from a single
+        # file, named as by its namespace, unless already named
+        def add(dict_tree, name):
+            if id(dict_tree) not in self._names:
+                self.add(dict_tree, name)
+
+        for collection in parse_tree.declarations(result, 'types'):
+            for datatype in collection['datatypes']:
+                add(datatype, f"{collection['name']}.{datatype['name']}")
+
+        for interface in parse_tree.declarations(result, 'interfaces'):
+            add(interface, interface['name'])
+            for datatype in interface.get('datatypes', []):
+                add(datatype, f"{interface['name']}.{datatype['name']}")
+
+    def name(self, dict_tree):
+        entry = self._names.get(id(dict_tree))
+        return entry[1] if entry is not None else None
+
+    def replace(self, value):
+        # Copy of value with the entries referring to a named type
+        # replaced by references. Other subtrees are copied as is.
+        if isinstance(value, dict):
+            res = {}
+            for (k, v) in value.items():
+                if k in reference_keys and isinstance(v, dict):
+                    name = self.name(v)
+                    if name is not None:
+                        res[k] = { '$ref': name }
+                        continue
+
+                res[k] = self.replace(v)
+
+            return res
+
+        if isinstance(value, list):
+            return [ self.replace(elem) for elem in value ]
+
+        return value
+
+
+class JsonEmitter:
+    def __init__(self, out, indent: int = None, references: bool = True):
+        # Compact output without indent
+        self._out = out
+        self._indent = indent
+        self._separators = (',', ':') if indent is None else (',', ': ')
+        self._references = References() if references else None
+
+    @property
+    def references(self):
+        # None if references are not written
+        return self._references
+
+    def _newline(self, level):
+        if self._indent is None:
+            return ''
+
+        return '\n' + ' ' * (self._indent * level)
+
+    def _encode(self, value, level):
+        if self._references is not None:
+            value = self._references.replace(value)
+
+        text = json.dumps(value, indent=self._indent, separators=self._separators)
+        if self._indent is None or level == 0:
+            return text
+
+        # Strings do not contain newlines, they are escaped
+        return text.replace('\n', self._newline(level))
+
+    def write(self, result: dict):
+        # Write a converted result. Types of other files, as for a
+        # project.Project, are named by adding the types of the project
+        # namespace to references first.
+        if self._references is not None:
+            self._references.add_result(result)
+
+        out = self._out
+        out.write('{')
+        for (position, (key, value)) in enumerate(result.items()):
+            out.write(f"{',' if position else ''}{self._newline(1)}{json.dumps(key)}{self._separators[1]}")
+            if key not in declaration_keys or not isinstance(value, list) or not value:
+                out.write(self._encode(value, 1))
+                continue
+
+            out.write('[')
+            for (index, declaration) in enumerate(value):
+                out.write(f"{',' if index else ''}{self._newline(2)}{self._encode(declaration, 2)}")
+
+            out.write(f"{self._newline(1)}]")
+
+        out.write(f"{self._newline(0)}}}")
+        return None
+
+
+class RecordEmitter:
+    def __init__(self, out):
+        self._out = out
+        self._references = References()
+
+    @property
+    def references(self):
+        return self._references
+
+    def _record(self, kind, name, declaration):
+        record = { 'kind': kind, 'name': name, 'declaration': self._references.replace(declaration) }
+        self._out.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _declaration(self, rule, declaration):
+        # Records of a type collection or interface, once its types
+        # are named by references
+        names = self._references
+        datatypes = declaration.get('datatypes', [])
+        for datatype in datatypes:
+            self._record(element_kind('datatypes', datatype), names.name(datatype), datatype)
+
+        if rule == 'interface':
+            interface = dict(declaration)
+            if 'datatypes' in interface:
+                interface['datatypes'] = [ { '$ref': names.name(datatype) } for datatype in datatypes ]
+
+            self._record('interface', names.name(declaration), interface)
+
+        return None
+
+    def declared(self, rule, declaration, ns):
+        # Callback for parse_tree.convert_fidl_text()
+        self._references.add_types(parse_tree.declaration_types(ns, rule, declaration['name']))
+        return self._declaration(rule, declaration)
+
+    def package(self, result: dict):
+        # The package record, once all declarations are written
+        record = { 'kind': 'package' }
+        record.update([ (key, value) for (key, value) in result.items() if key not in declaration_keys ])
+        self._out.write(json.dumps(record, separators=(',', ':')) + '\n')
+        return None
+
+    def write(self, result: dict):
+        # Write the records of a converted result
+        self._references.add_result(result)
+        for collection in parse_tree.declarations(result, 'types'):
+            self._declaration('type_collection', collection)
+
+        for interface in parse_tree.declarations(result, 'interfaces'):
+            self._declaration('interface', interface)
+
+        self.package(result)
+        return None
+
+
+class TableEmitter:
+    def __init__(self, out, indent: int = None, anonymous: bool = True):
+        # Compact output without indent. Anonymous types are written
+        # inline if anonymous is False.
+        self._out = out
+        self._indent = indent
+        self._separators = (',', ':') if indent is None else (',', ': ')
+        self._references = References()
+        # Canonical JSON text of an anonymous type -> symbol name
+        self._anonymous = {} if anonymous else None
+        self._symbols = 0
+
+    @property
+    def references(self):
+        return self._references
+
+    def _newline(self, level):
+        if self._indent is None:
+            return ''
+
+        return '\n' + ' ' * (self._indent * level)
+
+    def _intern(self, value, symbols):
+        # Replace the anonymous types of value, a copy made by
+        # References.replace(), by references, innermost first. New
+        # anonymous types are appended to symbols.
+        if isinstance(value, list):
+            return [ self._intern(elem, symbols) for elem in value ]
+
+        if not isinstance(value, dict):
+            return value
+
+        res = { k: self._intern(v, symbols) for (k, v) in value.items() }
+        if 'type' not in res or 'name' in res:
+            return res
+
+        key = json.dumps(res, sort_keys=True, separators=(',', ':'))
+        name = self._anonymous.get(key)
+        if name is None:
+            name = f"~{len(self._anonymous)}"
+            self._anonymous[key] = name
+            symbols.append((name, res))
+
+        return { '$ref': name }
+
+    def _symbol(self, name, declaration):
+        # Write a symbol, preceded by the anonymous types it uses
+        value = self._references.replace(declaration)
+        symbols = []
+        if self._anonymous is not None:
+            value = { k: self._intern(v, symbols) for (k, v) in value.items() }
+
+        symbols.append((name, value))
+        for (symbol_name, symbol) in symbols:
+            text = json.dumps(symbol, indent=self._indent, separators=self._separators)
+            if self._indent is not None:
+                text = text.replace('\n', self._newline(2))
+
+            self._out.write(f"{',' if self._symbols else ''}{self._newline(2)}"
+                            f"{json.dumps(symbol_name)}{self._separators[1]}{text}")
+            self._symbols += 1
+
+    def _declaration(self, rule, declaration):
+        # Write the symbols of a type collection or interface. Returns
+        # the declaration as written outside of the table.
+        names = self._references
+        datatypes = declaration.get('datatypes', [])
+        for datatype in datatypes:
+            self._symbol(names.name(datatype), datatype)
+
+        res = dict(declaration)
+        if 'datatypes' in res:
+            res['datatypes'] = [ { '$ref': names.name(datatype) } for datatype in datatypes ]
+
+        if rule == 'type_collection':
+            return res
+
+        self._symbol(names.name(declaration), res)
+        return { '$ref': names.name(declaration) }
+
+    def write(self, result: dict):
+        # Write a converted result, with the symbol table after the
+        # entries of the package
+        self._references.add_result(result)
+
+        out = self._out
+        out.write('{')
+        position = 0
+        for (key, value) in result.items():
+            if key in declaration_keys:
+                continue
+
+            out.write(f"{',' if position else ''}{self._newline(1)}{json.dumps(key)}{self._separators[1]}"
+                      f"{json.dumps(value, separators=self._separators)}")
+            position += 1
+
+        out.write(f"{',' if position else ''}{self._newline(1)}\"symbols\"{self._separators[1]}{{")
+        written = {}
+        for (key, rule) in (('types', 'type_collection'), ('interfaces', 'interface')):
+            if key not in result:
+                continue
+
+            value = [ self._declaration(rule, declaration) for declaration in parse_tree.declarations(result, key) ]
+            written[key] = value if isinstance(result[key], list) else value[0]
+
+        out.write(f"{self._newline(1)}}}")
+        for (key, value) in written.items():
+            text = json.dumps(value, indent=self._indent, separators=self._separators)
+            if self._indent is not None:
+                text = text.replace('\n', self._newline(1))
+
+            out.write(f",{self._newline(1)}{json.dumps(key)}{self._separators[1]}{text}")
+
+        out.write(f"{self._newline(0)}}}")
+        return None
+
+
+def load_table(document: dict) -> dict:
+    # Result of a document written by TableEmitter, as loaded by
+    # json.load(). References are replaced by the dictionary of their
+    # symbol, in place.
+    symbols = document['symbols']
+    loaded = set()
+
+    def resolve(value):
+        if isinstance(value, list):
+            for (index, elem) in enumerate(value):
+                value[index] = resolve(elem)
+
+            return value
+
+        if not isinstance(value, dict):
+            return value
+
+        if len(value) == 1 and '$ref' in value:
+            name = value['$ref']
+            if name not in symbols:
+                raise Exception(f"Unknown symbol {name}")
+
+            if name not in loaded:
+                loaded.add(name)
+                resolve(symbols[name])
+
+            return symbols[name]
+
+        for (k, v) in value.items():
+            value[k] = resolve(v)
+
+        return value
+
+    return { key: resolve(value) for (key, value) in document.items() if key != 'symbols' }
+
+
+def emit_fidl_text(fidl_text: str, out, format: str = 'json', tracer=None, usage=None) -> dict:
+    # Convert fidl_text and write it to out as 'json', with an indent of
+    # two, 'compact', 'jsonl' or 'table', a symbol table with an indent
+    # of two. Records are written while converting. Returns the
+    # converted result.
+    if format == 'jsonl':
+        emitter = RecordEmitter(out)
+        result = parse_tree.convert_fidl_text(fidl_text, tracer, usage, declared=emitter.declared)
+        emitter.package(result)
+        return result
+
+    if format not in ('json', 'compact', 'table'):
+        raise Exception(f"Unknown output format {format}")
+
+    result = parse_tree.convert_fidl_text(fidl_text, tracer, usage)
+    if format == 'table':
+        TableEmitter(out, 2).write(result)
+        return result
+
+    JsonEmitter(out, 2 if format == 'json' else None).write(result)
+    return result
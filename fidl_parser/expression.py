@@ -0,0 +1,470 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Constant expressions
+#
+#  compile_expression() compiles the lark subtree of an expression, or
+#  of a constant initializer, once. An expression that does not refer
+#  to any named constant is evaluated right away and its value is
+#  returned. Otherwise an Expression is returned, which is evaluated
+#  once datatypes are resolved.
+#
+#  The grammar does not encode operator precedence, and the LALR parser
+#  builds right leaning chains of operators. Each chain is flattened
+#  back into source order and regrouped with C precedence. Parentheses
+#  are kept as groups.
+#
+#  Guards of contract transitions are compiled into Guard strings,
+#  evaluated by contract.StateMachine against the values of a trace.
+#
+#  Integers follow C semantics for division and modulo, which truncate
+#  toward zero. check_constant() checks the value of an integer constant
+#  against the range of its datatype, including Integer(min, max).
+#
+import lark
+import operator
+
+# Binary operators by precedence, all left associative
+binary_precedence = {
+    '||': 1,
+    '&&': 2,
+    '==': 3, '!=': 3,
+    '<': 4, '<=': 4, '>': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+}
+
+arithmetic_operators = {
+    'arit_mul': '*',
+    'arit_div': '/',
+    'arit_mod': '%',
+    'arit_add': '+',
+    'arit_sub': '-',
+}
+
+# Prefix operator in a flattened chain
+NOT = ('!',)
+
+native_ranges = {
+    'int8': (-2**7, 2**7 - 1),
+    'uint8': (0, 2**8 - 1),
+    'int16': (-2**15, 2**15 - 1),
+    'uint16': (0, 2**16 - 1),
+    'int32': (-2**31, 2**31 - 1),
+    'uint32': (0, 2**32 - 1),
+    'int64': (-2**63, 2**63 - 1),
+    'uint64': (0, 2**64 - 1),
+}
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def c_div(lhs, rhs):
+    if is_integer(lhs) and is_integer(rhs):
+        if rhs == 0:
+            raise Exception("Division by zero in constant expression")
+
+        quotient = abs(lhs) // abs(rhs)
+        return quotient if (lhs < 0) == (rhs < 0) else -quotient
+
+    return lhs / rhs
+
+
+def c_mod(lhs, rhs):
+    if is_integer(lhs) and is_integer(rhs):
+        return lhs - rhs * c_div(lhs, rhs)
+
+    if rhs == 0:
+        raise Exception("Division by zero in constant expression")
+
+    quotient = lhs / rhs
+    return lhs - rhs * (quotient // 1 if quotient >= 0 else -(-quotient // 1))
+
+
+binary_functions = {
+    '||': lambda lhs, rhs: bool(lhs) or bool(rhs),
+    '&&': lambda lhs, rhs: bool(lhs) and bool(rhs),
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': c_div,
+    '%': c_mod,
+}
+
+token_values = {
+    "FIDL_CONST_TRUE": lambda token: True,
+    "FIDL_CONST_FALSE": lambda token: False,
+    "FIDL_CONST_INT": lambda token: int(token),
+    "FIDL_CONST_HEX": lambda token: int(token, 16),
+    "FIDL_CONST_BIN": lambda token: int(token, 2),
+    "FIDL_CONST_FLOAT": lambda token: float(token[:-1]),
+    "FIDL_CONST_DOUBLE": lambda token: float(token[:-1]),
+    "FIDL_CONST_STRING": lambda token: token[1:-1],
+}
+
+
+#
+# Compiling lark trees into nodes
+#
+#  Nodes are tuples, so that unevaluated expressions can be pickled:
+#    ('const', value), ('name', name), ('!', node),
+#    (binary operator, lhs node, rhs node),
+#    ('struct', ((field, node), ...)), ('array', (node, ...))
+#
+def token_node(token):
+    if token.type in token_values:
+        return ('const', token_values[token.type](token.value))
+
+    return ('name', token.value)
+
+
+def flatten(expr_tree, chain):
+    # Append the operands and operators of expr_tree, an expression
+    # tree, to chain in source order
+    child = expr_tree.children[0]
+    if isinstance(child, lark.Token):
+        chain.append(token_node(child))
+        return None
+
+    if child.data == 'expression':
+        # Parenthesized group
+        chain.append(expression_node(child))
+        return None
+
+    if child.data == 'arithmetic_op':
+        op_tree = child.children[0]
+        (lhs, rhs) = op_tree.children
+        flatten(lhs.children[0], chain)
+        chain.append(arithmetic_operators[op_tree.data])
+        flatten(rhs.children[0], chain)
+        return None
+
+    if child.data == 'comparison_op':
+        if len(child.children) == 2:
+            chain.append(NOT)
+            flatten(child.children[1], chain)
+            return None
+
+        (lhs, op, rhs) = child.children
+        flatten(lhs.children[0], chain)
+        chain.append(op.value)
+        flatten(rhs.children[0], chain)
+        return None
+
+    raise Exception(f"Unsupported expression {child.data}")
+
+
+def group(chain):
+    # Precedence climbing over a flattened chain
+    position = 0
+
+    def operand():
+        nonlocal position
+        item = chain[position]
+        position += 1
+        if item is NOT:
+            return ('!', operand())
+
+        return item
+
+    def climb(min_precedence):
+        nonlocal position
+        lhs = operand()
+        while position < len(chain):
+            op = chain[position]
+            precedence = binary_precedence[op]
+            if precedence < min_precedence:
+                break
+
+            position += 1
+            lhs = (op, lhs, climb(precedence + 1))
+
+        return lhs
+
+    return climb(1)
+
+
+def expression_node(expr_tree):
+    chain = []
+    flatten(expr_tree, chain)
+    return group(chain)
+
+
+def initializer_node(lark_tree):
+    # const_init, const_array_init, const_struct_init or expression
+    if lark_tree.data == 'expression':
+        return expression_node(lark_tree)
+
+    if lark_tree.data == 'const_init':
+        return initializer_node(lark_tree.children[0])
+
+    if lark_tree.data == 'const_array_init':
+        return ('array', tuple([ initializer_node(child) for child in lark_tree.children ]))
+
+    if lark_tree.data == 'const_struct_init':
+        return ('struct', tuple([ (member.children[0].value, initializer_node(member.children[1]))
+                                  for member in lark_tree.children ]))
+
+    raise Exception(f"Unsupported constant initializer {lark_tree.data}")
+
+
+def uses_names(node):
+    kind = node[0]
+    if kind == 'const':
+        return False
+
+    if kind == 'name':
+        return True
+
+    if kind == 'struct':
+        return any([ uses_names(field_node) for (_, field_node) in node[1] ])
+
+    if kind == 'array':
+        return any([ uses_names(elem_node) for elem_node in node[1] ])
+
+    return any([ uses_names(operand) for operand in node[1:] ])
+
+
+#
+# Building closures from nodes
+#
+#  Each closure takes the function used to look up named constants.
+#
+def build(node):
+    kind = node[0]
+    if kind == 'const':
+        value = node[1]
+        return lambda lookup: value
+
+    if kind == 'name':
+        name = node[1]
+        return lambda lookup: lookup(name)
+
+    if kind == '!':
+        operand = build(node[1])
+        return lambda lookup: not operand(lookup)
+
+    if kind == 'struct':
+        fields = [ (field, build(field_node)) for (field, field_node) in node[1] ]
+        return lambda lookup: { field: func(lookup) for (field, func) in fields }
+
+    if kind == 'array':
+        elements = [ build(elem_node) for elem_node in node[1] ]
+        return lambda lookup: [ func(lookup) for func in elements ]
+
+    func = binary_functions[kind]
+    lhs = build(node[1])
+    rhs = build(node[2])
+    return lambda lookup: func(lhs(lookup), rhs(lookup))
+
+
+def unparse(node):
+    kind = node[0]
+    if kind == 'const':
+        return repr(node[1])
+
+    if kind == 'name':
+        return node[1]
+
+    if kind == '!':
+        return f"!{unparse(node[1])}"
+
+    if kind == 'struct':
+        return f"{{ {', '.join([ f'{field}: {unparse(field_node)}' for (field, field_node) in node[1] ])} }}"
+
+    if kind == 'array':
+        return f"[ {', '.join([ unparse(elem_node) for elem_node in node[1] ])} ]"
+
+    return f"({unparse(node[1])} {kind} {unparse(node[2])})"
+
+
+class Expression:
+    def __init__(self, node):
+        self._node = node
+        self._func = None
+        self._resolve_name = None
+        self._evaluating = False
+        self._has_value = False
+        self._value = None
+
+        # (dictionary, key) entries holding this expression
+        # until it is evaluated
+        self._places = []
+
+    def __reduce__(self):
+        return (Expression, (self._node,))
+
+    def __repr__(self):
+        return f"Expression({unparse(self._node)})"
+
+    def bind(self, resolve_name):
+        # resolve_name(name) returns the type_manager.Type for a name,
+        # as for parse_tree.resolve_dict_tree(). Any previous value is
+        # dropped, and the expression is put back where it was stored.
+        self._resolve_name = resolve_name
+        self._has_value = False
+        self._value = None
+        for (dict_tree, key) in self._places:
+            dict_tree[key] = self
+
+        return None
+
+    def value(self):
+        if self._has_value:
+            return self._value
+
+        if self._evaluating:
+            raise Exception(f"Cyclic reference in constant expression {unparse(self._node)}")
+
+        if self._resolve_name is None:
+            raise Exception(f"Constant expression {unparse(self._node)} evaluated before it was resolved")
+
+        if self._func is None:
+            self._func = build(self._node)
+
+        self._evaluating = True
+        try:
+            self._value = self._func(self._lookup)
+        finally:
+            self._evaluating = False
+
+        self._has_value = True
+        return self._value
+
+    def store(self, dict_tree, key):
+        # Replace the expression in dict_tree[key] by its value
+        if not any([ place_dict is dict_tree and place_key == key
+                     for (place_dict, place_key) in self._places ]):
+            self._places.append((dict_tree, key))
+
+        dict_tree[key] = self.value()
+        return dict_tree[key]
+
+    def _lookup(self, name):
+        path = name.split('->')
+        value = named_value(path[0], self._resolve_name)
+        for member in path[1:]:
+            if not isinstance(value, dict) or member not in value:
+                raise Exception(f"No member {member} in constant {name}")
+
+            value = value[member]
+
+        return value
+
+
+class Guard(str):
+    # Guard of a contract transition. The guard is a string with the
+    # source of its condition, so that the converted result stays
+    # plain JSON. Names in a guard refer to the values of a trace as
+    # well as to constants, so a guard is never evaluated by the
+    # converter. bind() keeps the function resolving the constants
+    # for contract.compile_contract().
+    def __new__(cls, node):
+        guard = super().__new__(cls, unparse(node))
+        guard._node = node
+        guard._resolve_name = None
+        return guard
+
+    def __reduce__(self):
+        return (Guard, (self._node,))
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def resolve_name(self):
+        return self._resolve_name
+
+    def bind(self, resolve_name):
+        self._resolve_name = resolve_name
+        return None
+
+
+def compile_guard(lark_tree):
+    # Guard for the comparison_op subtree of a contract transition
+    return Guard(expression_node(lark.Tree('expression', [ lark_tree ])))
+
+
+def compile_expression(lark_tree):
+    # Returns the value of an expression that does not use named
+    # constants, and an Expression otherwise
+    node = initializer_node(lark_tree)
+    if not uses_names(node):
+        return build(node)(None)
+
+    return Expression(node)
+
+
+def stored_value(dict_tree, key):
+    value = dict_tree.get(key)
+    if isinstance(value, Expression):
+        return value.store(dict_tree, key)
+
+    return value
+
+
+def named_value(name, resolve_name):
+    # Value of a constant, or of an enumerator given as
+    # Enumeration.Enumerator
+    res_dt = resolve_name(name)
+    if res_dt:
+        if res_dt.info.get('type') != 'constant':
+            raise Exception(f"{name} is not a constant")
+
+        return stored_value(res_dt.info, 'value')
+
+    (enumeration_name, _, enumerator) = name.rpartition('.')
+    if enumeration_name:
+        res_dt = resolve_name(enumeration_name)
+        if res_dt and res_dt.info.get('type') == 'enumeration':
+            for member in res_dt.info['members']:
+                if member['name'] == enumerator:
+                    return stored_value(member, 'value')
+
+    raise Exception(f"Could not resolve constant {name}")
+
+
+def integer_range(dict_tree):
+    # (min, max) of the integer datatype of a resolved dictionary, or None
+    while dict_tree is not None:
+        if 'range' in dict_tree:
+            return (dict_tree['range']['min_range'], dict_tree['range']['max_range'])
+
+        resolved = dict_tree.get('_resolved_datatype')
+        if isinstance(resolved, str):
+            return native_ranges.get(resolved)
+
+        dict_tree = resolved
+
+    return None
+
+
+def check_constant(dict_tree):
+    # Check the value of a resolved constant against its datatype
+    value = dict_tree.get('value')
+    if not is_integer(value):
+        return None
+
+    value_range = integer_range(dict_tree)
+    if value_range is None:
+        return None
+
+    (min_range, max_range) = value_range
+    if value < min_range or value > max_range:
+        raise Exception(f"Value {value} of constant {dict_tree['name']} is out of range [{min_range}, {max_range}]")
+
+    return None
@@ -0,0 +1,631 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Typed model
+#
+#  Compact classes for the result of parse_tree.convert_fidl_tree(),
+#  built with build_model(). Resolved datatypes are direct references
+#  to the model object of the type, or the name of a native type.
+#
+#  to_dict() returns the same dictionary as convert_fidl_tree() for
+#  JSON compatibility.
+#
+#  The structured comment of an element, a comment.Comment, is kept
+#  in its comment attribute.
+#
+
+class _Omitted:
+    # Marks a dictionary entry that was not present, as opposed to None
+    __slots__ = ()
+
+    def __reduce__(self):
+        return 'OMITTED'
+
+    def __repr__(self):
+        return 'OMITTED'
+
+
+OMITTED = _Omitted()
+
+
+class Element:
+    __slots__ = ('name', 'comment')
+
+    def __init__(self, name):
+        self.name = name
+        self.comment = None
+
+    def to_dict(self) -> dict:
+        return add_comment(self, { 'name': self.name })
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+
+class TypeReference(Element):
+    # An element with a datatype, which is either a native type, an
+    # integer range, or a defined type. An array_size other than None
+    # makes the element an array of the datatype.
+    __slots__ = ('datatype', 'range', 'array_size', 'type')
+
+    def __init__(self, name, datatype=None, range=None, array_size=None):
+        super().__init__(name)
+        self.datatype = datatype
+        self.range = range
+        self.array_size = array_size
+
+        # Resolved datatype. Native type name or model object.
+        self.type = None
+
+    def _add_type(self, res):
+        if self.range is not None:
+            res['range'] = { 'min_range': self.range[0], 'max_range': self.range[1] }
+
+        if self.datatype is not None:
+            res['datatype'] = self.datatype
+
+        if self.array_size is not None and 'array_size' not in res:
+            res['array_size'] = self.array_size
+
+        return res
+
+    def _add_resolved(self, res):
+        # The comment precedes the entries added by type resolution
+        add_comment(self, res)
+        if self.type is not None:
+            res['_resolved_datatype'] = self.type if isinstance(self.type, str) else self.type.to_dict()
+
+        return res
+
+    def _add_datatype(self, res):
+        return self._add_resolved(self._add_type(res))
+
+
+class Member(TypeReference):
+    # Struct, union and argument members, and enumerators
+    __slots__ = ('value',)
+
+    def __init__(self, name, value=OMITTED, **kwargs):
+        super().__init__(name, **kwargs)
+        self.value = value
+
+    def to_dict(self) -> dict:
+        res = { 'name': self.name }
+        if self.value is not OMITTED:
+            res['value'] = self.value
+
+        return self._add_datatype(res)
+
+
+class Typedef(TypeReference):
+    __slots__ = ('type_tag',)
+
+    def __init__(self, name, type_tag=None, **kwargs):
+        super().__init__(name, **kwargs)
+        # 'type' entry of the converted dictionary
+        self.type_tag = type_tag
+
+    def to_dict(self) -> dict:
+        return self._add_datatype({ 'type': self.type_tag, 'name': self.name })
+
+
+class Array(TypeReference):
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        return self._add_datatype({ 'array_size': self.array_size, 'name': self.name })
+
+
+class Attribute(TypeReference):
+    __slots__ = ('readonly', 'no_read', 'no_subscriptions')
+
+    def __init__(self, name, readonly=False, no_read=False, no_subscriptions=False, **kwargs):
+        super().__init__(name, **kwargs)
+        self.readonly = readonly
+        self.no_read = no_read
+        self.no_subscriptions = no_subscriptions
+
+    def to_dict(self) -> dict:
+        res = self._add_type({ 'name': self.name })
+        if self.readonly:
+            res['readonly'] = True
+
+        if self.no_read:
+            res['no_read'] = True
+
+        if self.no_subscriptions:
+            res['no_subscriptions'] = True
+
+        return self._add_resolved(res)
+
+
+class Constant(TypeReference):
+    __slots__ = ('value',)
+
+    def __init__(self, name, value=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.value = value
+
+    def to_dict(self) -> dict:
+        res = self._add_type({ 'type': 'constant', 'name': self.name })
+        res['value'] = self.value
+        return self._add_resolved(res)
+
+
+def add_comment(obj, res):
+    if obj.comment is not None:
+        res['comment'] = obj.comment
+
+    return res
+
+
+def add_extends(obj, res):
+    # The name of the type extended by obj
+    if obj.extends is not None:
+        res['extends'] = obj.extends
+
+    return res
+
+
+def add_base(obj, res):
+    # The resolved type extended by obj
+    if obj.base is not None:
+        res['_resolved_extends'] = obj.base.to_dict()
+
+    return res
+
+
+class Compound(Element):
+    # Types with members. A type extending another type has the name
+    # of that type in extends, and its model object in base.
+    __slots__ = ('members', 'extends', 'base')
+    type_tag = None
+
+    def __init__(self, name, members=None, extends=None):
+        super().__init__(name)
+        self.members = members if members is not None else []
+        self.extends = extends
+        self.base = None
+
+    def to_dict(self) -> dict:
+        res = add_extends(self, { 'type': self.type_tag, 'name': self.name })
+        res['members'] = [ member.to_dict() for member in self.members ]
+        return add_base(self, add_comment(self, res))
+
+
+class Struct(Compound):
+    __slots__ = ()
+    type_tag = 'struct'
+
+
+class Union(Compound):
+    __slots__ = ()
+    type_tag = 'union'
+
+
+class Enumeration(Compound):
+    __slots__ = ()
+    type_tag = 'enumeration'
+
+
+class MapType(TypeReference):
+    # Key or value type of a map
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        super().__init__(None, **kwargs)
+
+    def to_dict(self) -> dict:
+        return self._add_datatype({})
+
+
+class Map(Element):
+    __slots__ = ('key_type', 'value_type', 'extends', 'base')
+
+    def __init__(self, name, key_type=None, value_type=None, extends=None):
+        super().__init__(name)
+        self.key_type = key_type
+        self.value_type = value_type
+        self.extends = extends
+        self.base = None
+
+    def to_dict(self) -> dict:
+        res = add_extends(self, { 'type': 'map', 'name': self.name })
+        if self.key_type is not None:
+            res['key_type'] = self.key_type.to_dict()
+
+        if self.value_type is not None:
+            res['value_type'] = self.value_type.to_dict()
+
+        return add_base(self, add_comment(self, res))
+
+
+def add_selector(obj, res):
+    # The selector of an overloaded method or broadcast
+    if obj.selector is not None:
+        res['selector'] = obj.selector
+
+    return res
+
+
+class Method(Element):
+    # error is an ErrorEnumeration with the enumerators of the method,
+    # or an ErrorType referring to an enumeration
+    __slots__ = ('in_args', 'out_args', 'selector', 'error')
+
+    def __init__(self, name, in_args=None, out_args=None, selector=None, error=None):
+        super().__init__(name)
+        self.in_args = in_args
+        self.out_args = out_args
+        self.selector = selector
+        self.error = error
+
+    def to_dict(self) -> dict:
+        res = add_selector(self, { 'name': self.name })
+        if self.in_args is not None:
+            res['in'] = { 'members': [ member.to_dict() for member in self.in_args ] }
+
+        if self.out_args is not None:
+            res['out'] = { 'members': [ member.to_dict() for member in self.out_args ] }
+
+        if self.error is not None:
+            res['error'] = self.error.to_dict()
+
+        return add_comment(self, res)
+
+
+class ErrorType(MapType):
+    # Named error enumeration of a method
+    __slots__ = ()
+
+
+class ErrorEnumeration(Enumeration):
+    # Error enumerators declared by a method
+    __slots__ = ()
+
+    def __init__(self, members=None):
+        super().__init__(None, members)
+
+    def to_dict(self) -> dict:
+        return add_comment(self, { 'type': self.type_tag, 'members': [ member.to_dict() for member in self.members ] })
+
+
+class Broadcast(Element):
+    __slots__ = ('out_args', 'selector')
+
+    def __init__(self, name, out_args=None, selector=None):
+        super().__init__(name)
+        self.out_args = out_args
+        self.selector = selector
+
+    def to_dict(self) -> dict:
+        res = add_selector(self, { 'name': self.name })
+        if self.out_args is not None:
+            res['out'] = { 'members': [ member.to_dict() for member in self.out_args ] }
+
+        return add_comment(self, res)
+
+
+class Interface(Element):
+    # contract is the converted contract dictionary, compiled by
+    # contract.compile_contract()
+    __slots__ = ('datatypes', 'methods', 'broadcasts', 'attributes', 'contract', 'extends', 'base')
+
+    def __init__(self, name, methods=None, broadcasts=None, attributes=None, contract=None, extends=None,
+                 datatypes=None):
+        super().__init__(name)
+        self.datatypes = datatypes
+        self.methods = methods
+        self.broadcasts = broadcasts
+        self.attributes = attributes
+        self.contract = contract
+        self.extends = extends
+        self.base = None
+
+    def to_dict(self) -> dict:
+        res = add_extends(self, { 'name': self.name })
+        if self.datatypes is not None:
+            res['datatypes'] = [ datatype.to_dict() for datatype in self.datatypes ]
+
+        if self.methods is not None:
+            res['methods'] = [ method.to_dict() for method in self.methods ]
+
+        if self.broadcasts is not None:
+            res['events'] = [ broadcast.to_dict() for broadcast in self.broadcasts ]
+
+        if self.attributes is not None:
+            res['attributes'] = [ attribute.to_dict() for attribute in self.attributes ]
+
+        if self.contract is not None:
+            res['contract'] = self.contract
+
+        return add_base(self, add_comment(self, res))
+
+
+class TypeCollection(Element):
+    __slots__ = ('datatypes',)
+
+    def __init__(self, name, datatypes=None):
+        super().__init__(name)
+        self.datatypes = datatypes if datatypes is not None else []
+
+    def to_dict(self) -> dict:
+        return add_comment(self, { 'name': self.name, 'datatypes': [ datatype.to_dict() for datatype in self.datatypes ] })
+
+
+def dict_or_list(elements):
+    # The converter returns a single declaration as a dictionary,
+    # and several as a list
+    if len(elements) == 1:
+        return elements[0].to_dict()
+
+    return [ element.to_dict() for element in elements ]
+
+
+def as_list(dict_or_list):
+    return dict_or_list if isinstance(dict_or_list, list) else [ dict_or_list ]
+
+
+class Package(Element):
+    __slots__ = ('import_models', 'import_namespaces', 'type_collections', 'interfaces')
+
+    def __init__(self, name, import_models=None, import_namespaces=None,
+                 type_collections=None, interfaces=None):
+        super().__init__(name)
+        # Lists of file names, and of (namespace, file name) tuples
+        self.import_models = import_models
+        self.import_namespaces = import_namespaces
+        self.type_collections = type_collections if type_collections is not None else []
+        self.interfaces = interfaces if interfaces is not None else []
+
+    def to_dict(self) -> dict:
+        res = { 'name': self.name }
+        if self.import_models is not None:
+            res['import_models'] = [ { 'file': file_name } for file_name in self.import_models ]
+
+        if self.import_namespaces is not None:
+            res['import_namespaces'] = [ { 'namespace': namespace, 'file': file_name }
+                                         for (namespace, file_name) in self.import_namespaces ]
+
+        if self.type_collections:
+            res['types'] = dict_or_list(self.type_collections)
+
+        if self.interfaces:
+            res['interfaces'] = dict_or_list(self.interfaces)
+
+        return res
+
+
+#
+# Building the model
+#
+#  The datatypes resolved by the converter are the very dictionaries
+#  stored in the 'datatypes' list of the type collection that defines
+#  them. The builder maps each of them to its model object and links
+#  the references once all results of a project have been built.
+#
+class ModelBuilder:
+    def __init__(self):
+        # id(datatype dictionary) -> model object. The dictionaries are
+        # kept in _datatypes until link(), so that no id is reused.
+        self._types = {}
+        self._datatypes = []
+        # (model object, resolved datatype) to link
+        self._pending = []
+        # (model object, resolved base) to link
+        self._pending_bases = []
+
+    def _range(self, dict_tree):
+        range = dict_tree.get('range')
+        if range is None:
+            return None
+
+        return (range['min_range'], range['max_range'])
+
+    def _reference(self, obj, dict_tree):
+        if '_resolved_datatype' in dict_tree:
+            self._pending.append((obj, dict_tree['_resolved_datatype']))
+
+        return self._comment(obj, dict_tree)
+
+    def _comment(self, obj, dict_tree):
+        obj.comment = dict_tree.get('comment')
+        return obj
+
+    def _member(self, dict_tree):
+        return self._reference(Member(dict_tree['name'],
+                                      value=dict_tree.get('value', OMITTED),
+                                      datatype=dict_tree.get('datatype'),
+                                      range=self._range(dict_tree),
+                                      array_size=dict_tree.get('array_size')),
+                               dict_tree)
+
+    def _base(self, obj, dict_tree):
+        if '_resolved_extends' in dict_tree:
+            self._pending_bases.append((obj, dict_tree['_resolved_extends']))
+
+        return self._comment(obj, dict_tree)
+
+    def _map_type(self, dict_tree):
+        if dict_tree is None:
+            return None
+
+        return self._reference(MapType(datatype=dict_tree.get('datatype'),
+                                       range=self._range(dict_tree),
+                                       array_size=dict_tree.get('array_size')),
+                               dict_tree)
+
+    def _members(self, dict_tree):
+        if dict_tree is None:
+            return None
+
+        return [ self._member(member) for member in dict_tree['members'] ]
+
+    def datatype(self, dict_tree):
+        obj = self._types.get(id(dict_tree))
+        if obj is not None:
+            return obj
+
+        type_tag = dict_tree.get('type')
+        if type_tag is None:
+            obj = self._reference(Array(dict_tree['name'],
+                                        datatype=dict_tree.get('datatype'),
+                                        range=self._range(dict_tree),
+                                        array_size=dict_tree['array_size']),
+                                  dict_tree)
+        elif type_tag == 'constant':
+            obj = self._reference(Constant(dict_tree['name'],
+                                           value=dict_tree.get('value'),
+                                           datatype=dict_tree.get('datatype'),
+                                           range=self._range(dict_tree)),
+                                  dict_tree)
+        elif type_tag == 'map':
+            obj = self._base(Map(dict_tree['name'],
+                                 self._map_type(dict_tree.get('key_type')),
+                                 self._map_type(dict_tree.get('value_type')),
+                                 dict_tree.get('extends')),
+                             dict_tree)
+        elif 'members' in dict_tree:
+            obj = self._base(compound_classes[type_tag](dict_tree['name'],
+                                                        [ self._member(member) for member in dict_tree['members'] ],
+                                                        dict_tree.get('extends')),
+                             dict_tree)
+        else:
+            # The converter tags typedefs as unions
+            obj = self._reference(Typedef(dict_tree['name'],
+                                          type_tag=type_tag,
+                                          datatype=dict_tree.get('datatype'),
+                                          range=self._range(dict_tree),
+                                          array_size=dict_tree.get('array_size')),
+                                  dict_tree)
+
+        self._types[id(dict_tree)] = obj
+        self._datatypes.append(dict_tree)
+        return obj
+
+    def _error(self, dict_tree):
+        if dict_tree is None:
+            return None
+
+        if 'members' in dict_tree:
+            return self._comment(ErrorEnumeration([ self._member(member) for member in dict_tree['members'] ]), dict_tree)
+
+        return self._reference(ErrorType(datatype=dict_tree.get('datatype')), dict_tree)
+
+    def _method(self, dict_tree):
+        return self._comment(Method(dict_tree['name'],
+                                    self._members(dict_tree.get('in')),
+                                    self._members(dict_tree.get('out')),
+                                    dict_tree.get('selector'),
+                                    self._error(dict_tree.get('error'))),
+                             dict_tree)
+
+    def _broadcast(self, dict_tree):
+        return self._comment(Broadcast(dict_tree['name'], self._members(dict_tree.get('out')), dict_tree.get('selector')),
+                             dict_tree)
+
+    def _attribute(self, dict_tree):
+        return self._reference(Attribute(dict_tree['name'],
+                                         readonly=dict_tree.get('readonly', False),
+                                         no_read=dict_tree.get('no_read', False),
+                                         no_subscriptions=dict_tree.get('no_subscriptions', False),
+                                         datatype=dict_tree.get('datatype'),
+                                         range=self._range(dict_tree),
+                                         array_size=dict_tree.get('array_size')),
+                               dict_tree)
+
+    def interface(self, dict_tree):
+        obj = self._types.get(id(dict_tree))
+        if obj is not None:
+            return obj
+
+        datatypes = dict_tree.get('datatypes')
+        methods = dict_tree.get('methods')
+        broadcasts = dict_tree.get('events')
+        attributes = dict_tree.get('attributes')
+        obj = self._base(Interface(dict_tree['name'],
+                                   None if methods is None else [ self._method(method) for method in methods ],
+                                   None if broadcasts is None else [ self._broadcast(broadcast) for broadcast in broadcasts ],
+                                   None if attributes is None else [ self._attribute(attribute) for attribute in attributes ],
+                                   dict_tree.get('contract'),
+                                   dict_tree.get('extends'),
+                                   None if datatypes is None else [ self.datatype(datatype) for datatype in datatypes ]),
+                         dict_tree)
+
+        self._types[id(dict_tree)] = obj
+        self._datatypes.append(dict_tree)
+        return obj
+
+    def build(self, result: dict) -> Package:
+        # result is the dictionary returned by convert_fidl_tree().
+        # References are linked by link().
+        package = Package(result['name'])
+
+        if 'import_models' in result:
+            package.import_models = [ imp['file'] for imp in result['import_models'] ]
+
+        if 'import_namespaces' in result:
+            package.import_namespaces = [ (imp['namespace'], imp['file'])
+                                          for imp in result['import_namespaces'] ]
+
+        if 'types' in result:
+            package.type_collections = [ self._comment(TypeCollection(types['name'],
+                                                                      [ self.datatype(datatype) for datatype in types['datatypes'] ]),
+                                                       types)
+                                         for types in as_list(result['types']) ]
+
+        if 'interfaces' in result:
+            package.interfaces = [ self.interface(interface) for interface in as_list(result['interfaces']) ]
+
+        return package
+
+    def link(self):
+        # Resolved datatypes that are not part of any built result,
+        # such as types of a file that was not built, get a model
+        # object of their own.
+        while self._pending or self._pending_bases:
+            while self._pending:
+                (obj, resolved) = self._pending.pop()
+                obj.type = resolved if isinstance(resolved, str) else self.datatype(resolved)
+
+            while self._pending_bases:
+                (obj, base) = self._pending_bases.pop()
+                obj.base = self.interface(base) if isinstance(obj, Interface) else self.datatype(base)
+
+        self._types = {}
+        self._datatypes = []
+        return None
+
+
+compound_classes = {
+    'struct': Struct,
+    'union': Union,
+    'enumeration': Enumeration,
+}
+
+
+def build_model(result: dict) -> Package:
+    builder = ModelBuilder()
+    package = builder.build(result)
+    builder.link()
+    return package
+
+
+def build_project_model(project) -> dict:
+    # File name -> Package for all files of a loaded project.Project,
+    # with references linked across files. Files that could not be
+    # read or parsed when collecting diagnostics are left out, and
+    # are reported in the diagnostics of the project.
+    builder = ModelBuilder()
+    res = {}
+    for (file_name, fidl_file) in project.files.items():
+        if fidl_file is not None:
+            res[file_name] = builder.build(fidl_file.result)
+
+    builder.link()
+    return res
@@ -4,45 +4,137 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 #
+import contextvars
 import lark
-import json
 from . import type_manager
+from .comment import CommentIndex, current_comments, declaration_header, error_header
+from . import diagnostics as diag
+from .expression import Expression, compile_expression, compile_guard, check_constant
+from .usage import element_kind
+from .tracer import Tracer, TRACE_CALLS
+from .parser import get_parser, parse_text
+from .profile import Profiler, profiled
 
-indent_level = 0
-func_stack = []
-def indent(func):
-    def wrap(*args, **kwargs):
-        global indent_level
-        global current_func
-        func_stack.append(func.__name__)
-        indent_level = indent_level + 2
-        res = func(*args, **kwargs)
-        indent_level = indent_level - 2
-        func_stack.pop()
-        return res
-
-    return wrap
+#
+# Conversion engine
+#
+#  The conversion map below declares how a lark tree is converted
+#  into a dictionary. Each map entry is a tuple of a helper function
+#  and its arguments.
+#
+#  A parse map is compiled once into a list of handlers by calling
+#  the helper of each entry with a MapCompiler and the entry arguments.
+#  The helper returns a handler(state, lark_tree, index) closure
+#  with any sub parse maps already compiled.
+#
+#  When a lark tree node is processed its children are indexed by rule
+#  name and token type in a single pass. The handlers look up the
+#  children they need in that index, making the cost of processing a
+#  node linear in the number of children and map entries.
+#
+#  All state of a conversion is kept in the state dictionary passed to
+#  the handlers, and lark trees and tokens are never modified. Files
+#  can be converted concurrently in multiple threads, each with its
+#  own state. A Tracer must not be shared by concurrent conversions.
+#
+#  Maps compiled for collecting mode report conversion errors to the
+#  diagnostics.Diagnostics in state['diagnostics'] and skip the element
+#  in error, and keep the positions needed to report them.
+#
+#  Maps compiled with a profile.Profiler count the nodes they convert,
+#  and time datatype resolution as a phase of its own.
+#
+class MapCompiler:
+    def __init__(self, tracer: Tracer = None, collecting: bool = False, profiler: Profiler = None):
+        if tracer is not None and not tracer.enabled:
+            tracer = None
+
+        self._tracer = tracer
+        self._collecting = collecting
+        self._profiler = profiler
+        self._compiled = {}
+
+    @property
+    def collecting(self):
+        return self._collecting
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    def compile(self, parse_map):
+        # The same map (such as type_map) may be used in multiple
+        # places. Compile each map and map entry only once.
+        key = id(parse_map)
+        if key not in self._compiled:
+            handlers = [ self.compile_entry(entry) for entry in parse_map ]
+            if self._profiler is not None and handlers:
+                # The handlers of a map are run once per node, starting
+                # with the first one
+                handlers[0] = self._profiler.counted('nodes', handlers[0])
+
+            self._compiled[key] = (parse_map, handlers)
+
+        return self._compiled[key][1]
+
+    def compile_entry(self, map_entry):
+        key = id(map_entry)
+        if key in self._compiled:
+            return self._compiled[key][1]
+
+        (map_func, *arg) = map_entry
+        handler = map_func(self, *arg)
+        if self._tracer is not None:
+            entry = arg[0] if arg and isinstance(arg[0], str) else None
+            handler = self._tracer.instrument(handler, map_func.__name__, entry)
+
+        # Keep map_entry alive so that its id is not reused
+        self._compiled[key] = (map_entry, handler)
+        return handler
+
+
+class ConvertedTree(lark.Tree):
+    # A top level declaration that was converted by DeclarationConverter
+    # while being parsed. The subtree is dropped and only the conversion
+    # result is kept.
+    def __init__(self, data, result):
+        super().__init__(data, [])
+        self.result = result
+
+    def __deepcopy__(self, memo):
+        # lark copies the value stack to describe a syntax error. The
+        # result is not changed by the parser, and is shared.
+        return self
+
+
+def index_lark_tree(lark_tree):
+    # Sort the children of a node into subtrees by rule name and
+    # tokens by type. Only the first token of each type is kept.
+    trees = {}
+    tokens = {}
+    for child in lark_tree.children:
+        if isinstance(child, lark.Tree):
+            if child.data in trees:
+                trees[child.data].append(child)
+            else:
+                trees[child.data] = [ child ]
+            continue
 
-def ind():
-    global indent_level
-    return f"{' '*indent_level}{func_stack[-1]}(): "
+        if isinstance(child, lark.Token) and child.type not in tokens:
+            tokens[child.type] = child
 
-@indent
-def get_lark_tree_entries_by_name(state, lark_tree, lark_entry):
-    return [ child for child in lark_tree.children if isinstance(child, lark.Tree) and child.data == lark_entry ]
+    return (trees, tokens)
 
-@indent
-def get_lark_tree_token_by_type(state, lark_tree, lark_type):
-    for child in lark_tree.children:
-        if isinstance(child, lark.Token) and child.type == lark_type:
-            return child
 
-    return None
+def run_handlers(state, lark_tree, index, handlers):
+    # A single result is returned as is, so that a datatype added to
+    # the namespace by add_datatype() is the dictionary in the result.
+    if len(handlers) == 1:
+        return handlers[0](state, lark_tree, index) or {}
 
-def process_lark_tree(state, lark_tree, parse_map):
     result = {}
-    for (map_func, *arg) in parse_map:
-        func_res = map_func(state, lark_tree, *arg)
+    for handler in handlers:
+        func_res = handler(state, lark_tree, index)
         if not func_res:
             continue
 
@@ -51,285 +143,584 @@ def process_lark_tree(state, lark_tree, parse_map):
     return result
 
 
-@indent
-def process_lark_tree_entry(state, lark_tree, lark_entry, parse_map):
-    # Locate the dictionary entry we want to process
-    print(f"{ind()}Called for {lark_tree.data}[{lark_entry}]")
+def process_lark_tree(state, lark_tree, handlers):
+    if isinstance(lark_tree, ConvertedTree):
+        return lark_tree.result
 
-    entries = get_lark_tree_entries_by_name(state, lark_tree, lark_entry)
-    if entries == []:
-        print(f"{ind()}No match for {lark_entry}. Return False.")
-        return None
+    return run_handlers(state, lark_tree, index_lark_tree(lark_tree), handlers)
 
-    if len(entries) > 1:
-        print(f"{ind()}Too many matches, {len(entries)} in {lark_entry}. exit.")
-        raise Exception(f"Too many matches for {lark_tree.data}[{lark_entry}]-> {len(entries)}")
 
-    result = process_lark_tree(state, entries[0], parse_map)
-    print(f"{ind()}Result: {type(result)} - {len(result)} elements")
-    return result
+def process_lark_tree_entry(compiler, lark_entry, parse_map):
+    handlers = compiler.compile(parse_map)
 
-@indent
-def create_entry(state, lark_tree, lark_type, target_name, target_type=str):
-    res = get_lark_tree_token_by_type(state, lark_tree, lark_type)
-    if not res:
-        print(f"{ind()}Not found: {lark_type}")
-        return None
+    def handler(state, lark_tree, index):
+        # Locate the dictionary entry we want to process
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-    print(f"{ind()}Found {lark_type} = {res} -> {target_name}")
-    if target_type == int and res.value=="minInt":
-        res.value = -9223372036854775808
+        if len(entries) > 1:
+            raise Exception(f"Too many matches for {lark_tree.data}[{lark_entry}]-> {len(entries)}")
 
-    if target_type == int and res.value=="maxInt":
-        res.value = 9223372036854775807
+        return process_lark_tree(state, entries[0], handlers)
 
-    return { target_name: target_type(res.value) }
+    if not compiler.collecting:
+        return handler
 
+    def collecting_handler(state, lark_tree, index):
+        # The first entry is used, and the others are reported
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-@indent
-def create_target_dictionary(state, lark_tree, lark_entry, target_entry, parse_map):
-    print(f"{ind()}Called for {lark_tree.data}[{lark_entry}] -> {target_entry}")
-    res = process_lark_tree_entry(state, lark_tree, lark_entry, parse_map)
-    if not res:
-        print(f"{ind()}Got None back. No action.")
-        return None
+        for entry in entries[1:]:
+            state['diagnostics'].report(f"Unexpected {lark_entry} in {lark_tree.data}", diag.first_token(entry))
 
-    print(f"{ind()}Create new {target_entry} dictionary with: {type(res)} - {len(res)} elements.")
-    return { target_entry: res }
+        return process_lark_tree(state, entries[0], handlers)
 
+    return collecting_handler
 
-@indent
-def create_target_list(state, lark_tree, lark_entry, target_entry, parse_map):
-    print(f"{ind()}Called for {lark_tree.data}[{lark_entry}] -> {target_entry}")
-    entries = get_lark_tree_entries_by_name(state, lark_tree, lark_entry)
-    if entries == []:
-        return None
 
-    res_list = []
-    for entry in entries:
-        res = process_lark_tree(state, entry, parse_map)
-        if res is not None:
-            res_list.append(res)
-
-    return { target_entry: res_list }
-
-
-@indent
-def aggregate_list(state, lark_tree, element_name, parse_map):
-    result = []
-
-    for (map_func, *arg) in parse_map:
-        res = map_func(state, lark_tree, *arg)
-        if res and element_name in res:
-            result.extend(res[element_name])
-
-    print(f"{ind()}Will aggregate {len(result)} elements into {element_name}")
-    return { element_name: result }
-
-@indent
-def create_entry_from_type_token(state, lark_tree, target_entry):
-
-    conversion_map = {
-        'FIDL_INT8': 'int8',
-        'FIDL_UINT8': 'uint8',
-        'FIDL_INT16': 'int16',
-        'FIDL_UINT16': 'uint16',
-        'FIDL_INT32': 'int32',
-        'FIDL_UINT32': 'uint32',
-        'FIDL_INT64': 'int64',
-        'FIDL_UINT64': 'uint64',
-        'FIDL_FLOAT': 'float',
-        'FIDL_DOUBLE': 'double',
-        'FIDL_BOOLEAN': 'boolean',
-        'FIDL_STRING': 'string',
-        'FIDL_BYTEBUFFER': 'binary'
-    }
+# Integer range limits given by name
+int_limits = {
+    "minInt": -9223372036854775808,
+    "maxInt": 9223372036854775807
+}
 
-    print(f"{ind()}Called for {lark_tree.data} -> {target_entry}")
-    if len(lark_tree.children) == 0:
-        print(f"{ind()}{lark_tree.data} has no tokens. No action")
-        return None
 
-    if len(lark_tree.children) > 1:
-        return None
+# Entries holding names that are resolved once the file is converted.
+# In collecting mode they keep the position of their token.
+located_entries = ('datatype', 'extends')
+
+
+def create_entry(compiler, lark_type, target_name, target_type=str):
+    def handler(state, lark_tree, index):
+        res = index[1].get(lark_type)
+        if not res:
+            return None
+
+        value = res.value
+        if target_type == int:
+            value = int_limits.get(value, value)
 
-    if not isinstance(lark_tree.children[0], lark.Token):
+        return { target_name: target_type(value) }
+
+    if compiler.collecting and target_name in located_entries and target_type == str:
+        def located_handler(state, lark_tree, index):
+            res = index[1].get(lark_type)
+            if not res:
+                return None
+
+            return { target_name: diag.Located(res.value, res.line, res.column) }
+
+        return located_handler
+
+    return handler
+
+
+def collect_element(state, lark_tree, handlers):
+    # process_lark_tree() in collecting mode. An element that fails to
+    # convert is reported and None is returned. The position of the
+    # converted element is recorded.
+    token = diag.first_token(lark_tree)
+    try:
+        res = process_lark_tree(state, lark_tree, handlers)
+    except Exception as e:
+        state['diagnostics'].report(str(e), token)
         return None
 
-    token_type = lark_tree.children[0].type
-    return { target_entry: conversion_map.get(token_type, f'UNKNOWN: {token_type}') }
+    if token is not None and res is not None:
+        state['diagnostics'].locate(res, token)
+
+    return res
 
 
-@indent
-def process_one_of(state, lark_tree, options):
-    print(f"{ind()}Called for {lark_tree.data}")
-    for (map_func, *arg) in options:
-        res = map_func(state, lark_tree, *arg)
-        if res:
-            return res
+def create_target_dictionary(compiler, lark_entry, target_entry, parse_map):
+    entry_handler = process_lark_tree_entry(compiler, lark_entry, parse_map)
 
-    return None
+    def handler(state, lark_tree, index):
+        res = entry_handler(state, lark_tree, index)
+        if not res:
+            return None
 
+        return { target_entry: res }
 
-@indent
-def create_static_entry(state, lark_elem, token_name, token_value):
-    return { token_name: token_value }
+    return handler
 
-def push_namespace(state, lark_elem, ns_type, parse_map):
 
-    ns_name = get_lark_tree_token_by_type(state, lark_elem, ns_type)
-    if ns_name is None:
-        raise Exception(f"Could not find {ns_type}.")
+def create_target_dictionaries(compiler, lark_entry, target_entry, parse_map):
+    # As create_target_dictionary(), for an entry that can occur more
+    # than once. Several entries are converted into a list of
+    # dictionaries, and a single entry into a dictionary, as the
+    # converter always did. declarations() returns either as a list.
+    handlers = compiler.compile(parse_map)
 
+    def handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-    new_ns = type_manager.NameSpace(ns_name.value)
-    state['ns'].add_namespace(new_ns)
-    state['ns'] = new_ns
+        if len(entries) == 1:
+            return { target_entry: process_lark_tree(state, entries[0], handlers) }
 
-    res = process_lark_tree(state, lark_elem, parse_map)
+        return { target_entry: [ process_lark_tree(state, entry, handlers) for entry in entries ] }
 
-    state['ns'] = state['ns'].parent
+    if not compiler.collecting:
+        return handler
 
-    if state['ns'] is None:
-        raise Exception("Popped last element on namespace stack.")
+    def collecting_handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-    return res
+        res = [ collect_element(state, entry, handlers) for entry in entries ]
+        res = [ elem for elem in res if elem is not None ]
+        if not res:
+            return None
 
+        return { target_entry: res[0] if len(res) == 1 else res }
 
-def add_datatype(state, lark_elem, parse_map):
-    res = process_lark_tree(state, lark_elem, parse_map)
+    return collecting_handler
 
-    # Add datatype to symbol table for current
-    # namestate
 
-    print(f"{ind()}ADDING DATATYPE---------------- {res['name']}")
+def declarations(result: dict, key: str) -> list:
+    # The type collections or interfaces of a result, by key 'types' or
+    # 'interfaces', as a list, whether the file declares one or several
+    value = result.get(key)
+    if value is None:
+        return []
 
-    state['ns'].add_type(type_manager.Type(res['name'], res))
+    return value if isinstance(value, list) else [ value ]
 
-    return res
 
-@indent
-def resolve_datatypes(state, lark_tree, parse_map):
+def create_target_list(compiler, lark_entry, target_entry, parse_map):
+    handlers = compiler.compile(parse_map)
 
-    def _resolve_datatype(dict_tree):
-        resolved_result = None
-        for k, v in dict_tree.items():
-            print(f"{ind()} Checking {k}")
+    def handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-            # Is this the already resolved datatype?
-            if k == '_resolved_datatype':
-                continue
+        return { target_entry: [ process_lark_tree(state, entry, handlers) for entry in entries ] }
 
-            if k == 'datatype':
-                # Is this a native type?
-                if v in [ 'int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32',
-                          'int64', 'uint64', 'float', 'double','boolean','string', 'binary' ]:
-                    resolved_result = v
-                    continue
+    if not compiler.collecting:
+        return handler
 
-                # Resolve type as local name
-                res_dt = state['ns'].resolve_type(v)
+    def collecting_handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
 
-                if not res_dt:
-                    # Resolve type as fully qualified name
-                    res_dt = state['ns'].resolve_type(f".{v}")
-                    if not res_dt:
-                        raise Exception(f"Could not resolve type name {v}")
+        res = [ collect_element(state, entry, handlers) for entry in entries ]
+        return { target_entry: [ elem for elem in res if elem is not None ] }
 
-                resolved_result = res_dt.info
-                continue
+    return collecting_handler
+
+
+def aggregate_list(compiler, element_name, parse_map, omit_empty=False):
+    handlers = compiler.compile(parse_map)
+
+    def handler(state, lark_tree, index):
+        result = []
+        for sub_handler in handlers:
+            res = sub_handler(state, lark_tree, index)
+            if res and element_name in res:
+                result.extend(res[element_name])
+
+        if omit_empty and not result:
+            return None
+
+        return { element_name: result }
+
+    return handler
+
+
+# Native datatype names by primitive type token
+type_token_names = {
+    'FIDL_INT8': 'int8',
+    'FIDL_UINT8': 'uint8',
+    'FIDL_INT16': 'int16',
+    'FIDL_UINT16': 'uint16',
+    'FIDL_INT32': 'int32',
+    'FIDL_UINT32': 'uint32',
+    'FIDL_INT64': 'int64',
+    'FIDL_UINT64': 'uint64',
+    'FIDL_FLOAT': 'float',
+    'FIDL_DOUBLE': 'double',
+    'FIDL_BOOLEAN': 'boolean',
+    'FIDL_STRING': 'string',
+    'FIDL_BYTEBUFFER': 'binary'
+}
+
+
+def create_entry_from_type_token(compiler, target_entry):
+    def handler(state, lark_tree, index):
+        if len(lark_tree.children) != 1:
+            return None
+
+        if not isinstance(lark_tree.children[0], lark.Token):
+            return None
+
+        token_type = lark_tree.children[0].type
+        return { target_entry: type_token_names.get(token_type, f'UNKNOWN: {token_type}') }
+
+    return handler
+
+
+def process_one_of(compiler, options):
+    handlers = compiler.compile(options)
+
+    def handler(state, lark_tree, index):
+        for option in handlers:
+            res = option(state, lark_tree, index)
+            if res:
+                return res
+
+        return None
+
+    return handler
+
+
+def create_static_entry(compiler, token_name, token_value):
+    def handler(state, lark_elem, index):
+        return { token_name: token_value }
+
+    return handler
+
+
+def push_namespace(compiler, ns_type, parse_map):
+    handlers = compiler.compile(parse_map)
+
+    def handler(state, lark_elem, index):
+        ns_name = index[1].get(ns_type)
+        if ns_name is None:
+            raise Exception(f"Could not find {ns_type}.")
+
+        state['ns'] = state['ns'].add_namespace(type_manager.NameSpace(ns_name.value))
+        try:
+            res = run_handlers(state, lark_elem, index, handlers)
+        finally:
+            state['ns'] = state['ns'].parent
 
-            if isinstance(v, dict):
-                _resolve_datatype(v)
+        if state['ns'] is None:
+            raise Exception("Popped last element on namespace stack.")
+
+        return res
+
+    return handler
+
+
+def add_datatype(compiler, parse_map):
+    handlers = compiler.compile(parse_map)
+
+    def handler(state, lark_elem, index):
+        res = run_handlers(state, lark_elem, index, handlers)
+
+        # Add datatype to symbol table for current
+        # namestate
+        state['ns'].add_type(type_manager.Type(res['name'], res))
+
+        return res
+
+    return handler
+
+
+native_datatypes = frozenset(type_token_names.values())
+
+
+def guarded(report, where, func, *args):
+    # func(*args). If report is given, an exception is passed to
+    # report(message, where) instead of being raised.
+    if report is None:
+        return func(*args)
+
+    try:
+        return func(*args)
+    except Exception as e:
+        report(str(e), where)
+        return None
+
+
+def resolve_dict_tree(dict_tree, resolve_name, report=None):
+    # Add _resolved_datatype to all dictionaries in dict_tree that
+    # have a datatype. resolve_name(name) returns the type_manager.Type
+    # for a datatype name, or None.
+    #
+    # If given, report(message, where) is called with each error,
+    # and the rest of dict_tree is resolved.
+    resolved_result = None
+    for k, v in dict_tree.items():
+        # Is this the already resolved datatype, or base type?
+        if k == '_resolved_datatype' or k == '_resolved_extends':
+            continue
+
+        if k == 'datatype':
+            # Is this a native type?
+            if v in native_datatypes:
+                resolved_result = v
                 continue
 
-            if isinstance(v, list):
-                [ _resolve_datatype(v_elem) for v_elem in v ]
+            res_dt = resolve_name(v)
+            if not res_dt:
+                if report is None:
+                    raise Exception(f"Could not resolve type name {v}")
+
+                report(f"Could not resolve type name {v}", v)
                 continue
 
-        if resolved_result is not None:
-            dict_tree['_resolved_datatype'] = resolved_result
+            resolved_result = res_dt.info
+            continue
+
+        if isinstance(v, dict):
+            resolve_dict_tree(v, resolve_name, report)
+            continue
+
+        if isinstance(v, list):
+            for v_elem in v:
+                resolve_dict_tree(v_elem, resolve_name, report)
+            continue
+
+        if isinstance(v, Expression):
+            guarded(report, dict_tree, v.store, dict_tree, k)
+            if dict_tree[k] is v:
+                # Reported, and put back by Expression.bind()
+                dict_tree[k] = None
+            continue
+
+    if resolved_result is not None:
+        dict_tree['_resolved_datatype'] = resolved_result
+
+    if dict_tree.get('type') == 'constant':
+        guarded(report, dict_tree, check_constant, dict_tree)
+
+
+def resolve_body(dict_tree, resolve_name, record=None, report=None):
+    # resolve_dict_tree() on the body of a type collection or an
+    # interface. If given, record(list name, element, type) is called
+    # for each type_manager.Type resolved for an element of the lists
+    # in the body, such as a datatype, method or broadcast.
+    if record is None:
+        resolve_dict_tree(dict_tree, resolve_name, report)
+        return None
+
+    def recording(list_name, element):
+        def resolve_element_name(name):
+            res = resolve_name(name)
+            if res:
+                record(list_name, element, res)
+            return res
 
+        return resolve_element_name
+
+    for (k, v) in dict_tree.items():
+        if isinstance(v, list):
+            for v_elem in v:
+                resolve_dict_tree(v_elem, recording(k, v_elem), report)
+        elif isinstance(v, dict):
+            resolve_dict_tree(v, resolve_name, report)
+
+    return None
+
+
+def interface_resolver(resolve_name, extends):
+    # resolve_name(name) for the namespace of an interface extending
+    # the interface named extends. Types that are not in scope are
+    # looked up in the namespaces of the extended interfaces.
+    if extends is None:
+        return resolve_name
+
+    def resolve_inherited(name):
+        res = resolve_name(name)
+        base_name = extends
+        seen = set()
+        while not res and base_name is not None:
+            base = resolve_name(base_name)
+            if not base or id(base) in seen or base.name not in base.parent.namespaces:
+                return None
+
+            seen.add(id(base))
+            res = base.parent.namespaces[base.name].resolve_type(name)
+            base_name = base.info.get('extends')
+
+        return res
+
+    return resolve_inherited
+
+
+def resolve_datatypes(compiler, parse_map):
     if len(parse_map) != 1:
         raise Exception(f"resolve_datatypes need a parse map with lenght one. Got {len(parse_map)}")
 
-    (map_func, *arg) = parse_map[0]
-    res = map_func(state, lark_tree, *arg)
-    _resolve_datatype(res)
-    return res
+    map_handler = compiler.compile_entry(parse_map[0])
+
+    def handler(state, lark_tree, index):
+        # Collect the expressions using named constants in res
+        outer_expressions = state.get('expressions')
+        expressions = state['expressions'] = []
+        try:
+            res = map_handler(state, lark_tree, index)
+        finally:
+            state['expressions'] = outer_expressions
+
+        return resolve(state, index, res, expressions)
+
+    def resolve(state, index, res, expressions):
+        # Resolution is deferred until all files of a project
+        # are converted. Remember the namespace path of res,
+        # and its expressions.
+        if 'unresolved' in state:
+            state['unresolved'].append(([ ns.name for ns in state['ns'].path()[1:] ], res, expressions))
+            return res
 
-@indent
-def evaluate_expression(state, lark_tree, expr_name, target_name):
-    tree_map = {
-        "expression": lambda expr_elem: eval_tree(expr_elem),
-        "primitive_type": lambda expr_elem: eval_tree(expr_elem),
-        "defined_typs": lambda expr_elem: eval_tree(expr_elem),
-        "arithmetic_op": lambda expr_elem: eval_tree(expr_elem),
-        "arit_add": lambda expr_elem: eval_expression(expr_elem, "lhs") + eval_expression(expr_elem, "rhs"),
-        "arit_sub": lambda expr_elem: eval_expression(expr_elem, "lhs") - eval_expression(expr_elem, "rhs"),
-        "arit_mul": lambda expr_elem: eval_expression(expr_elem, "lhs") * eval_expression(expr_elem, "rhs"),
-        "arit_div": lambda expr_elem: eval_expression(expr_elem, "lhs") / eval_expression(expr_elem, "rhs"),
-        "arit_div": lambda expr_elem: eval_expression(expr_elem, "lhs") / eval_expression(expr_elem, "rhs"),
-    }
+        # Resolve type as local name or as fully qualified name, or
+        # as a type of an extended interface. Expressions are bound
+        # before any of them is evaluated, so that constants can refer
+        # to constants declared after them.
+        extends = index[0].get('extends_interface')
+        resolve_name = interface_resolver(state['ns'].resolve_scoped_type,
+                                          extends[0].children[0].value if extends else None)
+        for expr in expressions:
+            expr.bind(resolve_name)
+
+        record = None
+        if 'usage' in state:
+            record = state['usage'].recorder(state['ns'].qualified_name)
+
+        report = state['diagnostics'].report if 'diagnostics' in state else None
+        resolve_body(res, resolve_name, record, report)
+        return res
 
-    token_map = {
-        "FIDL_CONST_TRUE": lambda token: True,
-        "FIDL_CONST_FALSE": lambda token: False,
-        "FIDL_CONST_INT": lambda token: int(token),
-        "FIDL_CONST_HEX": lambda token: int(token, 16),
-        "FIDL_CONST_BIN": lambda token: int(token, 2),
-        "FIDL_CONST_FLOAT": lambda token: float(token),
-        "FIDL_CONST_DOUBLE": lambda token: float(token),
-        "FIDL_CONST_STRING": lambda token: token.strip('"'),
-        "FIDL_NAME": lambda token: print(f"WE DO NOT EVAL NAMES: {token.value}") + sys.exit(255)
-    }
+    if compiler.profiler is not None:
+        resolve = compiler.profiler.timed('resolve', resolve)
 
-    @indent
-    def eval_token(expr_token):
-        print(f"{ind()}Evaluating {expr_token}")
+    return handler
 
 
-    @indent
-    def eval_tree(expr_tree):
-        print(f"{ind()}Evaluting {expr_tree.data}")
+def resolve_base(type, resolver, recorder=None):
+    base_name = type.info['extends']
+    base = resolver(type.parent)(base_name)
+    if not base:
+        raise Exception(f"Could not resolve base type {base_name} of {type.qualified_name}")
 
-        for expr in expr_tree.children:
-            print(f"{ind()}Checking {expr}")
-            if isinstance(expr, lark.Token):
-                if expr.type in token_map:
-                    print(f"{ind()}Evaluating token {expr.type} = {expr.value}")
-                    return token_map[expr.type](expr.value)
-                else:
-                    print(f"{ind()}No token lambda available to evaluate {expr.type}")
-                    continue
-            else:
-                if expr.data in tree_map:
-                    print(f"{ind()}Evaluating tree {expr.data}")
-                    return tree_map[expr.data](expr)
-                else:
-                    print(f"{ind()}No tree lambda available to evaluate {expr.data}")
-                    continue
-
-        print(f"{ind()}No hit")
-        return None
+    # Interfaces are the types that have a namespace of their own
+    list_name = 'interfaces' if type.name in type.parent.namespaces else 'datatypes'
+    base_list_name = 'interfaces' if base.name in base.parent.namespaces else 'datatypes'
+    if element_kind(list_name, type.info) != element_kind(base_list_name, base.info):
+        raise Exception(f"{type.qualified_name} cannot extend {base.qualified_name}")
 
-    @indent
-    def eval_expression(expr_tree, expr_name):
-        print(f"{ind()}Searching for {expr_name} in {expr_tree.data}")
+    type.base = base
+    type.info['_resolved_extends'] = base.info
+    if recorder is not None:
+        recorder(type.parent)(list_name, type.info, base)
+
+    return None
 
-        for expr in expr_tree.children:
-            print(f"{ind()}Checking {expr}")
-            if not isinstance(expr, lark.Tree) or expr.data != expr_name:
-                print(f"{ind()}Nope")
-                continue
 
-            return eval_tree(expr)
+def resolve_bases(types, resolver, recorder=None, report=None):
+    # Link each type_manager.Type in types that extends another type
+    # to its base, and add _resolved_extends with the base dictionary
+    # to its info. resolver(ns) returns the resolve_name function for
+    # names used in namespace ns. If given, recorder(ns) returns the
+    # record function for the usage.UsageIndex, as for resolve_body(),
+    # and report(message, where) is called with each error.
+    for type in types:
+        if 'extends' in type.info:
+            guarded(report, type.info['extends'], resolve_base, type, resolver, recorder)
 
-        print(f"{ind()}No hit")
+    return None
+
+
+def resolve_state_bases(state, types=None):
+    # resolve_bases() on types, or on all types converted with state,
+    # unless resolution is deferred
+    if 'unresolved' in state:
         return None
 
-    print(f"{ind()}Evaluating {lark_tree.data}/{expr_name}")
-    return { target_name: tree_map[expr_name](lark_tree) }
+    recorder = None
+    if 'usage' in state:
+        recorder = lambda ns: state['usage'].recorder(ns.qualified_name)
+
+    resolve_bases(state['ns'].all_types() if types is None else types,
+                  lambda ns: ns.resolve_scoped_type, recorder,
+                  state['diagnostics'].report if 'diagnostics' in state else None)
+    return None
+
+
+def declaration_types(ns, rule, name):
+    # Types added to namespace ns by the type collection or interface
+    # with the given name, including the interface itself
+    types = [ ns.types[name] ] if rule == 'interface' else []
+    types.extend(ns.namespaces[name].all_types())
+    return types
+
+
+def evaluate_expression(compiler, expr_name, target_name):
+    # The expression is compiled once. An expression using named
+    # constants is evaluated by resolve_dict_tree(), once the
+    # datatypes of its body are resolved.
+    def handler(state, lark_tree, index):
+        expr_trees = index[0].get(expr_name)
+        if expr_trees is None:
+            return { target_name: None }
+
+        res = compile_expression(expr_trees[0])
+        if isinstance(res, Expression) and 'expressions' in state:
+            state['expressions'].append(res)
+
+        return { target_name: res }
+
+    return handler
+
+
+def create_guard(compiler, guard_name, target_name):
+    # The guard of a contract transition is compiled once. It is bound
+    # to the namespace with the expressions of its body, and evaluated
+    # by contract.StateMachine.
+    def handler(state, lark_tree, index):
+        guard_trees = index[0].get(guard_name)
+        if guard_trees is None:
+            return None
+
+        res = compile_guard(guard_trees[0])
+        if 'expressions' in state:
+            state['expressions'].append(res)
+
+        return { target_name: res }
+
+    return handler
+
+
+def create_text_list(compiler, lark_entry, target_entry):
+    # List of the source text of each lark_entry subtree
+    def handler(state, lark_tree, index):
+        entries = index[0].get(lark_entry)
+        if entries is None:
+            return None
+
+        return { target_entry: [ ''.join(entry.children).strip() for entry in entries ] }
+
+    return handler
+
+
+def attach_comment(compiler, header=declaration_header):
+    # The structured comment preceding the first token of lark_tree,
+    # if the text between them matches header
+    def handler(state, lark_tree, index):
+        comments = state.get('comments')
+        if not comments:
+            return None
+
+        token = next(lark_tree.scan_values(lambda value: isinstance(value, lark.Token)), None)
+        if token is None:
+            return None
+
+        res = comments.take(token.start_pos, header)
+        if res is None:
+            return None
+
+        return { 'comment': res }
+
+    return handler
 
 
 non_array_type_map =  ( process_one_of, [
@@ -363,115 +754,273 @@ type_map = ( process_one_of, [
     ])
 ])
 
-conversion_map = [
-    ( create_entry, "FIDL_NAME", "name" ), # Package name
-    ( create_target_dictionary, "type_collection", "types", [
-        ( create_entry, "FIDL_NQ_NAME", "name"),
-        ( push_namespace, "FIDL_NQ_NAME", [
-            ( process_lark_tree_entry, "type_collection_body", [
-                ( resolve_datatypes, [
-                    ( aggregate_list, "datatypes", [
-                        ( create_target_list, "base_enumeration", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "type", "enumeration"),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                ( create_target_list, "enumerator_member", "members", [
-                                    ( create_entry, "FIDL_NQ_NAME", "name" ),
-                                    ( evaluate_expression, "expression", "value" )
-                                ])
-                            ])
-                        ]),
-                        ( create_target_list, "base_union", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "type", "union" ),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                ( create_target_list, "member", "members", [
-                                    ( create_entry, "FIDL_NQ_NAME", "name" ),
-                                    ( evaluate_expression, "expression", "value" ),
-                                    type_map
-                                ])
-                            ])
-                        ]),
-                        ( create_target_list, "base_struct", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "type", "struct" ),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                ( create_target_list, "member", "members", [
-                                    ( create_entry, "FIDL_NQ_NAME", "name" ),
-                                    ( evaluate_expression, "expression", "value" ),
-                                    type_map
-                                ])
-                            ])
-                        ]),
-                        ( create_target_list, "typedef", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "type", "union" ),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map
-                            ])
-                        ]),
-                        ( create_target_list, "explicit_array", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "array_size", 0 ),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map
-                            ])
-                        ]),
-                        ( create_target_list, "implicit_array", "datatypes", [
-                            ( add_datatype, [
-                                ( create_static_entry, "array_size", 0 ),
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map
-                            ])
-                        ])
+# Members of enumerations, and of structs and unions
+enumerator_list_map = ( create_target_list, "enumerator_member", "members", [
+    ( create_entry, "FIDL_NQ_NAME", "name" ),
+    ( evaluate_expression, "expression", "value" ),
+    ( attach_comment, )
+])
+
+member_list_map = ( create_target_list, "member", "members", [
+    ( create_entry, "FIDL_NQ_NAME", "name" ),
+    ( evaluate_expression, "expression", "value" ),
+    type_map,
+    ( attach_comment, )
+])
+
+map_member_map = ( process_lark_tree_entry, "map_member", [
+    ( create_target_dictionary, "map_key", "key_type", [ type_map ] ),
+    ( create_target_dictionary, "map_value", "value_type", [ type_map ] )
+])
+
+# Datatypes of type collections and interfaces
+datatype_maps = [
+    ( create_target_list, "base_enumeration", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "enumeration"),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            enumerator_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "inherited_enumeration", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "enumeration"),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            ( create_entry, "FIDL_NAME", "extends"),
+            enumerator_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "base_union", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "union" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            member_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "inherited_union", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "union" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            ( create_entry, "FIDL_NAME", "extends"),
+            member_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "base_struct", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "struct" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            member_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "inherited_struct", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "struct" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            ( create_entry, "FIDL_NAME", "extends"),
+            member_list_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "typedef", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "union" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            type_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "explicit_array", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "array_size", 0 ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            type_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "implicit_array", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "array_size", 0 ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            type_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "map", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "map" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            map_member_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "inherited_map", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "map" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            ( create_entry, "FIDL_NAME", "extends"),
+            map_member_map,
+            ( attach_comment, )
+        ])
+    ]),
+    ( create_target_list, "constant", "datatypes", [
+        ( add_datatype, [
+            ( create_static_entry, "type", "constant" ),
+            ( create_entry, "FIDL_NQ_NAME", "name"),
+            type_map,
+            ( evaluate_expression, "const_init", "value" ),
+            ( attach_comment, )
+        ])
+    ])
+]
+
+type_collection_map = [
+    ( create_entry, "FIDL_NQ_NAME", "name"),
+    ( push_namespace, "FIDL_NQ_NAME", [
+        ( process_lark_tree_entry, "type_collection_body", [
+            ( resolve_datatypes, [
+                ( aggregate_list, "datatypes", datatype_maps )
+            ])
+        ])
+    ]),
+    ( attach_comment, )
+]
+
+# Method and broadcast arguments
+arg_list_map = ( create_target_list, "member", "members", [
+    ( create_entry, "FIDL_NQ_NAME", "name"),
+    type_map,
+    ( attach_comment, )
+])
+
+# Transitions of all triggers of a contract state
+transition_map = [
+    ( create_entry, "FIDL_NQ_NAME", "name" ),
+    ( create_entry, "FIDL_VAR_NAME", "selector" ),
+    ( create_guard, "comparison_op", "guard" ),
+    ( create_entry, "FIDL_TARGET_STATE", "target" ),
+    ( create_text_list, "statement", "actions" )
+]
+
+contract_map = ( create_target_dictionary, "contract", "contract", [
+    ( process_lark_tree_entry, "contract_body", [
+        ( create_target_list, "vars_body", "variables", [
+            ( create_entry, "FIDL_NQ_NAME", "name" ),
+            type_map
+        ]),
+        ( process_lark_tree_entry, "psm_body", [
+            ( create_entry, "FIDL_INITIAL_STATE", "initial" ),
+            ( create_target_list, "psm_state", "states", [
+                ( create_entry, "FIDL_NQ_NAME", "name" ),
+                ( create_target_list, "psm_transition", "transitions", [
+                    ( process_one_of, [
+                        ( process_lark_tree_entry, "on_call",
+                          [ ( create_static_entry, "trigger", "call" ) ] + transition_map ),
+                        ( process_lark_tree_entry, "on_signal",
+                          [ ( create_static_entry, "trigger", "signal" ) ] + transition_map ),
+                        ( process_lark_tree_entry, "on_set",
+                          [ ( create_static_entry, "trigger", "set" ) ] + transition_map ),
+                        ( process_lark_tree_entry, "on_respond",
+                          [ ( create_static_entry, "trigger", "respond" ) ] + transition_map ),
+                        ( process_lark_tree_entry, "on_error",
+                          [ ( create_static_entry, "trigger", "error" ) ] + transition_map )
                     ])
                 ])
             ])
         ])
-    ]),
-    ( create_target_dictionary, "interface", "interfaces", [
+    ])
+])
+
+# The interface is added as a type, so that it can be extended
+interface_map = [
+    ( add_datatype, [
         ( create_entry, "FIDL_NQ_NAME", "name"),
+        ( process_lark_tree_entry, "extends_interface", [
+            ( create_entry, "FIDL_NAME", "extends")
+        ]),
         ( push_namespace, "FIDL_NQ_NAME", [
             ( resolve_datatypes, [
                 ( process_lark_tree_entry, "interface_body", [
+                    ( aggregate_list, "datatypes", datatype_maps, True ),
                     #
                     # Methods
                     #
                     ( create_target_list, "method", "methods", [
                         ( create_entry, "FIDL_NQ_NAME", "name"),
-                        ( create_target_dictionary, "arg_in", "in", [
-                            ( create_target_list, "member", "members", [
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map,
-                            ])
+                        ( create_entry, "FIDL_VAR_NAME", "selector"),
+                        ( create_target_dictionary, "arg_in", "in", [ arg_list_map ]),
+                        ( create_target_dictionary, "arg_out", "out", [ arg_list_map ]),
+                        # Enumerators, or the name of an enumeration
+                        ( create_target_dictionary, "arg_error", "error", [
+                            ( process_one_of, [
+                                ( process_lark_tree_entry, "error_body", [
+                                    ( create_static_entry, "type", "enumeration" ),
+                                    ( create_target_list, "error_member", "members", [
+                                        ( create_entry, "FIDL_NQ_NAME", "name" ),
+                                        ( evaluate_expression, "expression", "value" ),
+                                        ( attach_comment, )
+                                    ])
+                                ]),
+                                ( create_entry, "FIDL_NQ_NAME", "datatype" ),
+                                ( create_entry, "FIDL_FQ_NAME", "datatype" )
+                            ]),
+                            ( attach_comment, error_header )
                         ]),
-                        ( create_target_dictionary, "arg_out", "out", [
-                            ( create_target_list, "member", "members", [
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map,
-                            ])
-                        ])
+                        ( attach_comment, )
                     ]),
                     #
                     # Broadcast
                     #
                     ( create_target_list, "broadcast", "events", [
                         ( create_entry, "FIDL_NQ_NAME", "name"),
-                        ( create_target_dictionary, "arg_out", "out", [
-                            ( create_target_list, "member", "members", [
-                                ( create_entry, "FIDL_NQ_NAME", "name"),
-                                type_map
-                            ])
-                        ])
-                    ])
+                        ( create_entry, "FIDL_VAR_NAME", "selector"),
+                        ( create_target_dictionary, "arg_out", "out", [ arg_list_map ]),
+                        ( attach_comment, )
+                    ]),
+                    #
+                    # Attributes
+                    #
+                    ( create_target_list, "attribute", "attributes", [
+                        ( create_entry, "FIDL_NQ_NAME", "name"),
+                        type_map,
+                        ( create_entry, "FIDL_READONLY", "readonly", bool ),
+                        ( create_entry, "FIDL_NOREAD", "no_read", bool ),
+                        ( create_entry, "FIDL_NOSUBSCRIPTIONS", "no_subscriptions", bool ),
+                        ( attach_comment, )
+                    ]),
+                    #
+                    # Contract
+                    #
+                    contract_map
                 ])
             ])
-        ])
+        ]),
+        ( attach_comment, )
     ])
 ]
 
+def fidl_string(value):
+    return value[1:-1]
+
+
+conversion_map = [
+    ( create_entry, "FIDL_NAME", "name" ), # Package name
+    ( create_target_list, "import_model", "import_models", [
+        ( create_entry, "FIDL_FILE_NAME", "file", fidl_string )
+    ]),
+    ( create_target_list, "import_namespace", "import_namespaces", [
+        ( create_entry, "FIDL_NQ_NAMESPACE", "namespace" ),
+        ( create_entry, "FIDL_FILE_NAME", "file", fidl_string )
+    ]),
+    ( create_target_dictionaries, "type_collection", "types", type_collection_map ),
+    ( create_target_dictionaries, "interface", "interfaces", interface_map )
+]
+
 
-@indent
 def resolve_types(current_namespace, name, tree):
 
 
@@ -483,11 +1032,7 @@ def resolve_types(current_namespace, name, tree):
     if not isinstance(tree, dict):
         return None
 
-    print(f"{ind()}Resolving {name}")
-
     if 'datatype' in tree:
-        print(f"{ind()}Found datatype")
-
         res = current_namespace.resolve_type(f"{tree['datatype']}")
         if not res:
             # Resolve type as fully qualified name
@@ -496,7 +1041,6 @@ def resolve_types(current_namespace, name, tree):
                 raise Exception(f"Could not resolve type name {tree['datatype']}")
 
         tree['$resolved_datatype'] = res
-        print(f"{ind()}Resolved to: {res}")
 
     # Traverse namespaces and recursively resolve
     if 'namespaces' in tree:
@@ -505,7 +1049,6 @@ def resolve_types(current_namespace, name, tree):
 
     # Check for any lists to traverse:
     for k, v in tree.items():
-        print(f"{ind()}Checking {k}")
         # Filter out stuff we don't need
         if k == 'namespaces' or k =='datatype':
             continue
@@ -515,10 +1058,232 @@ def resolve_types(current_namespace, name, tree):
     return None
 
 
-def convert_fidl_tree(lark_tree: lark.Tree):
+# Top level declarations and the maps that convert them
+declaration_maps = {
+    'root': conversion_map,
+    'type_collection': type_collection_map,
+    'interface': interface_map
+}
+
+
+def compile_declaration_maps(tracer: Tracer = None, collecting: bool = False, profiler: Profiler = None):
+    compiler = MapCompiler(tracer, collecting, profiler)
+    handlers = { rule: compiler.compile(parse_map) for rule, parse_map in declaration_maps.items() }
+    if profiler is None:
+        return handlers
+
+    # Time the conversion of each declaration, and of the root
+    return { rule: [ profiler.timed('convert', handler) for handler in rule_handlers ]
+             for rule, rule_handlers in handlers.items() }
+
+
+# Maps compiled without tracing, keyed by collecting mode. They are
+# compiled when first used, so that importing the module stays cheap.
+_plain_handlers = {}
+
+
+def plain_handlers(collecting: bool = False):
+    handlers = _plain_handlers.get(collecting)
+    if handlers is None:
+        handlers = _plain_handlers.setdefault(collecting, compile_declaration_maps(collecting=collecting))
+
+    return handlers
+
+
+def convert_fidl_tree(lark_tree: lark.Tree, tracer: Tracer = None, usage=None, comments=None,
+                      profiler: Profiler = None):
+    # Types used by each element are recorded in usage,
+    # a usage.UsageIndex, if given. Structured comments are attached
+    # from comments, the CommentIndex returned by comment.parse().
+    # The conversion is profiled by profiler, if given.
     state = {
         'ns': type_manager.NameSpace('root')
     }
-    res = process_lark_tree(state, lark_tree, conversion_map)
-    state['ns'].dump()
+    if usage is not None:
+        state['usage'] = usage
+
+    if comments is not None:
+        state['comments'] = comments
+
+    return convert_tree_with_state(state, lark_tree, tracer, profiler)
+
+
+def convert_fidl_tree_file(lark_tree: lark.Tree, tracer: Tracer = None):
+    # Same as convert_fidl_file(), for an already parsed lark tree
+    state = {
+        'ns': type_manager.NameSpace('root'),
+        'unresolved': []
+    }
+    res = convert_tree_with_state(state, lark_tree, tracer)
+    return (res, state['ns'], state['unresolved'])
+
+
+def convert_tree_with_state(state, lark_tree, tracer, profiler=None):
+    # Only instrument the handlers when we trace or profile. Otherwise
+    # the plain handlers are called.
+    if (tracer is None or not tracer.enabled) and profiler is None:
+        res = process_lark_tree(state, lark_tree, plain_handlers()['root'])
+        resolve_state_bases(state)
+        return res
+
+    res = process_lark_tree(state, lark_tree, compile_declaration_maps(tracer, profiler=profiler)['root'])
+    finish_conversion(state, tracer, profiler)
+    return res
+
+
+def finish_conversion(state, tracer, profiler=None):
+    # Resolve the bases of the types converted with state, unless
+    # declared() has, and dump the namespace when tracing calls
+    if 'declared' not in state:
+        profiled(profiler, 'resolve', resolve_state_bases, state)
+    if tracer is not None and tracer.level >= TRACE_CALLS:
+        profiled(profiler, 'namespace_dump', state['ns'].dump, tracer.log)
+
+
+#
+# Tree-less conversion
+#
+#  DeclarationConverter is plugged into the LALR parser as an inline
+#  transformer. Each interface and type collection is converted as soon
+#  as the parser has reduced it, and its subtree is released. The lark
+#  tree for the whole file is never built, bounding peak memory by the
+#  largest top level declaration.
+#
+#  Declarations are converted in the order they appear in the file,
+#  while convert_fidl_tree() converts type collections before
+#  interfaces.
+#
+#  The parser and its DeclarationConverter are shared by all
+#  conversions. The state and handlers of the conversion in progress
+#  are kept in a context variable, which is separate for each thread
+#  and asyncio task, and restored when a nested conversion returns.
+#
+current_conversion = contextvars.ContextVar('current_conversion', default=None)
+
+
+class DeclarationConverter(lark.Transformer):
+    def _convert(self, rule, children):
+        (state, handlers) = current_conversion.get()
+        return process_lark_tree(state, lark.Tree(rule, children), handlers[rule])
+
+    def _declare(self, rule, children):
+        # Outside of a conversion, such as when lark replays the parser
+        # to describe a syntax error, the tree is not converted
+        if current_conversion.get() is None:
+            return lark.Tree(rule, children)
+
+        state = current_conversion.get()[0]
+        if 'diagnostics' in state:
+            # A declaration that fails to convert is reported and dropped
+            res = collect_element(state, lark.Tree(rule, children), current_conversion.get()[1][rule])
+            if res is None:
+                return ConvertedTree(rule, None)
+        else:
+            res = self._convert(rule, children)
+
+        if 'declared' in state:
+            # The declaration is complete once its bases are resolved
+            resolve_state_bases(state, declaration_types(state['ns'], rule, res['name']))
+            state['declared'](rule, res, state['ns'])
+
+        return ConvertedTree(rule, res)
+
+    def type_collection(self, children):
+        return self._declare('type_collection', children)
+
+    def interface(self, children):
+        return self._declare('interface', children)
+
+    def root(self, children):
+        if current_conversion.get() is None:
+            return lark.Tree('root', children)
+
+        return self._convert('root', children)
+
+
+declaration_converter = DeclarationConverter()
+
+
+def convert_fidl_text(fidl_text: str, tracer: Tracer = None, usage=None, declared=None, diagnostics=None,
+                      profiler: Profiler = None):
+    # Parse and convert fidl_text in a single pass. Returns
+    # the same result as convert_fidl_tree().
+    #
+    # If given, declared(rule, result, namespace) is called with each
+    # type collection and interface as soon as it is converted and
+    # resolved. The bases of its types are then resolved right away,
+    # so a base must be declared before the types extending it.
+    #
+    # With diagnostics, a diagnostics.Diagnostics, errors are reported
+    # to it instead of being raised. The result then holds the
+    # elements converted without errors, or is None if the parser
+    # could not recover from a syntax error.
+    #
+    # With profiler, a profile.Profiler, the time spent lexing,
+    # parsing, converting and resolving is recorded.
+    state = {
+        'ns': type_manager.NameSpace('root')
+    }
+    if usage is not None:
+        state['usage'] = usage
+
+    if declared is not None:
+        state['declared'] = declared
+
+    if diagnostics is not None:
+        state['diagnostics'] = diagnostics
+
+    return convert_with_state(state, fidl_text, tracer, profiler=profiler)
+
+
+def convert_fidl_file(fidl_text: str, tracer: Tracer = None, diagnostics=None, line: int = 1):
+    # Parse and convert fidl_text without resolving datatypes.
+    # Returns the result, the root namespace with the types defined
+    # by fidl_text, and a list of (namespace path, dictionary,
+    # expressions) tuples. Once all types are known, the expressions
+    # are bound and the dictionary is passed to resolve_dict_tree().
+    # Errors are reported to diagnostics, if given, as for
+    # convert_fidl_text(). The lines of fidl_text are numbered from
+    # line, for a part of a larger file.
+    state = {
+        'ns': type_manager.NameSpace('root'),
+        'unresolved': []
+    }
+    if diagnostics is not None:
+        state['diagnostics'] = diagnostics
+
+    res = convert_with_state(state, fidl_text, tracer, line)
+    return (res, state['ns'], state['unresolved'])
+
+
+def state_handlers(state, tracer, profiler=None):
+    # The compiled declaration maps for a conversion with state
+    if (tracer is None or not tracer.enabled) and profiler is None:
+        return plain_handlers('diagnostics' in state)
+
+    return compile_declaration_maps(tracer, 'diagnostics' in state, profiler)
+
+
+def parse_with_state(state, handlers, fidl_text, line=1, profiler=None):
+    # Parse fidl_text, with its lines numbered from line, converting
+    # its declarations with state and handlers. Several texts may be
+    # parsed with the same state, as parts of a single file. The
+    # parse is timed by profiler, if given, and so is the lexer.
+    state['comments'] = CommentIndex(fidl_text)
+    conversion = current_conversion.set((state, handlers))
+    collecting = current_comments.set(state['comments'])
+    try:
+        lark_parser = get_parser(transformer=declaration_converter)
+        if 'diagnostics' in state:
+            return profiled(profiler, 'parse', diag.parse, lark_parser, fidl_text, state['diagnostics'], line, profiler)
+
+        return profiled(profiler, 'parse', parse_text, lark_parser, fidl_text, line, profiler)
+    finally:
+        current_comments.reset(collecting)
+        current_conversion.reset(conversion)
+
+
+def convert_with_state(state, fidl_text, tracer, line=1, profiler=None):
+    res = parse_with_state(state, state_handlers(state, tracer, profiler), fidl_text, line, profiler)
+    finish_conversion(state, tracer, profiler)
     return res
@@ -0,0 +1,168 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Parser management
+#
+#  Builds LALR parsers from the grammar files shipped with the package
+#  and keeps the compiled parse tables in an on-disk cache so that
+#  subsequent runs only have to load the tables.
+#
+#  The cache file name is keyed by a hash of the grammar text, the
+#  parser options, and the lark and python versions. A changed grammar
+#  thus results in a new cache file, while an unchanged grammar is
+#  loaded straight from disk.
+#
+import hashlib
+import os
+import sys
+import threading
+import lark
+from . import comment
+
+FIDL_GRAMMAR = 'francaidl.lark'
+
+# Parsers already built by this process, keyed by grammar and options.
+# A parser is built once, and then shared by all threads.
+_parsers = {}
+_parsers_lock = threading.RLock()
+
+# Parsers with a transformer, keyed by grammar, options and the
+# transformer itself, so that a transformer is not collected while its
+# parser is kept. Only the parsers of the last max_transformer_parsers
+# transformers are kept.
+_transformer_parsers = {}
+max_transformer_parsers = 8
+
+
+def grammar_text(grammar_name: str = FIDL_GRAMMAR) -> str:
+    with open(os.path.join(os.path.dirname(__file__), grammar_name), encoding='utf-8') as f:
+        return f.read()
+
+
+def cache_dir() -> str:
+    # FIDL_PARSER_CACHE overrides the location. An empty value disables the cache.
+    if 'FIDL_PARSER_CACHE' in os.environ:
+        return os.environ['FIDL_PARSER_CACHE']
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fidl_parser')
+
+
+def parser_options(debug: bool = False) -> dict:
+    # Production configuration is non-debug. Debug mode makes lark
+    # report grammar collisions when the tables are built.
+    return { 'start': 'root', 'parser': 'lalr', 'debug': debug }
+
+
+def cache_key(grammar: str, options: dict) -> str:
+    key = hashlib.sha256()
+    key.update(grammar.encode('utf-8'))
+    key.update(repr(sorted(options.items())).encode('utf-8'))
+    key.update(lark.__version__.encode('utf-8'))
+    key.update(repr(sys.version_info[:2]).encode('utf-8'))
+    return key.hexdigest()
+
+
+def cache_file(grammar_name: str, grammar: str, options: dict):
+    directory = cache_dir()
+    if not directory:
+        return None
+
+    base_name = os.path.splitext(grammar_name)[0]
+    return os.path.join(directory, f"{base_name}-{cache_key(grammar, options)}.lark")
+
+
+def tables_cached(grammar_name: str = FIDL_GRAMMAR, debug: bool = False) -> bool:
+    # Are the tables of the grammar in the cache. Without a cache,
+    # the tables are built by each parser.
+    cache_fn = cache_file(grammar_name, grammar_text(grammar_name), parser_options(debug))
+    return cache_fn is None or os.path.exists(cache_fn)
+
+
+def build_parser(grammar_name: str = FIDL_GRAMMAR, debug: bool = False, **extra_options) -> lark.Lark:
+    grammar = grammar_text(grammar_name)
+    options = parser_options(debug)
+    cache_fn = cache_file(grammar_name, grammar, options)
+
+    # Structured comments are collected by the conversion in progress
+    extra_options['lexer_callbacks'] = { 'FIDL_STRUCTURED_COMMENT': comment.lexed }
+
+    if cache_fn is None:
+        return lark.Lark(grammar, **options, **extra_options)
+
+    # Lark loads the precompiled tables from cache_fn if they are
+    # present, or builds them and stores them there. A cache file
+    # that is still being written by a concurrent process fails to
+    # load and makes lark rebuild the tables.
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        return lark.Lark(grammar, cache=cache_fn, **options, **extra_options)
+    except OSError:
+        return lark.Lark(grammar, **options, **extra_options)
+
+
+def get_parser(grammar_name: str = FIDL_GRAMMAR, debug: bool = False, transformer=None) -> lark.Lark:
+    # A transformer is applied inline by the LALR parser. Each
+    # transformer instance gets its own parser, sharing the cached tables.
+    if transformer is not None:
+        return get_transformer_parser(grammar_name, debug, transformer)
+
+    key = (grammar_name, debug)
+    parser = _parsers.get(key)
+    if parser is not None:
+        return parser
+
+    with _parsers_lock:
+        if key not in _parsers:
+            _parsers[key] = build_parser(grammar_name, debug)
+
+    return _parsers[key]
+
+
+def get_transformer_parser(grammar_name: str, debug: bool, transformer) -> lark.Lark:
+    key = (grammar_name, debug, transformer)
+    parser = _transformer_parsers.get(key)
+    if parser is not None:
+        return parser
+
+    with _parsers_lock:
+        if key not in _transformer_parsers:
+            # Lark cannot store the tables of a parser with a
+            # transformer, so let the plain parser store them first,
+            # unless they are already stored.
+            if not tables_cached(grammar_name, debug):
+                get_parser(grammar_name, debug)
+
+            # Drop the oldest parser. A thread using it keeps it.
+            if len(_transformer_parsers) >= max_transformer_parsers:
+                del _transformer_parsers[next(iter(_transformer_parsers))]
+
+            _transformer_parsers[key] = build_parser(grammar_name, debug, transformer=transformer)
+
+    return _transformer_parsers[key]
+
+
+def start_parse(lark_parser: lark.Lark, text: str, line: int = 1, profiler=None):
+    # Interactive parser for text, numbering the lines of text from
+    # line instead of 1. resume_parse() returns the same result as
+    # lark_parser.parse(text). With a profile.Profiler, the lexer is
+    # timed and its tokens counted.
+    interactive = lark_parser.parse_interactive(text)
+    interactive.lexer_state.state.line_ctr.line = line
+    if profiler is not None:
+        interactive.lexer_state = interactive.parser_state.lexer = profiler.lexer(interactive.lexer_state)
+
+    return interactive
+
+
+def parse_text(lark_parser: lark.Lark, text: str, line: int = 1, profiler=None):
+    # lark_parser.parse(text), with the lines of text numbered from line
+    if line == 1 and profiler is None:
+        return lark_parser.parse(text)
+
+    return start_parse(lark_parser, text, line, profiler).resume_parse()
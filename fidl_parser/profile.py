@@ -0,0 +1,276 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Per-phase profiling
+#
+#  A Profiler records, for each file, the wall and CPU time spent in
+#  each phase of reading, parsing, converting and printing it, and
+#  counters such as the number of tokens lexed and the number of lark
+#  tree nodes converted.
+#
+#  Phases nest. The time of a nested phase is only counted for that
+#  phase, and not for the phase it is nested in. The tree-less
+#  conversion thus splits the time of the LALR parse into lex, parse
+#  (the parser itself), convert and resolve.
+#
+#  With trace_memory, the net change of the memory traced by
+#  tracemalloc is recorded for each phase, and the peak for each file.
+#  Tracing memory slows down allocation and thus all phases.
+#
+#  Functions that accept a profiler install their hooks only when
+#  given one, as for a tracer. Without a profiler they run the same
+#  code as before, so the hooks cost nothing when profiling is off.
+#  A Profiler must not be shared by concurrent conversions.
+#
+import contextlib
+import copy
+import time
+import tracemalloc
+from .parser import parse_text
+
+# Phases in report order. Other phases are reported after these.
+PHASES = ('read', 'lex', 'parse', 'dump_tree', 'convert', 'resolve', 'namespace_dump', 'encode')
+
+# Counters in report order
+COUNTERS = ('tokens', 'nodes')
+
+
+class Profiler:
+    def __init__(self, trace_memory: bool = False):
+        self._trace_memory = trace_memory
+        self._files = {}
+        self._file = None
+        self._stack = []
+
+    @property
+    def trace_memory(self):
+        return self._trace_memory
+
+    @property
+    def files(self) -> dict:
+        # file name -> { 'phases': { phase -> [ calls, wall, cpu, memory ] },
+        #                'counters': { counter -> count }, 'peak_memory': bytes }
+        # Times are in seconds and memory in bytes.
+        return self._files
+
+    def _record(self):
+        record = self._files.get(self._file)
+        if record is None:
+            record = self._files[self._file] = { 'phases': {}, 'counters': {}, 'peak_memory': 0 }
+
+        return record
+
+    def _now(self):
+        memory = tracemalloc.get_traced_memory()[0] if self._trace_memory else 0
+        return (time.perf_counter(), time.process_time(), memory)
+
+    @contextlib.contextmanager
+    def file(self, file_name: str):
+        # Record the phases and counters within the block for file_name
+        started = self._trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif self._trace_memory:
+            tracemalloc.reset_peak()
+
+        (outer, self._file) = (self._file, file_name)
+        record = self._record()
+        try:
+            yield
+        finally:
+            if self._trace_memory:
+                record['peak_memory'] = max(record['peak_memory'], tracemalloc.get_traced_memory()[1])
+            if started:
+                tracemalloc.stop()
+            self._file = outer
+
+    def start(self, phase: str):
+        # Enter phase. Must be followed by a stop().
+        self._stack.append([ phase, *self._now(), 0.0, 0.0, 0 ])
+
+    def stop(self):
+        # Leave the phase entered by the last start()
+        (wall, cpu, memory) = self._now()
+        (phase, start_wall, start_cpu, start_memory, nested_wall, nested_cpu, nested_memory) = self._stack.pop()
+        (wall, cpu, memory) = (wall - start_wall, cpu - start_cpu, memory - start_memory)
+
+        phases = self._record()['phases']
+        stat = phases.get(phase)
+        if stat is None:
+            stat = phases[phase] = [ 0, 0.0, 0.0, 0 ]
+
+        stat[0] += 1
+        stat[1] += wall - nested_wall
+        stat[2] += cpu - nested_cpu
+        stat[3] += memory - nested_memory
+
+        if self._stack:
+            outer = self._stack[-1]
+            outer[4] += wall
+            outer[5] += cpu
+            outer[6] += memory
+
+    @contextlib.contextmanager
+    def phase(self, phase: str):
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def call(self, phase: str, func, *args, **options):
+        # func(*args, **options), timed as phase
+        self.start(phase)
+        try:
+            return func(*args, **options)
+        finally:
+            self.stop()
+
+    def timed(self, phase: str, func):
+        # func, timed as phase on each call
+        def wrap(*args):
+            self.start(phase)
+            try:
+                return func(*args)
+            finally:
+                self.stop()
+
+        wrap.__name__ = getattr(func, '__name__', phase)
+        wrap.__wrapped__ = func
+        return wrap
+
+    def count(self, counter: str, value: int = 1):
+        counters = self._record()['counters']
+        counters[counter] = counters.get(counter, 0) + value
+
+    def counted(self, counter: str, func):
+        # func, adding one to counter on each call
+        def wrap(*args):
+            self.count(counter)
+            return func(*args)
+
+        wrap.__name__ = getattr(func, '__name__', counter)
+        wrap.__wrapped__ = func
+        return wrap
+
+    def lexer(self, lexer_thread):
+        # Stand-in for the lark LexerThread of an interactive parser
+        return ProfiledLexer(lexer_thread, self)
+
+    def parse(self, lark_parser, text: str, line: int = 1):
+        # lark_parser.parse(text), timed as parse, with the lexer timed
+        # as lex
+        return self.call('parse', parse_text, lark_parser, text, line, self)
+
+    def totals(self) -> dict:
+        # The records of all files summed up, in the format of a file
+        # record, with the largest peak memory
+        res = { 'phases': {}, 'counters': {}, 'peak_memory': 0 }
+        for record in self._files.values():
+            for (phase, stat) in record['phases'].items():
+                total = res['phases'].get(phase, [ 0, 0.0, 0.0, 0 ])
+                res['phases'][phase] = [ value + stat_value for (value, stat_value) in zip(total, stat) ]
+
+            for (counter, value) in record['counters'].items():
+                res['counters'][counter] = res['counters'].get(counter, 0) + value
+
+            res['peak_memory'] = max(res['peak_memory'], record['peak_memory'])
+
+        return res
+
+    def to_dict(self) -> dict:
+        # JSON serializable form of the files and their totals
+        return {
+            'files': [ dict(file=file_name, **record_to_dict(record, self._trace_memory))
+                       for (file_name, record) in self._files.items() ],
+            'total': record_to_dict(self.totals(), self._trace_memory)
+        }
+
+    def report(self) -> str:
+        totals = self.totals()
+        wall_total = sum([ stat[1] for stat in totals['phases'].values() ])
+        memory = self._trace_memory
+
+        lines = [ f"{'phase':<16} {'calls':>8} {'wall ms':>10} {'cpu ms':>10} {'wall %':>7}" +
+                  (f" {'alloc KB':>10}" if memory else "") ]
+        for phase in ordered(totals['phases'], PHASES):
+            (calls, wall, cpu, allocated) = totals['phases'][phase]
+            share = wall * 100 / wall_total if wall_total else 0.0
+            lines.append(f"{phase:<16} {calls:>8} {wall*1000:>10.3f} {cpu*1000:>10.3f} {share:>7.1f}" +
+                         (f" {allocated/1024:>10.1f}" if memory else ""))
+
+        counters = ordered(totals['counters'], COUNTERS)
+        lines.append("")
+        lines.append(f"{'wall ms':>10} {'cpu ms':>10}" + "".join([ f" {counter:>10}" for counter in counters ]) +
+                     (f" {'peak KB':>10}" if memory else "") + "  file")
+        for (file_name, record) in list(self._files.items()) + [ ('total', totals) ]:
+            stats = record['phases'].values()
+            lines.append(f"{sum([ stat[1] for stat in stats ])*1000:>10.3f} {sum([ stat[2] for stat in stats ])*1000:>10.3f}" +
+                         "".join([ f" {record['counters'].get(counter, 0):>10}" for counter in counters ]) +
+                         (f" {record['peak_memory']/1024:>10.1f}" if memory else "") + f"  {file_name}")
+
+        return "\n".join(lines)
+
+
+def record_to_dict(record, memory):
+    phases = {}
+    for phase in ordered(record['phases'], PHASES):
+        (calls, wall, cpu, allocated) = record['phases'][phase]
+        phases[phase] = { 'calls': calls, 'wall_ms': wall * 1000, 'cpu_ms': cpu * 1000 }
+        if memory:
+            phases[phase]['allocated_bytes'] = allocated
+
+    res = { 'phases': phases, 'counters': dict(record['counters']) }
+    if memory:
+        res['peak_memory_bytes'] = record['peak_memory']
+
+    return res
+
+
+def ordered(names, order):
+    # names in the given order, followed by the others sorted
+    return [ name for name in order if name in names ] + sorted([ name for name in names if name not in order ])
+
+
+def profiled(profiler, phase, func, *args, **options):
+    # func(*args, **options), timed as phase if profiler is given
+    if profiler is None:
+        return func(*args, **options)
+
+    return profiler.call(phase, func, *args, **options)
+
+
+class ProfiledLexer:
+    # Wraps the lark LexerThread of an interactive parser. Time spent
+    # lexing is recorded as the lex phase, and each token is counted.
+    def __init__(self, lexer_thread, profiler: Profiler):
+        self._lexer_thread = lexer_thread
+        self._profiler = profiler
+
+    @property
+    def state(self):
+        # The lexer state, read when recovering from errors
+        return self._lexer_thread.state
+
+    def lex(self, parser_state):
+        profiler = self._profiler
+        tokens = self._lexer_thread.lex(parser_state)
+        while True:
+            profiler.start('lex')
+            try:
+                token = next(tokens)
+            except StopIteration:
+                return
+            finally:
+                profiler.stop()
+
+            profiler.count('tokens')
+            yield token
+
+    def __copy__(self):
+        return ProfiledLexer(copy.copy(self._lexer_thread), self._profiler)
@@ -0,0 +1,421 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Multi-file projects
+#
+#  A project is loaded from one or more root .fidl files. The imports
+#  of each file (import model "..." and import x.y.* from "...") are
+#  followed to discover all files of the project.
+#
+#  Files are parsed and converted in a pool of worker processes as
+#  soon as they are discovered. Each file is parsed exactly once.
+#
+#  With a cache.ParseCache, files whose content has not changed since
+#  they were last converted are loaded from the cache instead.
+#
+#  The namespaces of all files are then merged into a single namespace
+#  tree, with each file's type collections and interfaces placed under
+#  its package, before datatypes are resolved across files.
+#
+#  While resolving, the project records which files each file uses
+#  types from, and which elements use each type in a
+#  usage.UsageIndex. reload() re-parses a single changed file,
+#  replaces its types in the namespace tree, and only re-resolves that
+#  file and the files depending on it.
+#
+#  With collect_diagnostics, syntax, conversion and resolution errors
+#  are reported to a diagnostics.Diagnostics object per file instead
+#  of being raised, and all files are loaded and resolved. Files that
+#  cannot be read or parsed at all are left out of the project.
+#
+import concurrent.futures
+import os
+from . import diagnostics as diag
+from . import parse_tree
+from . import type_manager
+from . import usage
+
+
+def parse_file(file_name, cache=None, collect=False):
+    # Runs in a worker process. Returns if the file was found in
+    # the cache, and the converted file with its datatypes unresolved.
+    # If collect is set, the cache is not used, and the diagnostics of
+    # the file are returned with the converted file.
+    if collect:
+        diagnostics = diag.Diagnostics(file_name)
+        try:
+            with open(file_name) as f:
+                fidl_text = f.read()
+        except OSError as e:
+            diagnostics.report(f"Could not read file: {e.strerror}")
+            return (False, (None, None, [], diagnostics))
+
+        return (False, parse_tree.convert_fidl_file(fidl_text, diagnostics=diagnostics) + (diagnostics,))
+
+    if cache is None:
+        with open(file_name) as f:
+            fidl_text = f.read()
+
+        return (False, parse_tree.convert_fidl_file(fidl_text))
+
+    with open(file_name, 'rb') as f:
+        fidl_bytes = f.read()
+
+    return cache.lookup(fidl_bytes)
+
+
+class FidlFile:
+    def __init__(self, file_name: str, result: dict, namespace, unresolved: list, diagnostics=None):
+        self._file_name = file_name
+        self._result = result
+        self._namespace = namespace
+        self._unresolved = unresolved
+        self._diagnostics = diagnostics
+
+        # Number of diagnostics reported before resolving
+        self._converted = len(diagnostics) if diagnostics is not None else 0
+
+        # Set when merged into and resolved in a project
+        self._types = []
+        self._dependencies = set()
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def result(self) -> dict:
+        # Same format as parse_tree.convert_fidl_tree()
+        return self._result
+
+    @property
+    def package(self) -> str:
+        return self._result['name']
+
+    @property
+    def imports(self) -> list:
+        # File names imported by this file, relative to the
+        # directory of this file.
+        return [ imp['file'] for imp in
+                 self._result.get('import_models', []) + self._result.get('import_namespaces', []) ]
+
+    @property
+    def imported_files(self) -> list:
+        # Normalized names of the imported files
+        return [ os.path.normpath(os.path.join(os.path.dirname(self._file_name), imp))
+                 for imp in self.imports ]
+
+    @property
+    def imported_namespaces(self) -> list:
+        return [ imp['namespace'] for imp in self._result.get('import_namespaces', []) ]
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @property
+    def unresolved(self) -> list:
+        return self._unresolved
+
+    @property
+    def diagnostics(self):
+        # diagnostics.Diagnostics of the file, if collected
+        return self._diagnostics
+
+    @property
+    def types(self) -> list:
+        # type_manager.Type objects added to the project by this file
+        return self._types
+
+    @property
+    def dependencies(self) -> set:
+        # Names of the files that define types used by this file
+        return self._dependencies
+
+
+class Project:
+    def __init__(self, root_files, workers: int = None, cache=None, collect_diagnostics: bool = False):
+        self._root_files = [ os.path.normpath(file_name) for file_name in root_files ]
+        self._workers = workers
+        self._cache = cache
+        self._collect = collect_diagnostics
+        self._files = {}
+
+        # File name -> diagnostics.Diagnostics, when collecting
+        self._diagnostics = {}
+        self._namespace = type_manager.NameSpace('root')
+
+        # Qualified type name -> name of the file defining it
+        self._owners = {}
+
+        # File name -> error message, for files that could not be
+        # reloaded or resolved by reload()
+        self._errors = {}
+
+        self._usage = usage.UsageIndex()
+
+    @property
+    def files(self) -> dict:
+        # File name -> FidlFile, in discovery order
+        return self._files
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @property
+    def errors(self) -> dict:
+        return self._errors
+
+    @property
+    def usage(self):
+        # usage.UsageIndex of all resolved files
+        return self._usage
+
+    @property
+    def diagnostics(self) -> list:
+        # diagnostics.Diagnostic objects of all files, by file in
+        # discovery order and by position within each file
+        return [ diagnostic for file_name in self._files if file_name in self._diagnostics
+                 for diagnostic in self._diagnostics[file_name].sorted() ]
+
+    def owner(self, type) -> str:
+        # Name of the file defining a type_manager.Type in the project
+        return self._owners.get(type.qualified_name)
+
+    def load(self):
+        self._files = { file_name: None for file_name in self._root_files }
+
+        if self._workers == 1:
+            self._load_serial()
+        else:
+            self._load_parallel()
+
+        if self._cache is not None:
+            self._cache.evict()
+
+        return self.resolve()
+
+    def resolve(self):
+        # Merge the namespaces of all files and resolve their datatypes
+        fidl_files = [ fidl_file for fidl_file in self._files.values() if fidl_file is not None ]
+        for fidl_file in fidl_files:
+            self._merge(fidl_file)
+
+        for fidl_file in fidl_files:
+            self._bind(fidl_file)
+
+        for fidl_file in fidl_files:
+            self._resolve(fidl_file)
+
+        return self
+
+    def _add_file(self, file_name, parse_result):
+        (cached, result) = parse_result
+        if self._cache is not None:
+            self._cache.count(cached)
+
+        return self.add_file(file_name, result)
+
+    def add_file(self, file_name, result):
+        # Add a file converted by parse_tree.convert_fidl_file(), and
+        # its diagnostics when collecting. Returns the imported files
+        # that have not been seen before.
+        if len(result) > 3:
+            self._diagnostics[file_name] = result[3]
+
+        if result[0] is None:
+            # Could not be read or parsed, reported in its diagnostics
+            self._files[file_name] = None
+            return []
+
+        fidl_file = FidlFile(file_name, *result)
+        self._files[file_name] = fidl_file
+
+        # Return imported files not seen before
+        new_files = []
+        for import_name in fidl_file.imported_files:
+            if import_name not in self._files:
+                self._files[import_name] = None
+                new_files.append(import_name)
+
+        return new_files
+
+    def _load_serial(self):
+        pending = list(self._files)
+        while pending:
+            file_name = pending.pop(0)
+            pending.extend(self._add_file(file_name, parse_file(file_name, self._cache, self._collect)))
+
+    def _load_parallel(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self._workers) as executor:
+            running = { executor.submit(parse_file, file_name, self._cache, self._collect): file_name
+                        for file_name in self._files }
+
+            while running:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    file_name = running.pop(future)
+                    for import_name in self._add_file(file_name, future.result()):
+                        running[executor.submit(parse_file, import_name, self._cache, self._collect)] = import_name
+
+    def _merge(self, fidl_file):
+        fidl_file._types = fidl_file.namespace.all_types()
+        package_ns = self._namespace.add_namespace_path(fidl_file.package.split('.'))
+        for ns in list(fidl_file.namespace.namespaces.values()):
+            package_ns.add_namespace(ns)
+
+        for type in list(fidl_file.namespace.types.values()):
+            package_ns.add_type(type)
+
+        self._owners.update([ (type.qualified_name, fidl_file.file_name) for type in fidl_file.types ])
+
+    def _unmerge(self, fidl_file):
+        for type in fidl_file.types:
+            if self._owners.get(type.qualified_name) == fidl_file.file_name:
+                del self._owners[type.qualified_name]
+            type.parent.remove_type(type)
+
+        fidl_file._types = []
+
+    def resolve_type(self, fidl_file, ns, sym_name):
+        # Local name, or a name relative to an enclosing namespace,
+        # including fully qualified names.
+        res = ns.resolve_scoped_type(sym_name)
+        if res:
+            return res
+
+        # Name imported with import x.y.* or import x.y.Name
+        for imported in fidl_file.imported_namespaces:
+            path_list = imported.split('.')
+            if path_list[-1] == '*':
+                imported_ns = self._namespace.find_namespace(path_list[:-1])
+                res = imported_ns.resolve_type(sym_name) if imported_ns else None
+            elif sym_name.split('.')[0] == path_list[-1]:
+                res = self._namespace.resolve_type_list(path_list[:-1] + sym_name.split('.'))
+            else:
+                res = None
+
+            if res:
+                return res
+
+        return None
+
+    def _resolver(self, fidl_file, ns):
+        # resolve_name(name) for the names used in ns, recording
+        # the files defining them as dependencies of fidl_file
+        def resolve_name(name):
+            res = self.resolve_type(fidl_file, ns, name)
+            if res:
+                owner = self._owners.get(res.qualified_name)
+                if owner is not None and owner != fidl_file.file_name:
+                    fidl_file._dependencies.add(owner)
+            return res
+
+        return resolve_name
+
+    def _scope_resolver(self, fidl_file, ns):
+        # _resolver() for the body of a type collection or interface.
+        # The types of an extended interface are in scope of the
+        # interfaces extending it.
+        interface = ns.parent.types.get(ns.name)
+        return parse_tree.interface_resolver(self._resolver(fidl_file, ns),
+                                             interface.info.get('extends') if interface else None)
+
+    def _bind(self, fidl_file):
+        # Constants may refer to constants of other files, so the
+        # expressions of all files are bound before any is resolved
+        package_ns = self._namespace.find_namespace(fidl_file.package.split('.'))
+        fidl_file._dependencies = set()
+        for (path_list, dict_tree, expressions) in fidl_file.unresolved:
+            resolve_name = self._scope_resolver(fidl_file, package_ns.find_namespace(path_list))
+            for expr in expressions:
+                expr.bind(resolve_name)
+
+    def _resolve(self, fidl_file):
+        package_ns = self._namespace.find_namespace(fidl_file.package.split('.'))
+        self._usage.remove_file(fidl_file.file_name)
+
+        # Errors found by resolving the file before are found again
+        report = None
+        if fidl_file.diagnostics is not None:
+            fidl_file.diagnostics.truncate(fidl_file._converted)
+            report = fidl_file.diagnostics.report
+
+        for (path_list, dict_tree, expressions) in fidl_file.unresolved:
+            ns = package_ns.find_namespace(path_list)
+            parse_tree.resolve_body(dict_tree, self._scope_resolver(fidl_file, ns),
+                                    self._usage.recorder(ns.qualified_name, fidl_file.file_name), report)
+
+        parse_tree.resolve_bases(fidl_file.types, lambda ns: self._resolver(fidl_file, ns),
+                                 lambda ns: self._usage.recorder(ns.qualified_name, fidl_file.file_name), report)
+
+    def dependents(self, file_name) -> set:
+        # Files that use types from, or import, file_name
+        return set([ fidl_file.file_name for fidl_file in self._files.values()
+                     if fidl_file is not None and (file_name in fidl_file.dependencies or
+                                                   file_name in fidl_file.imported_files) ])
+
+    def reload(self, file_name) -> list:
+        # Re-parse file_name after it has changed, or been removed, and
+        # re-resolve it and its dependents. Files it now imports and
+        # that are not part of the project are loaded. Returns the
+        # names of the files that were resolved again.
+        #
+        # Errors are recorded in errors instead of being raised. A file
+        # that fails to parse keeps its previous content.
+        file_name = os.path.normpath(file_name)
+        old_file = self._files.get(file_name)
+        affected = self.dependents(file_name)
+
+        if not os.path.exists(file_name):
+            if old_file is not None:
+                self._unmerge(old_file)
+            self._files.pop(file_name, None)
+            self._diagnostics.pop(file_name, None)
+            self._usage.remove_file(file_name)
+            self._errors[file_name] = f"{file_name}: No such file"
+            loaded = []
+        else:
+            try:
+                parse_result = parse_file(file_name, self._cache, self._collect)
+            except Exception as e:
+                self._errors[file_name] = f"{file_name}: {e}"
+                return []
+
+            if old_file is not None:
+                self._unmerge(old_file)
+
+            loaded = [ file_name ]
+            pending = self._add_file(file_name, parse_result)
+            while pending:
+                import_name = pending.pop(0)
+                try:
+                    pending.extend(self._add_file(import_name, parse_file(import_name, self._cache, self._collect)))
+                    loaded.append(import_name)
+                except Exception as e:
+                    del self._files[import_name]
+                    self._errors[import_name] = f"{import_name}: {e}"
+
+            for name in loaded:
+                self._merge(self._files[name])
+
+        # Files that failed to resolve before may resolve now
+        resolved = loaded + sorted((affected | set(self._errors)) - set(loaded))
+        resolved = [ name for name in resolved if self._files.get(name) is not None ]
+        for name in resolved:
+            self._bind(self._files[name])
+
+        for name in resolved:
+            self._errors.pop(name, None)
+            try:
+                self._resolve(self._files[name])
+            except Exception as e:
+                self._errors[name] = f"{name}: {e}"
+
+        return resolved
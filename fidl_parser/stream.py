@@ -0,0 +1,268 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Streaming input
+#
+#  convert_fidl_stream() converts a .fidl file without reading all of
+#  it into a string. The file is memory mapped and split into chunks
+#  that end with a top level interface or typeCollection, by scanning
+#  for braces outside of comments and strings. Each chunk is decoded,
+#  parsed and converted on its own, and released before the next one.
+#  Peak memory is thus bounded by the largest chunk and the converted
+#  result, instead of the size of the file.
+#
+#  A chunk holds consecutive declarations up to chunk_size bytes, or a
+#  single larger declaration. Chunks after the first are parsed with
+#  a package line of their own, and their lines and columns are
+#  numbered as in the file.
+#
+#  Chunks are converted in order with a single conversion state, with
+#  the same result as parse_tree.convert_fidl_text(). With jobs, the
+#  chunks are converted in worker processes instead, and their
+#  datatypes resolved once all are converted, as for the files of a
+#  project.Project.
+#
+import mmap
+import re
+from . import diagnostics as diag
+from . import parse_tree
+from . import type_manager
+from .profile import profiled
+
+# Default chunk size in bytes
+default_chunk_size = 1 << 20
+
+# Comments and strings, which may hold braces, and braces
+boundary_pattern = re.compile(rb'//[^\n]*|/\*.*?\*/|<\*\*.*?\*\*>|"(?:[^"\\\n]|\\.)*"|[{}]', re.S)
+
+# Package statement at the start of a file
+package_pattern = re.compile(rb'(?:\s+|//[^\n]*|/\*.*?\*/|<\*\*.*?\*\*>)*package\s+([A-Za-z_][\w.]*)', re.S)
+
+
+def declaration_ends(data):
+    # End offsets of the top level declarations in data
+    depth = 0
+    for match in boundary_pattern.finditer(data):
+        if match.group() == b'{':
+            depth += 1
+        elif match.group() == b'}':
+            # A stray } is reported by the parser
+            depth = max(depth - 1, 0)
+            if depth == 0:
+                yield match.end()
+
+
+def split_chunks(data, chunk_size: int = default_chunk_size) -> list:
+    # (start, end, line, column) of each chunk of data, the content of
+    # a .fidl file. Chunks end after a top level declaration, except
+    # the last one, which holds the rest of data.
+    chunks = []
+    (start, line, column) = (0, 1, 1)
+    for end in declaration_ends(data):
+        if end - start < chunk_size:
+            continue
+
+        chunks.append((start, end, line, column))
+        (start, line, column) = (end,) + position(data, start, end, line, column)
+
+    if start < len(data) or not chunks:
+        chunks.append((start, len(data), line, column))
+
+    return chunks
+
+
+def position(data, start, end, line, column):
+    # (line, column) of end, given those of start. Columns count
+    # characters, as the lexer does.
+    newlines = data[start:end].count(b'\n')
+    if newlines:
+        (start, column) = (data.rfind(b'\n', start, end) + 1, 1)
+
+    return (line + newlines, column + len(str(data[start:end], 'utf-8')))
+
+
+def decode(data) -> str:
+    # Newlines are translated as when reading a file in text mode
+    text = str(data, 'utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    return text
+
+
+def chunk_text(data, package, start, end, line, column):
+    # Text to parse for a chunk, and the number of its first line
+    if start == 0:
+        return (decode(data[start:end]), line)
+
+    return (f"package {package}\n{' ' * (column - 1)}{decode(data[start:end])}", line - 1)
+
+
+def merge_results(results: list) -> dict:
+    # The result of a file, from the results of its chunks in order
+    merged = {}
+    for entry in parse_tree.conversion_map:
+        (helper, target) = (entry[0], entry[2])
+        values = [ res[target] for res in results if target in res ]
+        if not values:
+            continue
+
+        if helper is parse_tree.create_entry:
+            merged[target] = values[0]
+            continue
+
+        items = [ item for value in values for item in (value if isinstance(value, list) else [ value ]) ]
+        if helper is parse_tree.create_target_dictionaries and len(items) == 1:
+            items = items[0]
+
+        merged[target] = items
+
+    return merged
+
+
+class MappedFile:
+    # The content of a file, memory mapped unless it is empty
+    def __init__(self, file_name: str):
+        self._file = open(file_name, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._data = b''
+
+    @property
+    def data(self):
+        return self._data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def convert_chunk(file_name, package, chunk, collect, diagnostics_name=None):
+    # Runs in a worker process. Returns the chunk converted as by
+    # parse_tree.convert_fidl_file(), and its diagnostics if collected.
+    chunk_diagnostics = diag.Diagnostics(diagnostics_name) if collect else None
+    with MappedFile(file_name) as mapped:
+        (text, line) = chunk_text(mapped.data, package, *chunk)
+
+    return parse_tree.convert_fidl_file(text, diagnostics=chunk_diagnostics, line=line) + (chunk_diagnostics,)
+
+
+def convert_fidl_stream(file_name: str, tracer=None, usage=None, declared=None, diagnostics=None,
+                        jobs: int = None, chunk_size: int = default_chunk_size, profiler=None):
+    # Convert the file file_name in chunks. Returns the same result as
+    # parse_tree.convert_fidl_text() with the content of the file.
+    # With jobs, chunks are converted in that many worker processes,
+    # and tracer, declared and profiler are not supported.
+    with MappedFile(file_name) as mapped:
+        data = mapped.data
+        package = package_pattern.match(data)
+        if package is None:
+            # Not split, so that the parser reports what is missing
+            chunks = [ (0, len(data), 1, 1) ]
+        else:
+            chunks = split_chunks(data, chunk_size)
+            package = package.group(1).decode()
+
+        if jobs is None:
+            return convert_serial(data, package, chunks, tracer, usage, declared, diagnostics, profiler)
+
+    if tracer is not None or declared is not None or profiler is not None:
+        raise Exception("Tracing, profiling and declared are not supported when converting chunks in worker processes")
+
+    return convert_parallel(file_name, package, chunks, jobs, usage, diagnostics)
+
+
+def convert_serial(data, package, chunks, tracer, usage, declared, diagnostics, profiler=None):
+    # Convert the chunks with one state, as a single text
+    state = {
+        'ns': type_manager.NameSpace('root')
+    }
+    if usage is not None:
+        state['usage'] = usage
+
+    if declared is not None:
+        state['declared'] = declared
+
+    if diagnostics is not None:
+        state['diagnostics'] = diagnostics
+
+    handlers = parse_tree.state_handlers(state, tracer, profiler)
+    results = []
+    for chunk in chunks:
+        # Decoding a chunk is reading it from the mapped file
+        (text, line) = profiled(profiler, 'read', chunk_text, data, package, *chunk)
+        res = parse_tree.parse_with_state(state, handlers, text, line, profiler)
+        if res is not None:
+            results.append(res)
+
+    parse_tree.finish_conversion(state, tracer, profiler)
+    return merge_results(results) if results else None
+
+
+def convert_parallel(file_name, package, chunks, jobs, usage, diagnostics):
+    # Convert the chunks in worker processes, then merge their
+    # namespaces and resolve their datatypes. concurrent.futures is
+    # slow to import, and only imported when used.
+    import concurrent.futures
+
+    root = type_manager.NameSpace('root')
+    results = []
+    unresolved = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [ executor.submit(convert_chunk, file_name, package, chunk, diagnostics is not None,
+                                    diagnostics.file_name if diagnostics is not None else None)
+                    for chunk in chunks ]
+
+        # In file order, as the types of later chunks replace those of
+        # earlier ones with the same name
+        for future in futures:
+            (res, ns, chunk_unresolved, chunk_diagnostics) = future.result()
+            if chunk_diagnostics is not None:
+                diagnostics.extend(chunk_diagnostics)
+
+            if res is None:
+                continue
+
+            results.append(res)
+            unresolved.extend(chunk_unresolved)
+            for child in list(ns.namespaces.values()):
+                root.add_namespace(child)
+
+            for type in list(ns.types.values()):
+                root.add_type(type)
+
+    report = diagnostics.report if diagnostics is not None else None
+    scopes = [ (root.find_namespace(path_list), dict_tree, expressions)
+               for (path_list, dict_tree, expressions) in unresolved ]
+    scopes = [ (ns, dict_tree, scope_resolver(ns), expressions) for (ns, dict_tree, expressions) in scopes ]
+
+    # Constants may refer to constants of other chunks
+    for (_, _, resolve_name, expressions) in scopes:
+        for expr in expressions:
+            expr.bind(resolve_name)
+
+    for (ns, dict_tree, resolve_name, _) in scopes:
+        record = usage.recorder(ns.qualified_name) if usage is not None else None
+        parse_tree.resolve_body(dict_tree, resolve_name, record, report)
+
+    recorder = (lambda ns: usage.recorder(ns.qualified_name)) if usage is not None else None
+    parse_tree.resolve_bases(root.all_types(), lambda ns: ns.resolve_scoped_type, recorder, report)
+    return merge_results(results) if results else None
+
+
+def scope_resolver(ns):
+    # resolve_name(name) for the body of a type collection or interface,
+    # as resolved by a single file conversion
+    interface = ns.parent.types.get(ns.name)
+    return parse_tree.interface_resolver(ns.resolve_scoped_type,
+                                         interface.info.get('extends') if interface else None)
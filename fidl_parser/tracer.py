@@ -0,0 +1,111 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Conversion tracing
+#
+#  A tracer instruments the handlers compiled from the parse map used
+#  by parse_tree.convert_fidl_tree(). Without a tracer the handlers run
+#  undecorated.
+#
+#  TRACE_STATS records call counts and cumulative (inclusive) time for
+#  each helper, keyed by helper name and the grammar rule it was
+#  applied to.
+#
+#  TRACE_CALLS additionally logs every helper call, indented by call
+#  depth, through the log function given to the tracer.
+#
+import time
+
+TRACE_OFF = 0
+TRACE_STATS = 1
+TRACE_CALLS = 2
+
+
+class Tracer:
+    def __init__(self, level: int = TRACE_STATS, log=print):
+        self._level = level
+        self._log = log
+        self._depth = 0
+        self._stats = {}
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def enabled(self):
+        return self._level > TRACE_OFF
+
+    @property
+    def stats(self) -> dict:
+        # (helper name, rule) -> [ call count, cumulative seconds ]
+        return self._stats
+
+    def log(self, message):
+        if self._level >= TRACE_CALLS:
+            self._log(f"{'  '*self._depth}{message}")
+
+    def reset(self):
+        self._stats = {}
+
+    def instrument(self, handler, name: str, entry: str = None):
+        # Wrap a handler compiled from a parse map entry. Statistics
+        # are keyed on the helper name and the rule the handler was
+        # applied to, and on the entry it looks for if given.
+        def wrap(state, lark_tree, *args):
+            if entry is not None:
+                rule = f"{lark_tree.data}[{entry}]"
+            else:
+                rule = f"{lark_tree.data}"
+
+            if self._level >= TRACE_CALLS:
+                self.log(f"{name}({rule})")
+
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                res = handler(state, lark_tree, *args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._depth -= 1
+
+            key = (name, rule)
+            stat = self._stats.get(key)
+            if stat is None:
+                self._stats[key] = [ 1, elapsed ]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+
+            if self._level >= TRACE_CALLS:
+                self.log(f"{name}({rule}) -> {describe_result(res)}")
+
+            return res
+
+        wrap.__name__ = name
+        wrap.__wrapped__ = handler
+        return wrap
+
+    def report(self) -> str:
+        lines = [ f"{'calls':>8} {'total ms':>10} {'avg us':>9}  helper(rule)" ]
+        for (name, rule), (count, elapsed) in sorted(self._stats.items(),
+                                                     key=lambda item: item[1][1],
+                                                     reverse=True):
+            lines.append(f"{count:>8} {elapsed*1000:>10.3f} {elapsed*1000000/count:>9.2f}  {name}({rule})")
+
+        return "\n".join(lines)
+
+
+def describe_result(res):
+    if res is None:
+        return "None"
+
+    if isinstance(res, dict):
+        return f"{{{', '.join(res.keys())}}}"
+
+    return f"{type(res).__name__}"
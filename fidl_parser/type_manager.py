@@ -11,10 +11,30 @@
 #  A namespace tree populated by types.
 #  Each type hosts a dictionary of arbitrary data.
 #
+#  The root namespace keeps a flat index from the qualified name of
+#  each type in the tree, such as "MyTypes.MyStruct", to the type.
+#  Qualified names exclude the root namespace itself and are interned.
+#  They are cached on each element and recomputed when the element,
+#  or one of its ancestors, is moved to a new parent.
+#
+#  Scoped lookups through resolve_scoped_type() are memoized per
+#  namespace. The memo is dropped whenever a type is added to the tree.
+#
+#  A type extending another type has it as its base. The flattened
+#  lists of members, methods or broadcasts of a type, including those
+#  inherited, and an index of them by name, are computed once per type
+#  and dropped when the base of the type, or of one of its bases, is
+#  changed.
+#
+import sys
+
+
 class Base:
     def __init__(self, name: str):
         self._parent = None
-        self._name = name
+        self._name = sys.intern(name)
+        self._root = None
+        self._qualified_name = None
 
     @property
     def name(self):
@@ -27,16 +47,31 @@ class Base:
     @parent.setter
     def parent(self, parent):
         self._parent = parent
+        self._invalidate()
+
+    def _invalidate(self):
+        self._root = None
+        self._qualified_name = None
 
     @property
     def root(self):
-        tmp = self
-        while True:
-            if tmp.parent == None:
-                return tmp
-            tmp = tmp.parent
+        if self._root is None:
+            self._root = self if self._parent is None else self._parent.root
 
+        return self._root
 
+    @property
+    def qualified_name(self) -> str:
+        # Dot separated path from, but not including, root
+        if self._qualified_name is None:
+            if self._parent is None:
+                self._qualified_name = ''
+            elif self._parent.parent is None:
+                self._qualified_name = self._name
+            else:
+                self._qualified_name = sys.intern(f"{self._parent.qualified_name}.{self._name}")
+
+        return self._qualified_name
 
     def path(self):
         res = []
@@ -48,17 +83,15 @@ class Base:
         return res
 
     def path_string(self, separator='.'):
-        res = ''
-        for path_elem in self.path():
-            if res == '':
-                res = path_elem.name
-                continue
+        if self._parent is None:
+            return self._name
 
-            res = f"{res}{separator}{path_elem.name}"
+        if separator == '.':
+            return f"{self.root.name}.{self.qualified_name}"
 
-        return res
+        return separator.join([ path_elem.name for path_elem in self.path() ])
 
-    def dump(self):
+    def dump(self, log=print):
         pass
 
 class NameSpace(Base):
@@ -67,59 +100,148 @@ class NameSpace(Base):
         self._namespaces = {}
         self._types = {}
 
+        # Only used when this namespace is root
+        self._index = {}
+        self._generation = 0
+
+        # Memoized resolve_scoped_type() results
+        self._scoped = {}
+        self._scoped_generation = 0
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._scoped = {}
+        for ns in self._namespaces.values():
+            ns._invalidate()
+
+        for type in self._types.values():
+            type._invalidate()
+
+    def _index_type(self, type):
+        root = self.root
+        root._index[type.qualified_name] = type
+        root._generation += 1
+
+    def _index_subtree(self):
+        for type in self._types.values():
+            self._index_type(type)
+
+        for ns in self._namespaces.values():
+            ns._index_subtree()
+
     def add_namespace(self, namespace):
-        namespace.parent = self
+        # Returns the namespace now hosted under namespace.name,
+        # which is an existing namespace if there was one.
         if namespace.name not in self._namespaces:
+            namespace.parent = self
             self._namespaces[namespace.name] = namespace
-            return None
+            namespace._index_subtree()
+            return namespace
 
         #
-        # Adopt child
-        #
-        new_child = self._namespaces[namespace.name]
-        [ new_child.add_namespace(ns) for ns in namespace.namespaces]
-        self._namespaces[namespace.name] = namespace
-
-        #
-        # Add types to child
+        # Merge with existing child.
         # Overwrite any existing types.
         #
-        self._types.update(namespace.types)
-        return None
+        existing = self._namespaces[namespace.name]
+        for ns in list(namespace.namespaces.values()):
+            existing.add_namespace(ns)
+
+        for type in list(namespace.types.values()):
+            existing.add_type(type)
+
+        return existing
+
+    def add_namespace_path(self, path_list):
+        # Create, or return existing, namespaces along path_list
+        ns = self
+        for name in path_list:
+            ns = ns.add_namespace(NameSpace(name))
+
+        return ns
+
+    def find_namespace(self, path_list):
+        ns = self
+        for name in path_list:
+            if name not in ns.namespaces:
+                return None
+            ns = ns.namespaces[name]
+
+        return ns
 
     def add_type(self, type):
         self._types[type.name] = type
         type.parent = self
+        self._index_type(type)
         return None
 
-    def resolve_type_list(self, path_list):
-        # Are we at the end of the path at a type?
-        if len(path_list) == 1:
-            if path_list[0] in self.types:
-                return self.types[path_list[0]]
-
+    def remove_type(self, type):
+        # Remove type, if it is still the type hosted under its name
+        if self._types.get(type.name) is not type:
             return None
 
-        # We are still traversing the namespace tree
+        root = self.root
+        del self._types[type.name]
+        if root._index.get(type.qualified_name) is type:
+            del root._index[type.qualified_name]
+        root._generation += 1
+        return type
 
-        # Do we have the next element in the path list
-        # as one of our hosted namespaces?
-        #
-        if not path_list[0] in self.namespaces:
-            return None
+    def all_types(self):
+        # Types in this namespace and in all namespaces below it
+        res = list(self._types.values())
+        for ns in self._namespaces.values():
+            res.extend(ns.all_types())
+
+        return res
+
+    def _lookup(self, sym_name):
+        # sym_name relative to this namespace
+        if self._parent is None:
+            return self._index.get(sym_name)
 
-        # Recurse into hosted namespace
-        return self.namespaces[path_list[0]].resolve_type_list(path_list[1:])
+        return self.root._index.get(f"{self.qualified_name}.{sym_name}")
 
+    def resolve_type_list(self, path_list):
+        return self._lookup('.'.join(path_list))
 
     def resolve_type(self, sym_name, separator='.'):
+        if separator != '.':
+            return self.resolve_type_list(sym_name.split(separator))
+
         if self.parent is not None and sym_name[0] == separator:
             #
             # Check if we are not root and type name is absolute path
             #
-            return self.root.resolve_type(sym_name[1:])
+            return self.root._lookup(sym_name[1:])
+
+        return self._lookup(sym_name)
 
-        return self.resolve_type_list(sym_name.split(separator))
+    def resolve_scoped_type(self, sym_name, separator='.'):
+        #
+        # Resolve sym_name relative to this namespace, or
+        # to any of its enclosing namespaces up to root.
+        #
+        if separator != '.':
+            sym_name = '.'.join(sym_name.split(separator))
+
+        generation = self.root._generation
+        if self._scoped_generation != generation:
+            self._scoped = {}
+            self._scoped_generation = generation
+
+        if sym_name in self._scoped:
+            return self._scoped[sym_name]
+
+        res = None
+        ns = self
+        while ns is not None:
+            res = ns._lookup(sym_name)
+            if res:
+                break
+            ns = ns.parent
+
+        self._scoped[sym_name] = res
+        return res
 
     @property
     def types(self) -> dict:
@@ -129,16 +251,86 @@ class NameSpace(Base):
     def namespaces(self) -> dict:
         return self._namespaces
 
-    def dump(self):
-        [ print(f"{self.path_string()}.{k} = {v.info}") for k,v in self.types.items() ]
-        [ v.dump() for k,v in self.namespaces.items() ]
+    def dump(self, log=print):
+        [ log(f"{self.path_string()}.{k} = {v.info}") for k,v in self.types.items() ]
+        [ v.dump(log) for k,v in self.namespaces.items() ]
 
 class Type(Base):
     def __init__(self, name: str, info: dict):
         super().__init__(name)
         self._info = info
+        self._base = None
+        self._derived = []
+
+        # Flattened lists, and name indexes, by list name
+        self._flattened = {}
+        self._indexes = {}
 
     @property
     def info(self):
         return self._info
 
+    @property
+    def base(self):
+        # The type extended by this type, or None
+        return self._base
+
+    @base.setter
+    def base(self, base):
+        ancestor = base
+        while ancestor is not None:
+            if ancestor is self:
+                raise Exception(f"Cyclic inheritance of {self.qualified_name}")
+            ancestor = ancestor._base
+
+        if self._base is not None:
+            self._base._derived.remove(self)
+
+        self._base = base
+        if base is not None:
+            base._derived.append(self)
+
+        self._drop_flattened()
+
+    def _drop_flattened(self):
+        pending = [ self ]
+        while pending:
+            type = pending.pop()
+            type._flattened = {}
+            type._indexes = {}
+            pending.extend(type._derived)
+
+    def _chain(self, cache):
+        # This type and its bases up to, but not including, the
+        # closest base with an entry in cache. Returns the chain,
+        # base first, and that base, or None.
+        chain = []
+        type = self
+        while type is not None and cache(type) is None:
+            chain.append(type)
+            type = type._base
+
+        chain.reverse()
+        return (chain, type)
+
+    def flattened(self, list_name: str = 'members') -> list:
+        # Elements of info[list_name] preceded by those inherited from
+        # the base types. Computed once per type, and shared.
+        (chain, base) = self._chain(lambda type: type._flattened.get(list_name))
+        res = base._flattened[list_name] if base is not None else []
+        for type in chain:
+            res = res + type._info.get(list_name, [])
+            type._flattened[list_name] = res
+
+        return res
+
+    def lookup(self, name: str, list_name: str = 'members'):
+        # Element of flattened(list_name) with the given name, or None
+        (chain, base) = self._chain(lambda type: type._indexes.get(list_name))
+        index = base._indexes[list_name] if base is not None else {}
+        for type in chain:
+            index = dict(index)
+            index.update([ (elem['name'], elem) for elem in type._info.get(list_name, []) ])
+            type._indexes[list_name] = index
+
+        return index.get(name)
@@ -0,0 +1,164 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# Type usage index
+#
+#  Maps the qualified name of each type to the elements using it: the
+#  datatypes of type collections, and the methods, broadcasts and
+#  attributes of interfaces. The index is filled while datatypes are
+#  resolved, through the recorder passed to parse_tree.resolve_body().
+#
+#  A type extending another type, including an interface, is recorded
+#  as a user of its base by parse_tree.resolve_bases().
+#
+#  impact() also follows users that are types themselves, such as
+#  structs, typedefs and arrays, and returns every element using a type
+#  directly or through other types. Each element of the result is
+#  visited once, so the time taken is proportional to the result.
+#
+interface_kinds = {
+    'methods': 'method',
+    'events': 'broadcast',
+    'attributes': 'attribute',
+}
+
+
+def element_kind(list_name, element):
+    if list_name in interface_kinds:
+        return interface_kinds[list_name]
+
+    if list_name == 'interfaces':
+        return 'interface'
+
+    if 'type' not in element:
+        return 'array'
+
+    # The converter tags typedefs as unions
+    if 'members' not in element and element['type'] == 'union':
+        return 'typedef'
+
+    return element['type']
+
+
+class Usage:
+    def __init__(self, kind: str, qualified_name: str, info: dict, file_name: str = None):
+        self._kind = kind
+        self._qualified_name = qualified_name
+        self._info = info
+        self._file_name = file_name
+
+    @property
+    def kind(self):
+        # struct, union, enumeration, map, typedef, array, constant,
+        # interface, method, broadcast or attribute
+        return self._kind
+
+    @property
+    def qualified_name(self):
+        return self._qualified_name
+
+    @property
+    def info(self) -> dict:
+        # The converted element
+        return self._info
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def is_datatype(self):
+        # Datatypes, and interfaces, can be used by other elements
+        return self._kind not in interface_kinds.values()
+
+    def to_dict(self) -> dict:
+        res = { 'kind': self._kind, 'name': self._qualified_name }
+        if self._file_name is not None:
+            res['file'] = self._file_name
+
+        return res
+
+    def __repr__(self):
+        return f"Usage({self._kind} {self._qualified_name})"
+
+
+class UsageIndex:
+    def __init__(self):
+        # Type name -> { (kind, element name): Usage }
+        self._users = {}
+
+        # File name -> [ (type name, (kind, element name)) ]
+        self._files = {}
+
+    def add(self, type_name: str, usage: Usage):
+        key = (usage.kind, usage.qualified_name)
+        users = self._users.get(type_name)
+        if users is None:
+            users = self._users[type_name] = {}
+        elif key in users:
+            return None
+
+        users[key] = usage
+        if usage.file_name is not None:
+            self._files.setdefault(usage.file_name, []).append((type_name, key))
+
+        return None
+
+    def recorder(self, namespace_name: str, file_name: str = None):
+        # Returns the record function for parse_tree.resolve_body()
+        # for a body in the namespace with the given qualified name.
+        usages = {}
+
+        def record(list_name, element, type):
+            usage = usages.get(id(element))
+            if usage is None:
+                if namespace_name:
+                    qualified_name = f"{namespace_name}.{element['name']}"
+                else:
+                    qualified_name = element['name']
+
+                usage = usages[id(element)] = Usage(element_kind(list_name, element),
+                                                    qualified_name, element, file_name)
+
+            self.add(type.qualified_name, usage)
+
+        return record
+
+    def remove_file(self, file_name: str):
+        # Remove the elements of file_name before it is resolved again
+        for (type_name, key) in self._files.pop(file_name, []):
+            users = self._users.get(type_name)
+            if users is None:
+                continue
+
+            users.pop(key, None)
+            if not users:
+                del self._users[type_name]
+
+        return None
+
+    def users(self, type_name: str) -> list:
+        # Elements using type_name directly
+        return list(self._users.get(type_name, {}).values())
+
+    def impact(self, type_name: str) -> list:
+        # Elements using type_name directly, or through other datatypes
+        res = []
+        seen = set()
+        pending = [ type_name ]
+        while pending:
+            for (key, usage) in self._users.get(pending.pop(), {}).items():
+                if key in seen:
+                    continue
+
+                seen.add(key)
+                res.append(usage)
+                if usage.is_datatype:
+                    pending.append(usage.qualified_name)
+
+        return res
@@ -0,0 +1,165 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+
+#
+# File watchers
+#
+#  A watcher reports which of a set of watched files have changed,
+#  been created or been removed since it was last asked.
+#
+#  InotifyWatcher watches the directories of the files with Linux
+#  inotify, through libc, and has a file descriptor that becomes
+#  readable when there are changes. Editors that save by renaming a
+#  new file over the old one are covered by watching directories.
+#
+#  PollingWatcher compares the modification time and size of each
+#  file every interval seconds. It is used where inotify is not
+#  available.
+#
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+inotify_event = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify not supported")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        # Watch descriptor -> directory
+        self._directories = {}
+        self._files = set()
+        self._changes = set()
+
+    @property
+    def interval(self):
+        # Seconds between calls to changes(), None when waiting for fileno()
+        return None
+
+    def fileno(self):
+        return self._fd
+
+    def watch(self, file_names):
+        for file_name in file_names:
+            file_name = os.path.abspath(file_name)
+            self._files.add(file_name)
+            directory = os.path.dirname(file_name)
+            if directory in self._directories.values():
+                continue
+
+            wd = self._libc.inotify_add_watch(self._fd, directory.encode(), IN_WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"{directory}: {os.strerror(errno)}")
+
+            self._directories[wd] = directory
+
+    def changes(self) -> set:
+        # Absolute names of the watched files changed since the last call
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                (wd, mask, cookie, length) = inotify_event.unpack_from(data, offset)
+                offset += inotify_event.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+
+                directory = self._directories.get(wd)
+                if directory is None or not name:
+                    continue
+
+                file_name = os.path.join(directory, name)
+                if file_name in self._files:
+                    self._changes.add(file_name)
+
+        res = self._changes
+        self._changes = set()
+        return res
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    def __init__(self, interval: float = 0.5):
+        self._interval = interval
+        # File name -> (mtime, size), or None if missing
+        self._files = {}
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def fileno(self):
+        return None
+
+    def _stat(self, file_name):
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def watch(self, file_names):
+        for file_name in file_names:
+            file_name = os.path.abspath(file_name)
+            if file_name not in self._files:
+                self._files[file_name] = self._stat(file_name)
+
+    def changes(self) -> set:
+        res = set()
+        for file_name, old_stat in self._files.items():
+            stat = self._stat(file_name)
+            if stat != old_stat:
+                self._files[file_name] = stat
+                res.add(file_name)
+
+        return res
+
+    def close(self):
+        pass
+
+
+def create_watcher(polling: bool = False, interval: float = 0.5):
+    # Inotify where available, polling otherwise
+    if not polling:
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(interval)
@@ -6,45 +6,216 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import getopt
-from lark import Lark, logger, Tree, Token
+from lark import logger, Tree, Token
 import sys
 import os
-from pkg_resources import resource_string as resource_bytes
 import logging
 import json
-from fidl_parser import parse_tree
+import contextlib
+from fidl_parser import parse_tree, get_parser
+from fidl_parser.tracer import Tracer, TRACE_OFF, TRACE_STATS, TRACE_CALLS
+
+# Modules only used by some modes, such as deployment for .fdepl files
+# and stream for -S, are imported where they are used, to keep the
+# startup of a plain conversion short.
 
 def usage(name):
-    print(f"Usage: {name} <idl-file>")
+    print(f"Usage: {name} [-d] [-n] [-k] [-S] [-p] [-j jobs] [-f format] <idl-file> ...")
+    print("  Deployment (.fdepl) files are printed as the converted JSON")
+    print("  -d, --debug        Build the parser in lark debug mode")
+    print("  -v, --verbose      Trace every conversion helper call")
+    print("  -t, --trace-stats  Print per-helper call counts and times")
+    print("  -p, --profile      Print the time spent in each phase, and the tokens lexed and")
+    print("                     nodes converted per file, to stderr")
+    print("  --profile-json     Print the profile as JSON. Implies --profile")
+    print("  --profile-memory   Also trace allocations with tracemalloc. Implies --profile")
+    print("  -n, --tree-less, --no-tree")
+    print("                     Convert while parsing. Do not build or print the parse tree")
+    print("  -k, --keep-going   Recover from errors and report all of them to stderr as")
+    print("                     file:line:column: message. Implies --tree-less")
+    print("  -S, --stream       Memory map each .fidl file and convert it in chunks of top")
+    print("                     level declarations. Implies --tree-less")
+    print("  -j, --jobs=N       Batch mode. Convert files in N worker processes and print")
+    print("                     one JSON line per file, in input order")
+    print("  -f, --format=FMT   Print the model as json, compact, jsonl or table, with")
+    print("                     references to resolved datatypes instead of copies")
 
-def dump_tree(node, indent=0):
+def dump_tree(node, indent=0, out=print):
     if isinstance(node, Tree):
-        print(f"{' '*indent*2}{node.data}")
+        out(f"{' '*indent*2}{node.data}")
         for subnode in node.children:
-            dump_tree(subnode, indent + 1)
+            dump_tree(subnode, indent + 1, out)
         if len(node.children) == 0:
-            print(f"{' '*(indent*2+2)}[empty]")
+            out(f"{' '*(indent*2+2)}[empty]")
         else:
-            print(f"{' '*(indent*2)}--")
+            out(f"{' '*(indent*2)}--")
 
     elif isinstance(node, Token):
-        print(f"{' '*indent*2}{node.type}: {node.value} - {type(node.value)}")
+        out(f"{' '*indent*2}{node.type}: {node.value} - {type(node.value)}")
+    else:
+        out(f"{' '*indent*2}<unknown>{node}")
+
+#
+# Batch mode
+#
+# Each worker process builds its parser once in init_worker() and
+# then converts one file per convert_file() call. Failures are
+# returned as an error record for the file, and do not stop the batch.
+#
+worker_options = {}
+
+def init_worker(tree_less, debug, keep_going, stream_input):
+    worker_options['tree_less'] = tree_less
+    worker_options['keep_going'] = keep_going
+    worker_options['stream'] = stream_input
+    if tree_less:
+        get_parser(transformer=parse_tree.declaration_converter)
+    else:
+        worker_options['parser'] = get_parser(debug=debug)
+
+def convert_file(fidl_file_name):
+    record = { 'file': fidl_file_name }
+    try:
+        fidl_text = read_file(fidl_file_name, worker_options['stream'])
+        if fidl_file_name.endswith('.fdepl'):
+            from fidl_parser import deployment
+            record['model'] = deployment.convert_fdepl_text(fidl_text)
+        elif worker_options['keep_going']:
+            from fidl_parser import diagnostics
+            file_diagnostics = diagnostics.Diagnostics(fidl_file_name)
+            record['model'] = convert_text(fidl_file_name, fidl_text, diagnostics=file_diagnostics)
+            record['diagnostics'] = [ diagnostic.to_dict() for diagnostic in file_diagnostics.sorted() ]
+        elif worker_options['tree_less']:
+            record['model'] = convert_text(fidl_file_name, fidl_text)
+        else:
+            from fidl_parser import comment
+            (tree, comments) = comment.parse(worker_options['parser'], fidl_text)
+            lines = []
+            dump_tree(tree, out=lines.append)
+            record['tree'] = "\n".join(lines)
+            record['model'] = parse_tree.convert_fidl_tree(tree, comments=comments)
+
+    except Exception as err:
+        record['error'] = f"{type(err).__name__}: {err}"
+
+    return ('error' in record or bool(record.get('diagnostics')), json.dumps(record))
+
+def read_file(file_name, stream_input):
+    # The text of a file, or None for a .fidl file to convert in chunks
+    if stream_input and not file_name.endswith('.fdepl'):
+        return None
+
+    with open(file_name) as f:
+        return f.read()
+
+def convert_text(file_name, fidl_text, tracer=None, **options):
+    # Tree-less conversion of a file read by read_file()
+    if fidl_text is None:
+        from fidl_parser import stream
+        return stream.convert_fidl_stream(file_name, tracer, **options)
+
+    return parse_tree.convert_fidl_text(fidl_text, tracer, **options)
+
+def print_profile(profiler, profile_format):
+    sys.stdout.flush()
+    if profile_format == 'json':
+        print(json.dumps(profiler.to_dict(), indent=2), file=sys.stderr)
+    else:
+        print(profiler.report(), file=sys.stderr)
+
+def print_model(result, format):
+    # Streams the model to stdout. Without format, the output is
+    # the same as json.dumps(result, indent=2).
+    from fidl_parser import emitter
+    if format is None:
+        emitter.JsonEmitter(sys.stdout, 2, references=False).write(result)
+    elif format == 'jsonl':
+        emitter.RecordEmitter(sys.stdout).write(result)
+    elif format == 'table':
+        emitter.TableEmitter(sys.stdout, 2).write(result)
     else:
-        print(f"{' '*indent*2}<unknown>{node}")
+        emitter.JsonEmitter(sys.stdout, 2 if format == 'json' else None).write(result)
+
+    print()
+
+def run_batch(fidl_file_names, jobs, tree_less, debug, keep_going, stream_input):
+    # Only imported in batch mode, as it is slow to import
+    import concurrent.futures
+
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                initializer=init_worker,
+                                                initargs=(tree_less, debug, keep_going, stream_input)) as executor:
+        # map() returns the results in input order as they complete
+        for (failed, record) in executor.map(convert_file, fidl_file_names):
+            print(record, flush=True)
+            if failed:
+                failures += 1
+
+    return failures
 
 if __name__ == "__main__":
     try:
         options, remainder = getopt.getopt(
             sys.argv[1:],
-            's:i:',
-            ['server=', 'id='])
+            'dvtnkSpj:f:s:i:',
+            ['debug', 'verbose', 'trace-stats', 'tree-less', 'no-tree', 'keep-going', 'stream', 'profile',
+             'profile-json', 'profile-memory', 'jobs=', 'format=', 'server=', 'id='])
     except getopt.GetoptError as err:
         print(err)
         usage(sys.argv[0])
         sys.exit(1)
 
+    debug = False
+    trace_level = TRACE_OFF
+    tree_less = False
+    keep_going = False
+    stream_input = False
+    profile_format = None
+    profile_memory = False
+    jobs = None
+    format = None
     for opt, arg in options:
-        if opt in ('-s', '--server'):
+        if opt in ('-d', '--debug'):
+            debug = True
+        elif opt in ('-v', '--verbose'):
+            trace_level = TRACE_CALLS
+        elif opt in ('-t', '--trace-stats'):
+            trace_level = max(trace_level, TRACE_STATS)
+        elif opt in ('-n', '--tree-less', '--no-tree'):
+            tree_less = True
+        elif opt in ('-k', '--keep-going'):
+            # Only the tree-less conversion recovers from errors
+            keep_going = True
+            tree_less = True
+        elif opt in ('-S', '--stream'):
+            stream_input = True
+            tree_less = True
+        elif opt in ('-p', '--profile'):
+            profile_format = profile_format or 'table'
+        elif opt == '--profile-json':
+            profile_format = 'json'
+        elif opt == '--profile-memory':
+            profile_format = profile_format or 'table'
+            profile_memory = True
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                jobs = 0
+
+            if jobs < 1:
+                print(f"Invalid number of jobs: {arg}")
+                usage(sys.argv[0])
+                sys.exit(255)
+        elif opt in ('-f', '--format'):
+            if arg not in ('json', 'compact', 'jsonl', 'table'):
+                print(f"Invalid format: {arg}")
+                usage(sys.argv[0])
+                sys.exit(255)
+
+            format = arg
+        elif opt in ('-s', '--server'):
             pass # Future options
         elif opt in ('-i', '--id'):
             pass # Future options
@@ -58,22 +229,93 @@ if __name__ == "__main__":
         usage(sys.argv[0])
         sys.exit(255)
 
-    logger.setLevel(logging.DEBUG)
-    fidl_grammar = resource_bytes('fidl_parser', 'francaidl.lark').decode('utf-8')
-    lark_parser = Lark(fidl_grammar, start="root", parser="lalr", debug=True)
+    if jobs is not None:
+        if trace_level != TRACE_OFF or profile_format is not None:
+            print("Tracing and profiling are not supported in batch mode")
+            sys.exit(255)
+
+        sys.exit(1 if run_batch(remainder, jobs, tree_less, debug, keep_going, stream_input) else 0)
+
+    # Lark logs grammar collisions, and loading the parser tables
+    if debug:
+        logger.setLevel(logging.DEBUG)
+
+    if not tree_less:
+        lark_parser = get_parser(debug=debug)
+
+    tracer = Tracer(trace_level) if trace_level != TRACE_OFF else None
+
+    # Phases are only timed with a profiler
+    if profile_format is not None:
+        from fidl_parser.profile import Profiler, profiled
+        profiler = Profiler(profile_memory)
+    else:
+        profiler = None
+
+        def profiled(profiler, phase, func, *args, **options):
+            return func(*args, **options)
 
+    reported = 0
     for fidl_file_name in remainder:
-        with open(fidl_file_name) as f:
-            fidl_text = f.read()
-
-        print(f"----------------")
-        print(f"FILE: {fidl_file_name}")
-        print(f"----------------")
-        tree = lark_parser.parse(fidl_text)
-        dump_tree(tree)
-#        dict_tree = parse_tree.lark_to_dict(tree)
-#        print(f"{json.dumps(dict_tree, indent=2)}")
-        print("-------------------------")
-        svc_tree = parse_tree.convert_fidl_tree(tree)
-        print(f"{json.dumps(svc_tree, indent=2)}")
-        print("\n")
+        with profiler.file(fidl_file_name) if profiler is not None else contextlib.nullcontext():
+            fidl_text = profiled(profiler, 'read', read_file, fidl_file_name, stream_input)
+            print(f"----------------")
+            print(f"FILE: {fidl_file_name}")
+            print(f"----------------")
+            if fidl_file_name.endswith('.fdepl'):
+                from fidl_parser import deployment
+                fdepl_tree = deployment.convert_fdepl_text(fidl_text, tracer, profiler)
+                print(profiled(profiler, 'encode', json.dumps, fdepl_tree, indent=2))
+                print("\n")
+                continue
+
+            file_diagnostics = None
+            if keep_going:
+                from fidl_parser import diagnostics
+                file_diagnostics = diagnostics.Diagnostics(fidl_file_name)
+
+            if tree_less and format == 'jsonl':
+                # Records are printed while the file is converted
+                from fidl_parser import emitter
+                records = emitter.RecordEmitter(sys.stdout)
+                declared = records.declared if profiler is None else profiler.timed('encode', records.declared)
+                svc_tree = convert_text(fidl_file_name, fidl_text, tracer, declared=declared,
+                                        diagnostics=file_diagnostics, profiler=profiler)
+                if svc_tree is not None:
+                    profiled(profiler, 'encode', records.package, svc_tree)
+                print("\n")
+            elif tree_less:
+                svc_tree = convert_text(fidl_file_name, fidl_text, tracer, diagnostics=file_diagnostics,
+                                        profiler=profiler)
+                if svc_tree is not None:
+                    profiled(profiler, 'encode', print_model, svc_tree, format)
+                print("\n")
+
+            if file_diagnostics is not None:
+                sys.stdout.flush()
+                for diagnostic in file_diagnostics.sorted():
+                    print(diagnostic, file=sys.stderr)
+
+                reported += len(file_diagnostics)
+
+            if tree_less:
+                continue
+
+            from fidl_parser import comment
+            (tree, comments) = comment.parse(lark_parser, fidl_text, profiler)
+            profiled(profiler, 'dump_tree', dump_tree, tree)
+#            dict_tree = parse_tree.lark_to_dict(tree)
+#            print(f"{json.dumps(dict_tree, indent=2)}")
+            print("-------------------------")
+            svc_tree = parse_tree.convert_fidl_tree(tree, tracer, comments=comments, profiler=profiler)
+            profiled(profiler, 'encode', print_model, svc_tree, format)
+            print("\n")
+
+    if tracer is not None:
+        print(tracer.report())
+
+    if profiler is not None:
+        print_profile(profiler, profile_format)
+
+    if reported:
+        sys.exit(1)
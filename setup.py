@@ -23,8 +23,8 @@ setuptools.setup(
     url="https://github.com/GENIVI/fidl-parser",
     packages=setuptools.find_packages(),
     install_requires=['lark'],
-    scripts=["fidl_tool.py" ],
-    data_files=[ 'fidl_parser/francaidl.lark'],
+    scripts=["fidl_tool.py", "fidl_daemon.py" ],
+    data_files=[ 'fidl_parser/francaidl.lark', 'fidl_parser/francadepl.lark' ],
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3.7",
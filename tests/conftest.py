@@ -0,0 +1,92 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# The tests run against the source tree, as the benchmarks do
+#
+import os
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+
+@pytest.fixture(autouse=True, scope='session')
+def cache_home(tmp_path_factory):
+    # Parser tables and cached models are written to a temporary cache
+    # directory, which the tools run by the tests inherit
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path_factory.mktemp('cache')))
+        monkeypatch.delenv('FIDL_PARSER_CACHE', raising=False)
+        yield
+
+
+@pytest.fixture
+def testcase():
+    # Path of a file under testcases/
+    return lambda *path: os.path.join(root, 'testcases', *path)
+
+
+@pytest.fixture
+def read_testcase(testcase):
+    # Text of a file under testcases/
+    def read(*path):
+        with open(testcase(*path)) as f:
+            return f.read()
+
+    return read
+
+
+# A project of three files. service.fidl uses the types of types.fidl,
+# and client.fidl imports service.fidl.
+project_files = {
+    'types.fidl': """package org.example
+typeCollection Types {
+  struct Point { Int32 x Int32 y }
+  struct Point3 extends Point { Int32 z }
+  enumeration Color { RED = 1 GREEN BLUE }
+}
+""",
+    'service.fidl': """package org.example
+import org.example.Types.* from "types.fidl"
+interface Service {
+  method move { in { Point p Point3 q } out { Color c } }
+  broadcast moved { out { Point3 at } }
+}
+""",
+    'client.fidl': """package org.client
+import model "service.fidl"
+interface Client {
+  attribute UInt8 count
+}
+"""
+}
+
+
+@pytest.fixture
+def write_files(tmp_path):
+    # Write files, a dictionary of file name -> text, to a temporary
+    # directory. Returns a function of a file name returning its path.
+    def write(files):
+        for (file_name, text) in files.items():
+            (tmp_path / file_name).write_text(text)
+
+        return lambda file_name: str(tmp_path / file_name)
+
+    return write
+
+
+@pytest.fixture
+def model_files():
+    # File name -> text of the project, for tests changing some files
+    return dict(project_files)
+
+
+@pytest.fixture
+def model(write_files, model_files):
+    # Path of a file of the project
+    return write_files(model_files)
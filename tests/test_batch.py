@@ -0,0 +1,45 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+import subprocess
+import sys
+
+from fidl_parser import parse_tree
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def batch(*args):
+    res = subprocess.run([ sys.executable, os.path.join(root, 'fidl_tool.py'), *args ],
+                         capture_output=True, text=True)
+    return (res.returncode, [ json.loads(line) for line in res.stdout.splitlines() ])
+
+
+def test_records_are_printed_in_input_order(testcase, read_testcase):
+    names = [ '60-Method.fidl', '01-Minimal.fidl', '65-Broadcast.fidl', '55-Attribute.fidl' ]
+    (returncode, records) = batch('-j', '2', '-n', *[ testcase('core_tests', name) for name in names ])
+
+    assert returncode == 0
+    assert [ os.path.basename(record['file']) for record in records ] == names
+    assert records[0]['model'] == json.loads(json.dumps(parse_tree.convert_fidl_text(read_testcase('core_tests', names[0]))))
+
+
+def test_tree_is_included_without_tree_less(testcase):
+    (returncode, records) = batch('-j', '1', testcase('core_tests', '01-Minimal.fidl'))
+    assert returncode == 0
+    assert records[0]['tree'].startswith('root')
+
+
+def test_failed_file_does_not_stop_the_batch(testcase, tmp_path):
+    broken = tmp_path / 'broken.fidl'
+    broken.write_text("package p\ninterface {")
+    (returncode, records) = batch('-j', '2', '-n', str(broken), testcase('core_tests', '01-Minimal.fidl'))
+
+    assert returncode == 1
+    assert records[0]['error'].startswith('Unexpected')
+    assert 'model' in records[1]
@@ -0,0 +1,105 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import glob
+import os
+import shutil
+
+import pytest
+
+from fidl_parser import cache, contract, diagnostics, parser
+
+text = b"package p\ntypeCollection T { struct S { UInt8 a } }\n"
+
+
+@pytest.fixture
+def fresh_version(monkeypatch):
+    # Compute the converter version again in the test
+    monkeypatch.setattr(cache, '_converter_version', None)
+    yield
+    cache._converter_version = None
+
+
+def entries(directory):
+    return sorted(entry for entry in os.listdir(directory) if entry.endswith('.model'))
+
+
+def test_second_conversion_is_a_hit(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    first = parse_cache.convert_fidl_file(text)
+    second = parse_cache.convert_fidl_file(text)
+    assert (parse_cache.misses, parse_cache.hits) == (1, 1)
+    assert second[0] == first[0]
+
+    parse_cache.convert_fidl_file(text + b"\n")
+    assert (parse_cache.misses, parse_cache.hits) == (2, 1)
+    assert len(entries(tmp_path)) == 2
+
+
+def test_empty_directory_disables_the_cache():
+    parse_cache = cache.ParseCache('')
+    parse_cache.convert_fidl_file(text)
+    parse_cache.convert_fidl_file(text)
+    assert (parse_cache.misses, parse_cache.hits) == (2, 0)
+
+
+def test_corrupt_entry_is_converted_again(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    parse_cache.convert_fidl_file(text)
+    (tmp_path / entries(tmp_path)[0]).write_bytes(b"not a model")
+
+    assert parse_cache.load(parse_cache.key(text)) is None
+    assert parse_cache.lookup(text)[0] is False
+    assert parse_cache.lookup(text)[0] is True
+
+
+@pytest.mark.parametrize('module', [ parser, diagnostics, contract ])
+def test_source_change_invalidates(tmp_path, monkeypatch, fresh_version, module):
+    version = cache.converter_version()
+    key = cache.ParseCache(str(tmp_path)).key(text)
+
+    # The grammars are read next to the parser module
+    source_dir = os.path.dirname(module.__file__)
+    for file_name in glob.glob(os.path.join(source_dir, '*.lark')):
+        shutil.copy(file_name, tmp_path)
+
+    changed = tmp_path / os.path.basename(module.__file__)
+    shutil.copy(module.__file__, changed)
+    with open(changed, 'a') as f:
+        f.write("\n# Changed\n")
+
+    monkeypatch.setattr(module, '__file__', str(changed))
+    cache._converter_version = None
+    assert cache.converter_version() != version
+    assert cache.ParseCache(str(tmp_path)).key(text) != key
+
+
+def test_grammar_change_invalidates(monkeypatch, fresh_version):
+    version = cache.converter_version()
+    grammar = parser.grammar_text()
+    monkeypatch.setattr(parser, 'grammar_text', lambda: grammar + "\n")
+    cache._converter_version = None
+    assert cache.converter_version() != version
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    keys = []
+    for index in range(4):
+        fidl_bytes = text + b"\n" * index
+        parse_cache.convert_fidl_file(fidl_bytes)
+        keys.append(parse_cache.key(fidl_bytes))
+        path = tmp_path / f"{keys[-1]}.model"
+        os.utime(path, (1000 + index, 1000 + index))
+
+    # A hit marks the oldest entry as recently used
+    assert parse_cache.load(keys[0]) is not None
+    size = (tmp_path / f"{keys[0]}.model").stat().st_size
+
+    evicting = cache.ParseCache(str(tmp_path), max_size=2 * size + size // 2)
+    evicting.evict()
+    assert evicting.evictions == 2
+    assert entries(tmp_path) == sorted([ f"{keys[0]}.model", f"{keys[3]}.model" ])
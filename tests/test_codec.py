@@ -0,0 +1,77 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import array
+import struct
+
+import pytest
+
+from fidl_parser import codec, parse_tree
+
+model = """package p
+typeCollection T {
+  struct Fixed { UInt8 a UInt32 b Boolean c }
+  struct Derived extends Fixed { Int16 d }
+  enumeration Color { RED GREEN BLUE }
+  struct Mixed { UInt16 id String text ByteBuffer data Fixed fixed Color color }
+  array Samples of Int32
+  array Names of String
+  union Value { UInt8 small String text }
+  typedef Id is UInt64
+  struct Nested { Samples samples Names names Value value Id id Integer(0, 1000) ranged }
+}
+"""
+
+
+@pytest.fixture(scope='module')
+def codecs():
+    return codec.create_codecs(parse_tree.convert_fidl_text(model))
+
+
+def round_trip(codecs, name, value):
+    data = codecs[name].pack(value)
+    assert codecs[name].unpack(data) == value
+    return data
+
+
+def test_fixed_struct_has_a_c_layout(codecs):
+    data = round_trip(codecs, 'T.Fixed', { 'a': 1, 'b': 2, 'c': True })
+    assert data == struct.pack('<BxxxI?xxx', 1, 2, True)
+    assert codecs['T.Fixed'].size == 12
+
+    # Inherited members come first
+    data = round_trip(codecs, 'T.Derived', { 'a': 1, 'b': 2, 'c': False, 'd': -3 })
+    assert data == struct.pack('<BxxxI?xh', 1, 2, False, -3)
+
+
+def test_variable_struct_round_trip(codecs):
+    value = { 'id': 7, 'text': "héllo", 'data': b"\x00\x01", 'fixed': { 'a': 1, 'b': 2, 'c': True }, 'color': 2 }
+    data = round_trip(codecs, 'T.Mixed', value)
+    assert codecs['T.Mixed'].size is None
+    assert data[2:6] == struct.pack('<I', len("héllo".encode('utf-8')))
+
+
+def test_arrays_unions_and_typedefs_round_trip(codecs):
+    round_trip(codecs, 'T.Samples', array.array('i', [ 1, -2, 3 ]))
+    round_trip(codecs, 'T.Names', [ "a", "", "bc" ])
+    assert round_trip(codecs, 'T.Value', { 'text': "x" })[:4] == struct.pack('<I', 1)
+    round_trip(codecs, 'T.Value', { 'small': 5 })
+    round_trip(codecs, 'T.Id', 2**64 - 1)
+    round_trip(codecs, 'T.Nested', { 'samples': array.array('i', [ 4 ]), 'names': [ "n" ],
+                                     'value': { 'small': 1 }, 'id': 9, 'ranged': 999 })
+
+
+def test_native_arrays_can_be_views():
+    codecs = codec.create_codecs(parse_tree.convert_fidl_text(model), zero_copy=True)
+    data = codecs['T.Samples'].pack(array.array('i', [ 1, 2, 3 ]))
+    view = codecs['T.Samples'].unpack(data)
+    assert isinstance(view, memoryview)
+    assert view.tolist() == [ 1, 2, 3 ]
+
+
+def test_trailing_bytes_are_an_error(codecs):
+    with pytest.raises(Exception, match="1 bytes left after unpacking T.Id"):
+        codecs['T.Id'].unpack(codecs['T.Id'].pack(1) + b"\x00")
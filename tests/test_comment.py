@@ -0,0 +1,83 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import time
+
+import pytest
+
+from fidl_parser import comment, get_parser, parse_tree
+
+
+def indented_model(indent):
+    # A commented struct and member, indented by indent spaces. The
+    # first member tries the comment of the struct, and fails.
+    pad = ' ' * indent
+    return (f"package p\ntypeCollection T {{\n"
+            f"{pad}<** @description: A struct **>\n"
+            f"{pad}struct S {{\n"
+            f"{pad}  UInt16 n\n"
+            f"{pad}  <** @description: A member **>\n"
+            f"{pad}  UInt8 m\n"
+            f"{pad}}}\n"
+            f"{pad}<** Not followed by a declaration **>\n"
+            f"}}\n")
+
+
+def test_comments_are_attached(read_testcase):
+    res = parse_tree.convert_fidl_text(read_testcase('core_tests', '61-MethodComments.fidl'))
+    interface = res['interfaces']
+    (callme, with_error1, with_error2) = interface['methods']
+
+    assert callme['comment'].description == "This is a method comment."
+    assert callme['in']['members'][0]['comment'].description == "This is an input argument comment."
+    assert callme['out']['members'][0]['comment'].description == "This is an output argument comment."
+    assert with_error1['error']['comment'].description == "This is an error enumeration comment."
+    assert with_error1['error']['members'][0]['comment'].description == "This is an error enumerator comment."
+    assert with_error2['error']['comment'].description == "This is another error enumeration comment."
+    assert interface['datatypes'][0]['comment'].description == "This is an enumeration comment."
+
+
+def test_tree_and_tree_less_attach_the_same_comments():
+    text = indented_model(4)
+    (tree, comments) = comment.parse(get_parser(), text)
+    assert parse_tree.convert_fidl_tree(tree, comments=comments) == parse_tree.convert_fidl_text(text)
+
+
+def test_comment_without_declaration_is_dropped():
+    struct = parse_tree.convert_fidl_text(indented_model(4))['types']['datatypes'][0]
+    assert struct['comment'] == "@description: A struct"
+    assert 'comment' not in struct['members'][0]
+    assert struct['members'][1]['comment'] == "@description: A member"
+    assert len(parse_tree.convert_fidl_text(indented_model(4))['types']['datatypes']) == 1
+
+
+def test_tags_are_parsed_when_read():
+    text = comment.Comment("Intro\n@description: First\n   line\n@author: me")
+    assert '_tags' not in text.__dict__
+    assert text.tags == [ (None, "Intro"), ('description', "First\nline"), ('author', "me") ]
+    assert text.tag('author') == "me"
+    assert text.tag('missing') is None
+
+
+# Gaps that took seconds to fail to match when whitespace and line
+# comments could be split in several ways. Longer gaps did not finish.
+@pytest.mark.parametrize('gap', [ ' ' * 22, '\t' * 22, '\n' + ' ' * 21, '//' * 16 + '\n',
+                                  '// a // b  // c\n' * 5, '/* c */ ' * 200 ])
+def test_failed_header_match_is_linear(gap):
+    # A member tries the comment of its struct, and fails at the
+    # struct name
+    start = time.perf_counter()
+    assert comment.declaration_header.fullmatch(gap + 'struct A { ') is None
+    assert comment.error_header.fullmatch(gap + 'error { X') is None
+    assert time.perf_counter() - start < 0.5
+
+
+def test_long_indented_gap_converts():
+    start = time.perf_counter()
+    struct = parse_tree.convert_fidl_text(indented_model(20))['types']['datatypes'][0]
+    assert struct['comment'] == "@description: A struct"
+    assert struct['members'][1]['comment'] == "@description: A member"
+    assert time.perf_counter() - start < 0.5
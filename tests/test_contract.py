@@ -0,0 +1,110 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import pytest
+
+from fidl_parser import contract, parse_tree
+
+model = """package p
+interface Door {
+  const UInt8 max = 3
+  method open { in { UInt8 width } }
+  method close { }
+  broadcast opened { }
+
+  contract {
+    PSM {
+      initial closed
+      state closed {
+        on call open [width <= max] -> opening
+        on call close -> closed
+      }
+      state opening {
+        on respond open -> open
+      }
+      state open {
+        on signal opened -> open
+        on call close -> closing
+      }
+      state closing {
+        on respond close -> closed
+      }
+    }
+  }
+}
+"""
+
+
+def door(text=model):
+    return contract.compile_contracts(parse_tree.convert_fidl_text(text))['Door']
+
+
+def test_machine_is_compiled_into_a_table():
+    machine = door()
+    assert machine.states == [ 'closed', 'opening', 'open', 'closing' ]
+    assert machine.states[machine.initial] == 'closed'
+    assert 'signal opened' in machine.events
+    assert len(machine.table) == len(machine.states) * len(machine.events)
+
+
+def test_valid_trace_is_accepted():
+    machine = door()
+    events = machine.encode([ ('call open', { 'width': 3 }), 'respond open', 'signal opened',
+                              'call close', 'respond close', 'call close' ])
+    checker = machine.check(events)
+    assert (checker.state, checker.position) == ('closed', 6)
+
+    # A checker can be fed in parts
+    checker = machine.checker()
+    checker.feed(events[:2])
+    assert checker.state == 'open'
+    checker.feed(events[2:])
+    assert checker.state == 'closed'
+
+
+def test_event_not_allowed_in_state():
+    machine = door()
+    with pytest.raises(Exception, match="Event respond close at position 1 not allowed in state closed"):
+        machine.check(machine.encode([ 'call close', 'respond close' ]))
+
+
+def test_event_id_out_of_range():
+    # Ids that would index another row of the table, or wrap around
+    # from its end, are not allowed in any state
+    machine = door()
+    width = len(machine.events)
+    for event in (width, width + 3, len(machine.table) - 1, len(machine.table), 1 << 70, -1, -width, -1 << 70):
+        for values in (None, { 'width': 1 }):
+            checker = machine.checker()
+            checker.feed([ machine.event_id('call close') ])
+            with pytest.raises(Exception, match=f"Event {event} at position 1 not allowed in state closed"):
+                checker.feed([ event if values is None else (event, values) ])
+
+            assert (checker.state, checker.position) == ('closed', 1)
+
+
+def test_guard_that_does_not_hold():
+    machine = door()
+    with pytest.raises(Exception, match="No guard of event call open at position 0 holds in state closed"):
+        machine.check(machine.encode([ ('call open', { 'width': 4 }) ]))
+
+    with pytest.raises(Exception, match="No value for width in guard at position 0"):
+        machine.check(machine.encode([ 'call open' ]))
+
+
+def test_unknown_event_and_target():
+    with pytest.raises(Exception, match="Unknown event call lock for contract of Door"):
+        door().event_id('call lock')
+
+    with pytest.raises(Exception, match="Unknown target state ajar in state closing of contract of Door"):
+        door(model.replace("on respond close -> closed", "on respond close -> ajar"))
+
+
+def test_error_guards(read_testcase):
+    result = parse_tree.convert_fidl_text(read_testcase('core_tests', 'contracts', 'ValidUsageOfErrorKeywords.fidl'))
+    machine = contract.compile_contracts(result)['InterfaceTest']
+    events = machine.encode([ ('error forceEnumError', { 'errorval': 1 }) ])
+    assert machine.check(events, { 'savedError': 1 }).state == 'start'
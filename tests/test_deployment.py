@@ -0,0 +1,99 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import os
+
+import pytest
+
+from fidl_parser import deployment
+from fidl_parser.project import Project
+
+spec = """specification org.example.Spec {
+  for interfaces { ServiceId: Integer; }
+  for methods { MethodId: Integer; Reliable: Boolean (default: false); }
+  for broadcasts { EventId: Integer; }
+  for arguments { Label: String (optional); }
+  for structs { Packed: Boolean (default: false); }
+  for struct_fields { Offset: Integer (optional); }
+  for enumerations { Width: Integer (default: 4); }
+  for instances { InstanceId: Integer; }
+}
+"""
+
+
+def deployment_file(body):
+    return f'package org.deploy\nimport "spec.fdepl"\nimport "service.fidl"\n{body}'
+
+
+service_deployment = """define org.example.Spec for interface org.example.Service {
+  ServiceId = 7
+  method move { MethodId = 1 in { p { Label = "from" } } }
+  broadcast moved { EventId = 2 }
+}
+define org.example.Spec for typeCollection org.example.Types {
+  struct Point { Packed = true x { Offset = 0 } }
+}
+define org.example.Spec for provider as Server {
+  instance org.example.Service { InstanceId = 3 }
+}
+"""
+
+
+def bind(model_files, write_files, body):
+    path = write_files(dict(model_files, **{ 'spec.fdepl': spec, 'service.fdepl': deployment_file(body) }))
+    depl = deployment.Deployment([ path('service.fdepl') ]).load()
+    project = Project(depl.model_files, workers=1).load()
+    return depl.bind(project.namespace)
+
+
+def errors(binding):
+    # Messages without the file name
+    return sorted(error.split(': ', 1)[1] for error in binding.errors)
+
+
+def test_properties_are_bound_with_defaults(model_files, write_files):
+    binding = bind(model_files, write_files, service_deployment)
+    assert binding.errors == []
+
+    properties = binding.properties
+    assert properties['org.example.Service'] == { 'ServiceId': 7 }
+    assert properties['org.example.Service.move'] == { 'MethodId': 1, 'Reliable': False }
+    assert properties['org.example.Service.move.in.p'] == { 'Label': "from" }
+    assert properties['org.example.Types.Point'] == { 'Packed': True }
+    assert properties['org.example.Types.Point.x'] == { 'Offset': 0 }
+    assert properties['org.example.Types.Color'] == { 'Width': 4 }
+
+
+def test_model_files_are_imported(model_files, write_files):
+    path = write_files(dict(model_files, **{ 'spec.fdepl': spec, 'service.fdepl': deployment_file("") }))
+    depl = deployment.Deployment([ path('service.fdepl') ]).load()
+    assert [ os.path.basename(file_name) for file_name in depl.model_files ] == [ 'service.fidl' ]
+    assert 'org.example.Spec' in depl.specifications
+
+
+@pytest.mark.parametrize('body, expected', [
+    ("""define org.example.Spec for interface org.example.Service {
+  ServiceId = 7
+  method move { MethodId = 1 }
+}""", [ "org.example.Service.moved: Missing mandatory property EventId" ]),
+    ("""define org.example.Spec for interface org.example.Service {
+  ServiceId = 7 method move { MethodId = 1 } broadcast moved { EventId = 2 }
+  method jump { MethodId = 3 }
+}""", [ "org.example.Service.jump: No method in the model" ]),
+    ("""define org.example.Spec for interface org.example.Service {
+  ServiceId = 7 method move { MethodId = 1 } broadcast moved { EventId = 2 }
+  method move { MethodId = 4 }
+}""", [ "org.example.Service.move: Deployed twice" ]),
+    ("""define org.example.Spec for interface org.example.Service {
+  ServiceId = "seven" method move { MethodId = 1 Color = 2 } broadcast moved { EventId = 2 }
+}""", [ "org.example.Service.move: Property Color is not defined for methods",
+        "org.example.Service: Property ServiceId: 'seven' is not of type Integer" ]),
+    ("""define org.example.Spec for provider as Server {
+  instance org.example.Nope { InstanceId = 3 }
+}""", [ "org.deploy.Server: No interface org.example.Nope in the model" ]),
+])
+def test_binding_errors(model_files, write_files, body, expected):
+    assert errors(bind(model_files, write_files, body)) == sorted(expected)
@@ -0,0 +1,137 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from fidl_parser import diagnostics, parse_tree
+from fidl_parser.project import Project
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Two syntax errors and an unresolved name, each in its own struct
+broken_model = """package p
+typeCollection T {
+  struct A { UInt8 a ; }
+  struct B { Nope b }
+  struct C { UInt8 c ] }
+}
+"""
+
+
+def collect(fidl_text):
+    # Diagnostics as text, and the converted result
+    file_diagnostics = diagnostics.Diagnostics('f.fidl')
+    result = parse_tree.convert_fidl_text(fidl_text, diagnostics=file_diagnostics)
+    return ([ str(diagnostic) for diagnostic in file_diagnostics.sorted() ], result)
+
+
+def datatype_names(result):
+    return sorted(datatype['name'] for datatype in result['types']['datatypes'])
+
+
+def test_all_errors_of_a_file_are_reported():
+    (messages, result) = collect(broken_model)
+    assert messages[0].startswith("f.fidl:3:22: Unexpected ';', expected ")
+    assert messages[1] == "f.fidl:4:14: Could not resolve type name Nope"
+    assert messages[2].startswith("f.fidl:5:22: Unexpected ']', expected ")
+    assert datatype_names(result) == [ 'A', 'B', 'C' ]
+
+    with pytest.raises(Exception):
+        parse_tree.convert_fidl_text(broken_model)
+
+
+@pytest.mark.parametrize('fidl_text, fixed_text, message', [
+    ("package p\ntypeCollection T {\n  struct A { UInt8 a }\n",
+     "package p\ntypeCollection T {\n  struct A { UInt8 a }\n}\n",
+     "f.fidl:3:22: Missing '}' before end of file"),
+    ("package p\ninterface I {\n  method m { in { UInt8 a }\n  attribute UInt8 b\n}\n",
+     "package p\ninterface I {\n  method m { in { UInt8 a } }\n  attribute UInt8 b\n}\n",
+     "f.fidl:4:3: Missing '}' before 'attribute'") ])
+def test_missing_closing_brace_is_inserted(fidl_text, fixed_text, message):
+    (messages, result) = collect(fidl_text)
+    assert messages == [ message ]
+    assert result == parse_tree.convert_fidl_text(fixed_text)
+
+
+def test_unresolved_base_and_constant_are_reported():
+    (messages, result) = collect("package p\ntypeCollection T {\n"
+                                 "  struct A extends Missing { UInt8 a }\n"
+                                 "  const UInt8 x = y + 1\n"
+                                 "  struct C { UInt8 c }\n}\n")
+    assert messages == [ "f.fidl:3:20: Could not resolve base type Missing of T.A",
+                         "f.fidl:4:9: Could not resolve constant y" ]
+    assert datatype_names(result) == [ 'A', 'C', 'x' ]
+
+
+def test_valid_file_has_no_diagnostics(read_testcase):
+    text = read_testcase('core_tests', '61-MethodComments.fidl')
+    (messages, result) = collect(text)
+    assert messages == []
+    assert result == parse_tree.convert_fidl_text(text)
+
+
+def test_diagnostics_survive_pickling():
+    file_diagnostics = diagnostics.Diagnostics('f.fidl')
+    parse_tree.convert_fidl_text(broken_model, diagnostics=file_diagnostics)
+    copy = pickle.loads(pickle.dumps(file_diagnostics))
+    assert [ diagnostic.to_dict() for diagnostic in copy ] == [ diagnostic.to_dict() for diagnostic in file_diagnostics ]
+
+
+def test_project_collects_the_diagnostics_of_each_file(model_files, write_files):
+    model_files['service.fidl'] = model_files['service.fidl'].replace("Point p", "Nope p") \
+                                                             .replace('"types.fidl"', '"types.fidl"\nimport model "gone.fidl"')
+    model = write_files(model_files)
+    project = Project([ model('client.fidl') ], workers=1, collect_diagnostics=True).load()
+
+    messages = [ (os.path.basename(diagnostic.file_name), diagnostic.message) for diagnostic in project.diagnostics ]
+    assert ('service.fidl', "Could not resolve type name Nope") in messages
+    assert ('gone.fidl', "Could not read file: No such file or directory") in messages
+
+    # Resolution continues past the error
+    point = project.namespace.resolve_type('org.example.Types.Point3')
+    assert point.info['_resolved_extends'] is project.namespace.resolve_type('org.example.Types.Point').info
+
+
+def test_reload_replaces_resolution_diagnostics(model_files, write_files):
+    model_files['service.fidl'] = model_files['service.fidl'].replace("Point p", "Nope p")
+    model = write_files(model_files)
+    project = Project([ model('client.fidl') ], workers=1, collect_diagnostics=True).load()
+    assert len(project.diagnostics) == 1
+
+    project.reload(os.path.normpath(model('types.fidl')))
+    assert [ diagnostic.message for diagnostic in project.diagnostics ] == [ "Could not resolve type name Nope" ]
+
+
+def run_tool(*args):
+    return subprocess.run([ sys.executable, os.path.join(root, 'fidl_tool.py'), *args ], capture_output=True, text=True)
+
+
+def test_keep_going_prints_all_errors(tmp_path):
+    broken = tmp_path / 'broken.fidl'
+    broken.write_text(broken_model)
+    res = run_tool('-k', str(broken))
+
+    assert res.returncode == 1
+    assert [ line.split(': ', 1)[0] for line in res.stderr.splitlines() ] == \
+        [ f"{broken}:3:22", f"{broken}:4:14", f"{broken}:5:22" ]
+
+
+def test_keep_going_batch_records(tmp_path, testcase):
+    broken = tmp_path / 'broken.fidl'
+    broken.write_text(broken_model)
+    res = run_tool('-k', '-j', '1', str(broken), testcase('core_tests', '01-Minimal.fidl'))
+
+    assert res.returncode == 1
+    records = [ json.loads(line) for line in res.stdout.splitlines() ]
+    assert [ (diagnostic['line'], diagnostic['column']) for diagnostic in records[0]['diagnostics'] ] == \
+        [ (3, 22), (4, 14), (5, 22) ]
+    assert records[1]['diagnostics'] == []
@@ -0,0 +1,154 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import io
+import json
+
+import pytest
+
+from fidl_parser import emitter, parse_tree
+
+model = """package org.example
+typeCollection Types {
+  struct Point { Int32 x Int32 y }
+  struct Point3 extends Point { Int32 z }
+  enumeration Color { RED GREEN BLUE }
+}
+interface Service {
+  struct Move { Types.Point start Types.Point end }
+  method move { in { Move m Types.Color c } out { Types.Point3 at } }
+}
+"""
+
+
+def emit(emitter_class, result, **options):
+    out = io.StringIO()
+    emitter_class(out, **options).write(result)
+    return out.getvalue()
+
+
+def records(text):
+    return [ json.loads(line) for line in text.splitlines() ]
+
+
+@pytest.mark.parametrize('file_name', [ '20-AllPredefinedTypes.fidl', '30-StructInheritance.fidl',
+                                        '61-MethodComments.fidl', '75-InterfaceInheritingTypes.fidl' ])
+@pytest.mark.parametrize('indent', [ None, 2 ])
+def test_output_without_references_is_that_of_json_dumps(read_testcase, file_name, indent):
+    result = parse_tree.convert_fidl_text(read_testcase('core_tests', file_name))
+    expected = json.dumps(result, indent=indent, separators=(',', ':') if indent is None else (',', ': '))
+    assert emit(emitter.JsonEmitter, result, indent=indent, references=False) == expected
+
+
+def test_references_replace_named_types():
+    result = parse_tree.convert_fidl_text(model)
+    document = json.loads(emit(emitter.JsonEmitter, result, indent=2))
+
+    datatypes = { datatype['name']: datatype for datatype in document['types']['datatypes'] }
+    assert datatypes['Point3']['_resolved_extends'] == { '$ref': 'Types.Point' }
+    assert datatypes['Point']['members'][0]['_resolved_datatype'] == 'int32'
+
+    move = document['interfaces']['datatypes'][0]
+    assert [ member['_resolved_datatype'] for member in move['members'] ] == [ { '$ref': 'Types.Point' } ] * 2
+    method = document['interfaces']['methods'][0]
+    assert method['in']['members'][0]['_resolved_datatype'] == { '$ref': 'Service.Move' }
+    assert method['in']['members'][1]['_resolved_datatype'] == { '$ref': 'Types.Color' }
+    assert method['out']['members'][0]['_resolved_datatype'] == { '$ref': 'Types.Point3' }
+
+
+def test_references_leave_the_result_unchanged():
+    result = parse_tree.convert_fidl_text(model)
+    expected = json.dumps(result)
+    emit(emitter.JsonEmitter, result)
+    emit(emitter.RecordEmitter, result)
+    assert json.dumps(result) == expected
+
+
+def test_records_name_each_declaration():
+    result = parse_tree.convert_fidl_text(model)
+    res = records(emit(emitter.RecordEmitter, result))
+
+    assert [ (record['kind'], record['name']) for record in res ] == [
+        ('enumeration', 'Types.Color'), ('struct', 'Types.Point'), ('struct', 'Types.Point3'),
+        ('struct', 'Service.Move'), ('interface', 'Service'), ('package', 'org.example') ]
+    assert res[2]['declaration']['_resolved_extends'] == { '$ref': 'Types.Point' }
+    assert res[4]['declaration']['datatypes'] == [ { '$ref': 'Service.Move' } ]
+    assert res[5] == { 'kind': 'package', 'name': 'org.example' }
+
+
+def test_records_written_while_converting_are_those_written_after():
+    out = io.StringIO()
+    result = emitter.emit_fidl_text(model, out, 'jsonl')
+    assert records(out.getvalue()) == records(emit(emitter.RecordEmitter, result))
+
+
+@pytest.mark.parametrize('format', [ 'json', 'compact' ])
+def test_emit_fidl_text_formats(format):
+    out = io.StringIO()
+    result = emitter.emit_fidl_text(model, out, format)
+    assert out.getvalue() == emit(emitter.JsonEmitter, result, indent=2 if format == 'json' else None)
+
+
+def test_unknown_format():
+    with pytest.raises(Exception, match="Unknown output format xml"):
+        emitter.emit_fidl_text(model, io.StringIO(), 'xml')
+
+
+errors_model = """package org.example
+interface Service {
+  method open { in { UInt8 mode } error { DENIED BUSY } }
+  method close { error { DENIED BUSY } }
+  method reset { error { FAILED } }
+}
+"""
+
+
+@pytest.mark.parametrize('file_name', [ '20-AllPredefinedTypes.fidl', '30-StructInheritance.fidl',
+                                        '61-MethodComments.fidl', '75-InterfaceInheritingTypes.fidl' ])
+def test_symbol_table_round_trip(read_testcase, file_name):
+    result = parse_tree.convert_fidl_text(read_testcase('core_tests', file_name))
+    document = json.loads(emit(emitter.TableEmitter, result, indent=2))
+    assert emitter.load_table(document) == json.loads(json.dumps(result))
+
+
+def test_symbols_are_written_once_and_shared():
+    result = parse_tree.convert_fidl_text(model)
+    document = json.loads(emit(emitter.TableEmitter, result))
+    assert sorted(document['symbols']) == [ 'Service', 'Service.Move', 'Types.Color', 'Types.Point', 'Types.Point3' ]
+    assert document['interfaces'] == { '$ref': 'Service' }
+
+    loaded = emitter.load_table(document)
+    datatypes = { datatype['name']: datatype for datatype in loaded['types']['datatypes'] }
+    move = loaded['interfaces']['datatypes'][0]
+    assert move['members'][0]['_resolved_datatype'] is datatypes['Point']
+    assert datatypes['Point3']['_resolved_extends'] is datatypes['Point']
+
+
+def test_identical_anonymous_types_are_written_once():
+    result = parse_tree.convert_fidl_text(errors_model)
+    document = json.loads(emit(emitter.TableEmitter, result))
+    assert sorted(document['symbols']) == [ 'Service', '~0', '~1' ]
+
+    (open_method, close_method, reset_method) = document['symbols']['Service']['methods']
+    assert open_method['error'] == close_method['error'] == { '$ref': '~0' }
+    assert reset_method['error'] == { '$ref': '~1' }
+    assert emitter.load_table(document) == json.loads(json.dumps(result))
+
+    # Written inline when not interned
+    document = json.loads(emit(emitter.TableEmitter, result, anonymous=False))
+    assert sorted(document['symbols']) == [ 'Service' ]
+    assert document['symbols']['Service']['methods'][0]['error'] == json.loads(json.dumps(result['interfaces']['methods'][0]['error']))
+
+
+def test_unknown_symbol():
+    with pytest.raises(Exception, match="Unknown symbol Types.Nope"):
+        emitter.load_table({ 'symbols': {}, 'types': { '$ref': 'Types.Nope' } })
+
+
+def test_emit_fidl_text_table():
+    out = io.StringIO()
+    result = emitter.emit_fidl_text(errors_model, out, 'table')
+    assert out.getvalue() == emit(emitter.TableEmitter, result, indent=2)
@@ -0,0 +1,46 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import lark
+
+from fidl_parser import parse_tree
+
+
+def test_children_are_indexed_by_rule_and_token_type():
+    (a1, a2, b) = (lark.Tree('a', []), lark.Tree('a', []), lark.Tree('b', []))
+    (name, other_name) = (lark.Token('NAME', 'x'), lark.Token('NAME', 'y'))
+    (trees, tokens) = parse_tree.index_lark_tree(lark.Tree('node', [ a1, name, b, a2, other_name ]))
+
+    assert trees == { 'a': [ a1, a2 ], 'b': [ b ] }
+    assert tokens == { 'NAME': name }
+
+
+def test_maps_and_entries_are_compiled_once():
+    compiled = []
+
+    def helper(compiler, name):
+        compiled.append(name)
+        return lambda state, lark_tree, index: { name: len(index[0]) }
+
+    entry = (helper, 'shared')
+    first_map = [ entry, (helper, 'first') ]
+    second_map = [ entry ]
+
+    compiler = parse_tree.MapCompiler()
+    handlers = compiler.compile(first_map)
+    assert compiler.compile(first_map) is handlers
+    compiler.compile(second_map)
+    assert compiled == [ 'shared', 'first' ]
+
+    tree = lark.Tree('node', [ lark.Tree('a', []), lark.Tree('b', []) ])
+    assert parse_tree.process_lark_tree({}, tree, handlers) == { 'shared': 2, 'first': 2 }
+
+
+def test_wide_type_collection_keeps_member_order():
+    members = " ".join(f"UInt8 m{index}" for index in range(2000))
+    res = parse_tree.convert_fidl_text(f"package p\ntypeCollection T {{ struct S {{ {members} }} }}\n")
+    struct = res['types']['datatypes'][0]
+    assert [ member['name'] for member in struct['members'] ] == [ f"m{index}" for index in range(2000) ]
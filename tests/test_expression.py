@@ -0,0 +1,78 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import os
+
+import pytest
+
+from fidl_parser import parse_tree
+from fidl_parser.project import Project
+
+
+def constants(text):
+    res = parse_tree.convert_fidl_text(f"package p\ntypeCollection T {{\n{text}\n}}\n")
+    return { datatype['name']: datatype.get('value') for datatype in res['types']['datatypes'] }
+
+
+def test_testcase_expressions(read_testcase):
+    res = parse_tree.convert_fidl_text(read_testcase('core_tests', 'evaluation', 'IntegerExpressions.fidl'))
+    values = { datatype['name']: datatype.get('value') for datatype in res['types']['datatypes'] }
+
+    assert (values['b04'], values['b05'], values['b28']) == (False, True, True)
+    assert (values['i06'], values['i08'], values['i09']) == (2, 2, 20)
+    assert (values['i11'], values['i12'], values['i13']) == (717, 156, 0)
+    assert (values['h03'], values['y03'], values['h11']) == (10000, 160968, 2000000000001)
+    assert (values['r20'], values['r21'], values['r25']) == (6, 8, "foo")
+    assert (values['r30'], values['r31'], values['r40'], values['r41']) == (True, 7, True, 7)
+
+
+def test_enumerators_use_constants(read_testcase):
+    res = parse_tree.convert_fidl_text(read_testcase('core_tests', 'evaluation', 'ConstantsForEnums.fidl'))
+    enum = next(datatype for datatype in res['types']['datatypes'] if datatype['name'] == 'Enum1')
+    assert [ member['value'] for member in enum['members'] ] == [ None, 1, 3, 77, 4, 77, 30, 12 ]
+
+
+def test_c_precedence_and_division():
+    values = constants("""
+  const Int32 a = 2 + 3 * 4 - 6 / 2
+  const Int32 b = (2 + 3) * 4
+  const Int32 c = -7 / 2
+  const Int32 d = -7 % 2
+  const Boolean e = 1 + 1 == 2 && 3 < 2 || true
+""")
+    assert values == { 'a': 11, 'b': 20, 'c': -3, 'd': -1, 'e': True }
+
+
+def test_constants_are_evaluated_in_any_order():
+    values = constants("""
+  const UInt32 a = b * 2
+  const UInt32 b = c + 1
+  const UInt32 c = 4
+""")
+    assert values == { 'a': 10, 'b': 5, 'c': 4 }
+
+
+@pytest.mark.parametrize('text, error', [
+    ("const UInt32 a = b\nconst UInt32 b = a", "Cyclic reference in constant expression"),
+    ("const UInt32 a = a + 1", "Cyclic reference in constant expression"),
+    ("const UInt8 a = 255 + 1", "Value 256 of constant a is out of range [0, 255]"),
+    ("const UInt32 a = 1 / (2 - 2)", "Division by zero in constant expression"),
+    ("const UInt32 a = nope", "Could not resolve constant nope"),
+])
+def test_errors(text, error):
+    with pytest.raises(Exception, match=error.replace('[', r'\[').replace(']', r'\]')):
+        constants(text)
+
+
+def test_constants_of_imported_files(write_files):
+    path = write_files({
+        'base.fidl': "package org.base\ntypeCollection Limits {\n  const UInt32 max = 10\n}\n",
+        'use.fidl': ('package org.use\nimport org.base.Limits.* from "base.fidl"\n'
+                     'typeCollection Sizes {\n  const UInt32 twice = max * 2\n}\n'),
+    })
+    project = Project([ path('use.fidl') ], workers=1).load()
+    sizes = project.files[os.path.normpath(path('use.fidl'))].result['types']
+    assert sizes['datatypes'][0]['value'] == 20
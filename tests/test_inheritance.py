@@ -0,0 +1,107 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import pytest
+
+from fidl_parser import parse_tree
+from fidl_parser.diagnostics import Diagnostics
+from fidl_parser.project import Project
+from fidl_parser.type_manager import NameSpace, Type
+
+model = """package org.example
+typeCollection Types {
+  struct A { UInt8 a }
+  struct B extends A { UInt8 b }
+  struct C extends B { UInt8 c }
+}
+interface Base {
+  method get { out { UInt8 v } }
+  broadcast changed { }
+}
+interface Derived extends Base {
+  method set { in { UInt8 v } }
+}
+"""
+
+
+@pytest.fixture
+def project(write_files):
+    path = write_files({ 'model.fidl': model })
+    return Project([ path('model.fidl') ], workers=1).load()
+
+
+def names(elements):
+    return [ element['name'] for element in elements ]
+
+
+def test_members_are_flattened_base_first(project):
+    c = project.namespace.resolve_type('org.example.Types.C')
+    assert names(c.flattened()) == [ 'a', 'b', 'c' ]
+    assert c.lookup('a')['name'] == 'a'
+    assert c.lookup('d') is None
+    assert c.base is project.namespace.resolve_type('org.example.Types.B')
+    assert c.info['_resolved_extends'] is c.base.info
+
+
+def test_interfaces_are_flattened(project):
+    derived = project.namespace.resolve_type('org.example.Derived')
+    assert names(derived.flattened('methods')) == [ 'get', 'set' ]
+    assert names(derived.flattened('events')) == [ 'changed' ]
+    assert derived.lookup('get', 'methods') is derived.base.lookup('get', 'methods')
+
+
+def test_flattened_lists_are_computed_once_and_dropped_on_rebase(project):
+    (a, b, c) = [ project.namespace.resolve_type(f'org.example.Types.{name}') for name in 'ABC' ]
+    assert c.flattened() is c.flattened()
+    assert b.flattened() == c.flattened()[:2]
+
+    b.base = None
+    assert names(c.flattened()) == [ 'b', 'c' ]
+    assert c.lookup('a') is None
+
+
+def test_cyclic_inheritance_is_an_error():
+    types = NameSpace('root').add_namespace(NameSpace('T'))
+    (a, b) = (Type('A', {}), Type('B', {}))
+    types.add_type(a)
+    types.add_type(b)
+    b.base = a
+    with pytest.raises(Exception, match="Cyclic inheritance of T.A"):
+        a.base = b
+
+    text = "package p\ntypeCollection T {\n  struct A extends B { UInt8 a }\n  struct B extends A { UInt8 b }\n}\n"
+    with pytest.raises(Exception, match="Cyclic inheritance"):
+        parse_tree.convert_fidl_text(text)
+
+
+def test_base_of_another_kind_is_an_error():
+    text = "package p\ntypeCollection T {\n  enumeration E { X }\n  struct S extends E { UInt8 s }\n}\n"
+    with pytest.raises(Exception, match="T.S cannot extend T.E"):
+        parse_tree.convert_fidl_text(text)
+
+
+def test_interface_uses_types_of_its_base(read_testcase):
+    res = parse_tree.convert_fidl_text(read_testcase('core_tests', '75-InterfaceInheritingTypes.fidl'))
+    (base, derived) = res['interfaces']
+    typedef = next(datatype for datatype in derived['datatypes'] if datatype['name'] == 'MyStruct1')
+    struct = next(datatype for datatype in base['datatypes'] if datatype['name'] == 'MyStruct')
+    assert typedef['_resolved_datatype'] is struct
+
+
+@pytest.mark.parametrize('keep_going', [ False, True ])
+def test_declarations_are_a_dictionary_or_a_list(keep_going):
+    # One declaration of a kind is a dictionary, several are a list.
+    # declarations() returns a list either way.
+    options = { 'diagnostics': Diagnostics('model.fidl') } if keep_going else {}
+    res = parse_tree.convert_fidl_text(model, **options)
+    assert res['types']['name'] == 'Types'
+    assert names(res['interfaces']) == [ 'Base', 'Derived' ]
+    assert parse_tree.declarations(res, 'types') == [ res['types'] ]
+    assert parse_tree.declarations(res, 'interfaces') is res['interfaces']
+
+    res = parse_tree.convert_fidl_text("package p\ninterface I { }\n", **options)
+    assert parse_tree.declarations(res, 'interfaces') == [ res['interfaces'] ]
+    assert parse_tree.declarations(res, 'types') == []
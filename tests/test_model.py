@@ -0,0 +1,51 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+
+import pytest
+
+from fidl_parser import model, parse_tree
+from fidl_parser.project import Project
+
+
+@pytest.mark.parametrize('file_name', [ '01-Minimal.fidl', '30-StructInheritance.fidl', '61-MethodComments.fidl' ])
+def test_to_dict_returns_the_converted_result(read_testcase, file_name):
+    res = parse_tree.convert_fidl_text(read_testcase('core_tests', file_name))
+    assert json.dumps(model.build_model(res).to_dict()) == json.dumps(res)
+
+
+def test_elements_have_slots(read_testcase):
+    package = model.build_model(parse_tree.convert_fidl_text(read_testcase('core_tests', '30-StructInheritance.fidl')))
+    struct = package.type_collections[0].datatypes[0]
+    assert isinstance(struct, model.Struct)
+    assert not hasattr(struct, '__dict__')
+
+
+def test_references_are_linked_across_files(model_files, write_files):
+    path = write_files(model_files)
+    packages = model.build_project_model(Project([ path('client.fidl') ], workers=1).load())
+
+    types = packages[os.path.normpath(path('types.fidl'))].type_collections[0]
+    (point, point3, color) = [ next(datatype for datatype in types.datatypes if datatype.name == name)
+                               for name in ('Point', 'Point3', 'Color') ]
+    move = packages[os.path.normpath(path('service.fidl'))].interfaces[0].methods[0]
+    assert [ arg.type for arg in move.in_args ] == [ point, point3 ]
+    assert move.out_args[0].type is color
+    assert point3.base is point
+
+
+def test_files_that_failed_are_left_out(model_files, write_files):
+    path = write_files(dict(model_files, **{ 'types.fidl': "package org.example\ntypeCollection {" }))
+    project = Project([ path('client.fidl') ], workers=1, collect_diagnostics=True).load()
+    types = os.path.normpath(path('types.fidl'))
+    assert project.files[types] is None
+
+    packages = model.build_project_model(project)
+    assert types not in packages
+    assert os.path.normpath(path('service.fidl')) in packages
+    assert any(diagnostic.file_name == types for diagnostic in project.diagnostics)
@@ -0,0 +1,69 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import os
+
+import lark
+
+from fidl_parser import get_parser, parser
+
+
+def test_tables_are_stored_and_loaded(tmp_path, monkeypatch, read_testcase):
+    monkeypatch.setenv('FIDL_PARSER_CACHE', str(tmp_path))
+    assert not parser.tables_cached()
+
+    text = read_testcase('core_tests', '60-Method.fidl')
+    built = parser.build_parser()
+    cache_fn = parser.cache_file(parser.FIDL_GRAMMAR, parser.grammar_text(), parser.parser_options())
+    assert os.path.dirname(cache_fn) == str(tmp_path)
+    assert parser.tables_cached()
+
+    loaded = parser.build_parser()
+    assert loaded.parse(text) == built.parse(text)
+
+
+def test_empty_directory_disables_the_cache(monkeypatch):
+    monkeypatch.setenv('FIDL_PARSER_CACHE', '')
+    assert parser.cache_file(parser.FIDL_GRAMMAR, parser.grammar_text(), parser.parser_options()) is None
+    assert parser.tables_cached()
+
+
+def test_cache_key_covers_grammar_and_options():
+    grammar = parser.grammar_text()
+    key = parser.cache_key(grammar, parser.parser_options())
+    assert parser.cache_key(grammar, parser.parser_options()) == key
+    assert parser.cache_key(grammar + "\n", parser.parser_options()) != key
+    assert parser.cache_key(grammar, parser.parser_options(debug=True)) != key
+
+
+def test_parser_is_built_once():
+    assert get_parser() is get_parser()
+    assert get_parser(debug=True) is not get_parser()
+
+
+def test_transformer_parsers_are_kept_per_transformer(monkeypatch):
+    monkeypatch.setattr(parser, '_transformer_parsers', {})
+    transformers = [ lark.Transformer() for _ in range(parser.max_transformer_parsers + 1) ]
+    first = get_parser(transformer=transformers[0])
+    assert get_parser(transformer=transformers[0]) is first
+    assert get_parser(transformer=transformers[1]) is not first
+
+    # Only the parsers of the last transformers are kept
+    for transformer in transformers[2:]:
+        get_parser(transformer=transformer)
+
+    assert len(parser._transformer_parsers) == parser.max_transformer_parsers
+    assert get_parser(transformer=transformers[0]) is not first
+
+
+def test_tests_do_not_use_the_home_cache():
+    assert parser.cache_dir() != os.path.join(os.path.expanduser('~'), '.cache', 'fidl_parser')
+
+
+def test_parse_text_numbers_lines_from_line():
+    tree = parser.parse_text(get_parser(), "package p\ninterface I { }\n", line=10)
+    token = next(tree.scan_values(lambda token: token == 'I'))
+    assert token.line == 11
@@ -0,0 +1,142 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+from fidl_parser import comment, diagnostics, get_parser, parse_tree, profile, stream
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+core_tests = [ '20-AllPredefinedTypes.fidl', '30-StructInheritance.fidl', '61-MethodComments.fidl',
+               '75-InterfaceInheritingTypes.fidl', '80-InterfaceManagingOthers.fidl' ]
+
+
+def convert(func):
+    # JSON text of the result, or the error
+    try:
+        return json.dumps(func())
+    except Exception as err:
+        return f"{type(err).__name__}: {err}"
+
+
+def clocked(profiler, times):
+    # Make the profiler read (wall, cpu, memory) from times
+    ticks = iter(times)
+    profiler._now = lambda: next(ticks)
+    return profiler
+
+
+def test_nested_phases_are_only_counted_once():
+    profiler = clocked(profile.Profiler(), [ (0.0, 0.0, 0), (1.0, 0.5, 0), (3.0, 1.5, 0), (4.0, 2.0, 0),
+                                              (5.0, 2.5, 0), (6.0, 3.0, 0) ])
+    with profiler.file('a.fidl'):
+        with profiler.phase('parse'):
+            profiler.call('convert', lambda: None)
+            profiler.count('nodes', 3)
+
+        profiler.call('convert', profiler.count, 'nodes')
+
+    record = profiler.files['a.fidl']
+    assert record['phases'] == { 'parse': [ 1, 2.0, 1.0, 0 ], 'convert': [ 2, 3.0, 1.5, 0 ] }
+    assert record['counters'] == { 'nodes': 4 }
+    assert profiler.totals()['phases'] == record['phases']
+
+
+@pytest.mark.parametrize('file_name', core_tests)
+def test_results_are_the_same_with_a_profiler(read_testcase, testcase, file_name):
+    text = read_testcase('core_tests', file_name)
+    profiler = profile.Profiler()
+
+    def with_tree(profiler=None):
+        (tree, comments) = comment.parse(get_parser(), text, profiler)
+        return parse_tree.convert_fidl_tree(tree, comments=comments, profiler=profiler)
+
+    def collecting(profiler=None):
+        file_diagnostics = diagnostics.Diagnostics(file_name)
+        res = parse_tree.convert_fidl_text(text, diagnostics=file_diagnostics, profiler=profiler)
+        return (res, [ str(diagnostic) for diagnostic in file_diagnostics.sorted() ])
+
+    with profiler.file(file_name):
+        assert convert(lambda: parse_tree.convert_fidl_text(text, profiler=profiler)) == \
+            convert(lambda: parse_tree.convert_fidl_text(text))
+        assert convert(lambda: with_tree(profiler)) == convert(with_tree)
+        assert convert(lambda: collecting(profiler)) == convert(collecting)
+        assert convert(lambda: stream.convert_fidl_stream(testcase('core_tests', file_name), chunk_size=64,
+                                                          profiler=profiler)) == \
+            convert(lambda: stream.convert_fidl_stream(testcase('core_tests', file_name), chunk_size=64))
+
+    assert profiler._stack == []
+
+
+def test_tree_less_conversion_is_split_into_phases(read_testcase):
+    profiler = profile.Profiler()
+    with profiler.file('30-StructInheritance.fidl'):
+        parse_tree.convert_fidl_text(read_testcase('core_tests', '30-StructInheritance.fidl'), profiler=profiler)
+
+    record = profiler.files['30-StructInheritance.fidl']
+    assert profile.ordered(record['phases'], profile.PHASES) == [ 'lex', 'parse', 'convert', 'resolve' ]
+    assert record['phases']['parse'][0] == 1
+    assert record['counters']['tokens'] == 22
+    assert record['counters']['nodes'] > 0
+
+
+def test_syntax_error_leaves_no_phase_open():
+    profiler = profile.Profiler()
+    with profiler.file('broken.fidl'):
+        with pytest.raises(Exception):
+            parse_tree.convert_fidl_text("package p\ntypeCollection T { struct {", profiler=profiler)
+
+    assert profiler._stack == []
+    assert profiler.files['broken.fidl']['phases']['parse'][0] == 1
+
+
+def test_memory_is_traced_per_file(read_testcase):
+    profiler = profile.Profiler(trace_memory=True)
+    with profiler.file('30-StructInheritance.fidl'):
+        parse_tree.convert_fidl_text(read_testcase('core_tests', '30-StructInheritance.fidl'), profiler=profiler)
+
+    assert not tracemalloc.is_tracing()
+    assert profiler.files['30-StructInheritance.fidl']['peak_memory'] > 0
+    assert 'allocated_bytes' in profiler.to_dict()['total']['phases']['convert']
+
+
+def test_report_and_dict(read_testcase):
+    profiler = profile.Profiler()
+    for file_name in ('30-StructInheritance.fidl', '61-MethodComments.fidl'):
+        with profiler.file(file_name):
+            parse_tree.convert_fidl_text(read_testcase('core_tests', file_name), profiler=profiler)
+
+    res = json.loads(json.dumps(profiler.to_dict()))
+    assert [ record['file'] for record in res['files'] ] == [ '30-StructInheritance.fidl', '61-MethodComments.fidl' ]
+    assert list(res['total']['phases']) == [ 'lex', 'parse', 'convert', 'resolve' ]
+    assert res['total']['counters']['tokens'] == sum(record['counters']['tokens'] for record in res['files'])
+    assert 'peak_memory_bytes' not in res['total']
+
+    lines = profiler.report().splitlines()
+    assert lines[0].split() == [ 'phase', 'calls', 'wall', 'ms', 'cpu', 'ms', 'wall', '%' ]
+    assert [ line.split()[0] for line in lines[1:5] ] == [ 'lex', 'parse', 'convert', 'resolve' ]
+    assert [ line.split()[-1] for line in lines[-3:] ] == [ '30-StructInheritance.fidl', '61-MethodComments.fidl', 'total' ]
+
+
+def test_profiled_without_a_profiler():
+    assert profile.profiled(None, 'parse', lambda a, b=0: a + b, 1, b=2) == 3
+
+
+def test_tool_prints_the_profile_to_stderr(testcase):
+    file_name = testcase('core_tests', '30-StructInheritance.fidl')
+    (plain, profiled) = [ subprocess.run([ sys.executable, os.path.join(root, 'fidl_tool.py'), '-n', *args, file_name ],
+                                         capture_output=True, text=True, check=True)
+                          for args in ([], [ '--profile-json' ]) ]
+
+    assert profiled.stdout == plain.stdout
+    res = json.loads(profiled.stderr)
+    assert [ record['file'] for record in res['files'] ] == [ file_name ]
+    assert 'encode' in res['total']['phases']
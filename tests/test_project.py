@@ -0,0 +1,82 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+
+import pytest
+
+from fidl_parser import cache
+from fidl_parser.project import Project
+
+
+def results(project):
+    return { os.path.basename(file_name): json.dumps(fidl_file.result, sort_keys=True, default=str)
+             for (file_name, fidl_file) in project.files.items() }
+
+
+def test_imports_are_followed(model):
+    project = Project([ model('client.fidl') ], workers=1).load()
+    assert [ os.path.basename(file_name) for file_name in project.files ] == \
+        [ 'client.fidl', 'service.fidl', 'types.fidl' ]
+    assert project.files[os.path.normpath(model('client.fidl'))].package == 'org.client'
+
+
+def test_types_are_resolved_across_files(model):
+    project = Project([ model('client.fidl') ], workers=1).load()
+    point = project.namespace.resolve_type('org.example.Types.Point')
+    method = project.files[os.path.normpath(model('service.fidl'))].result['interfaces']['methods'][0]
+    assert method['in']['members'][0]['_resolved_datatype'] is point.info
+    assert project.namespace.resolve_type('org.example.Service') is not None
+    assert project.namespace.resolve_type('org.client.Client') is not None
+
+
+def test_parallel_load_matches_serial_load(model):
+    serial = Project([ model('client.fidl') ], workers=1).load()
+    parallel = Project([ model('client.fidl') ], workers=2).load()
+    assert results(parallel) == results(serial)
+
+
+def test_cached_load_matches_load(model, tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path / 'cache'))
+    first = Project([ model('client.fidl') ], workers=1, cache=parse_cache).load()
+    second = Project([ model('client.fidl') ], workers=1, cache=parse_cache).load()
+    assert (parse_cache.misses, parse_cache.hits) == (3, 3)
+    assert results(second) == results(first) == results(Project([ model('client.fidl') ], workers=1).load())
+
+
+def test_missing_import_raises(model_files, write_files):
+    path = write_files(dict(model_files, **{ 'client.fidl': 'package org.client\nimport model "nope.fidl"\n' }))
+    with pytest.raises(OSError):
+        Project([ path('client.fidl') ], workers=1).load()
+
+
+def test_files_with_several_declarations(model_files, write_files):
+    model_files['types.fidl'] = model_files['types.fidl'] + """typeCollection Shapes {
+  struct Line { Types.Point start Types.Point3 end }
+}
+"""
+    model_files['service.fidl'] = model_files['service.fidl'].replace(
+        '"types.fidl"', '"types.fidl"\nimport org.example.Shapes.* from "types.fidl"') + """interface Painter {
+  method draw { in { Line l Color c } }
+}
+"""
+    model = write_files(model_files)
+    project = Project([ model('client.fidl') ], workers=1).load()
+
+    types = project.files[os.path.normpath(model('types.fidl'))].result['types']
+    assert [ type_collection['name'] for type_collection in types ] == [ 'Types', 'Shapes' ]
+    interfaces = project.files[os.path.normpath(model('service.fidl'))].result['interfaces']
+    assert [ interface['name'] for interface in interfaces ] == [ 'Service', 'Painter' ]
+
+    # Types of one declaration are resolved in another, and across files
+    line = project.namespace.resolve_type('org.example.Shapes.Line')
+    assert line.info['members'][0]['_resolved_datatype'] is project.namespace.resolve_type('org.example.Types.Point').info
+    draw = interfaces[1]['methods'][0]
+    assert [ member['_resolved_datatype'] for member in draw['in']['members'] ] == \
+        [ line.info, project.namespace.resolve_type('org.example.Types.Color').info ]
+
+    assert results(Project([ model('client.fidl') ], workers=2).load()) == results(project)
@@ -0,0 +1,158 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+import socket
+import threading
+
+from fidl_parser import watcher
+from fidl_parser.daemon import Daemon
+from fidl_parser.project import FidlFile, Project
+
+
+def load(model):
+    return Project([ model('client.fidl') ], workers=1).load()
+
+
+def rewrite(file_name, text):
+    # Replace the content of file_name with a new modification time
+    with open(file_name, 'w') as f:
+        f.write(text)
+
+    stat = os.stat(file_name)
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
+def point_fields(project):
+    return [ member['name'] for member in project.namespace.resolve_type('org.example.Types.Point').info['members'] ]
+
+
+def test_errors_and_owners_are_kept_by_the_project(model):
+    project = load(model)
+    point = project.namespace.resolve_type('org.example.Types.Point')
+    assert project.owner(point) == os.path.normpath(model('types.fidl'))
+    assert project.errors == {}
+    assert not hasattr(FidlFile, 'errors')
+    assert not hasattr(FidlFile, 'owner')
+
+
+def test_reload_resolves_the_file_and_its_dependents(model):
+    project = load(model)
+    (types, service) = (os.path.normpath(model('types.fidl')), os.path.normpath(model('service.fidl')))
+    with open(types) as f:
+        text = f.read()
+
+    rewrite(types, text.replace("Int32 x Int32 y", "Int32 x Int32 y Int32 w"))
+    assert project.reload(types) == [ types, service ]
+    assert point_fields(project) == [ 'x', 'y', 'w' ]
+
+    # The argument of the method refers to the new type
+    method = project.files[service].result['interfaces']['methods'][0]
+    assert method['in']['members'][0]['_resolved_datatype'] is project.namespace.resolve_type('org.example.Types.Point').info
+
+
+def test_reload_keeps_a_file_that_fails_to_parse(model):
+    project = load(model)
+    types = os.path.normpath(model('types.fidl'))
+    with open(types) as f:
+        text = f.read()
+
+    rewrite(types, text + "struct {")
+    assert project.reload(types) == []
+    assert types in project.errors
+    assert point_fields(project) == [ 'x', 'y' ]
+
+    rewrite(types, text)
+    assert types in project.reload(types)
+    assert project.errors == {}
+
+
+def test_reload_of_a_removed_file_reports_its_dependents(model):
+    project = load(model)
+    (types, service) = (os.path.normpath(model('types.fidl')), os.path.normpath(model('service.fidl')))
+    os.remove(types)
+
+    project.reload(types)
+    assert project.errors[types] == f"{types}: No such file"
+    assert project.namespace.resolve_type('org.example.Types.Point') is None
+    assert service in project.errors
+
+
+def test_polling_watcher_reports_changes(model):
+    file_watcher = watcher.PollingWatcher()
+    file_watcher.watch([ model('types.fidl'), model('missing.fidl') ])
+    assert file_watcher.changes() == set()
+
+    rewrite(model('types.fidl'), "package changed")
+    assert file_watcher.changes() == { os.path.abspath(model('types.fidl')) }
+    assert file_watcher.changes() == set()
+
+    rewrite(model('missing.fidl'), "package created")
+    assert file_watcher.changes() == { os.path.abspath(model('missing.fidl')) }
+
+
+def test_daemon_queries(model):
+    daemon = Daemon(load(model), watcher.PollingWatcher(), log=lambda message: None)
+    types = os.path.normpath(model('types.fidl'))
+
+    def query(**query):
+        return json.loads(daemon.handle(json.dumps(query)))
+
+    response = query(query='type', name='org.example.Types.Point3', id=7)
+    assert response['ok'] and response['id'] == 7
+    assert response['result']['file'] == types
+
+    assert query(query='dependents', file=types)['result'] == [ os.path.normpath(model('service.fidl')) ]
+    assert [ use['name'] for use in query(query='users', type='org.example.Types.Color')['result'] ] == \
+        [ 'org.example.Service.move' ]
+    assert query(query='reload', file=types)['result']['resolved'][0] == types
+    assert query(query='status')['result']['reloads'] == 1
+
+    assert query(query='type', name='org.example.Nope') == { 'ok': False, 'error': "Unknown type: org.example.Nope" }
+    assert query(query='file')['error'] == "Missing query argument: 'file'"
+    assert json.loads(daemon.handle("[]"))['ok'] is False
+
+
+def test_slow_socket_client_does_not_stall_the_daemon(model, tmp_path):
+    daemon = Daemon(load(model), watcher.PollingWatcher(), log=lambda message: None)
+    path = str(tmp_path / 'daemon.sock')
+    thread = threading.Thread(target=daemon.serve_socket, args=(path,), daemon=True)
+    thread.start()
+    while not os.path.exists(path):
+        thread.join(0.01)
+
+    def connect():
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(10)
+        client.connect(path)
+        return client
+
+    def read_lines(client, count):
+        data = b''
+        while data.count(b'\n') < count:
+            data += client.recv(65536)
+
+        return [ json.loads(line) for line in data.splitlines() ]
+
+    # More responses than the socket buffers hold, which are not read
+    queries = 1000
+    query = json.dumps({ 'query': 'file', 'file': model('service.fidl') }).encode() + b'\n'
+    slow = connect()
+    slow.sendall(query * queries)
+
+    fast = connect()
+    fast.sendall(b'{ "query": "status", "id": 1 }\n')
+    assert read_lines(fast, 1)[0]['result']['files'] == 3
+
+    responses = read_lines(slow, queries)
+    assert len(responses) == queries and all(response['ok'] for response in responses)
+
+    fast.sendall(b'{ "query": "shutdown" }\n')
+    thread.join(10)
+    assert not thread.is_alive()
+    slow.close()
+    fast.close()
@@ -0,0 +1,84 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Startup time of fidl_tool.py
+#
+#  Short runs are dominated by importing lark, which fidl_tool.py
+#  cannot avoid, so lark is imported before the time is measured.
+#  Imports are timed by python -X importtime, and a run by the process
+#  itself, leaving out the startup of the interpreter. Each time is the
+#  best of several runs, after a run that fills the parser cache.
+#
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+minimal_file = os.path.join(root, 'testcases', 'core_tests', '01-Minimal.fidl')
+runs = 5
+
+# ms on top of importing lark
+import_budget = 50
+run_budget = 200
+
+# Modules that fidl_tool.py imports only in the modes using them
+deferred_modules = ('concurrent.futures', 'multiprocessing', 'mmap', 'fidl_parser.emitter',
+                    'fidl_parser.deployment', 'fidl_parser.stream')
+
+
+# Runs fidl_tool.py as the main module, and prints the time it took
+timed_run = """
+import runpy, sys, time, lark
+sys.argv = [ 'fidl_tool.py', *sys.argv[1:] ]
+start = time.perf_counter()
+try:
+    runpy.run_path('fidl_tool.py', run_name='__main__')
+finally:
+    print((time.perf_counter() - start) * 1000, file=sys.stderr)
+"""
+
+
+def best_time(args, measured):
+    # Best time in ms of runs of python with args, measured(stderr)
+    # returning the time of a run
+    res = []
+    for _ in range(runs):
+        run = subprocess.run([ sys.executable, *args ], cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             text=True, check=True)
+        res.append(measured(run.stderr))
+
+    return min(res)
+
+
+def import_time(stderr):
+    # Cumulative import time of fidl_tool in ms, from -X importtime
+    for line in stderr.splitlines():
+        if line.split('|')[-1].strip() == 'fidl_tool':
+            return int(line.split('|')[1]) / 1000
+
+    raise Exception("No import time for fidl_tool")
+
+
+@pytest.fixture(scope='module', autouse=True)
+def parser_cache():
+    subprocess.run([ sys.executable, 'fidl_tool.py', '-n', minimal_file ], cwd=root, stdout=subprocess.DEVNULL, check=True)
+
+
+def test_deferred_modules_are_not_imported():
+    res = subprocess.run([ sys.executable, '-c', 'import sys, json, fidl_tool; print(json.dumps(list(sys.modules)))' ],
+                         cwd=root, capture_output=True, text=True, check=True)
+    assert [ name for name in deferred_modules if name in json.loads(res.stdout) ] == []
+
+
+def test_import_time():
+    assert best_time([ '-X', 'importtime', '-c', 'import lark, fidl_tool' ], import_time) < import_budget
+
+
+def test_run_time():
+    assert best_time([ '-c', timed_run, '-n', minimal_file ], float) < run_budget
@@ -0,0 +1,123 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from fidl_parser import diagnostics, parse_tree, stream
+from fidl_parser.usage import UsageIndex
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+core_tests = [ '11-GlobalStruct.fidl', '30-StructInheritance.fidl', '61-MethodComments.fidl',
+               '75-InterfaceInheritingTypes.fidl', '80-InterfaceManagingOthers.fidl' ]
+
+# Braces in comments and strings do not end a declaration
+braces_model = b"""package p
+// } {
+typeCollection A { struct S { UInt8 a } }
+/* } */
+interface I { <** { **> attribute UInt8 b }
+typeCollection C { const String s = "}" }
+"""
+
+
+def convert(func, *args, **options):
+    # JSON text of the result, or the error
+    try:
+        return json.dumps(func(*args, **options))
+    except Exception as err:
+        return f"{type(err).__name__}: {err}"
+
+
+@pytest.mark.parametrize('file_name', core_tests)
+@pytest.mark.parametrize('chunk_size', [ 1, stream.default_chunk_size ])
+def test_stream_matches_text_conversion(testcase, read_testcase, file_name, chunk_size):
+    expected = convert(parse_tree.convert_fidl_text, read_testcase('core_tests', file_name))
+    assert convert(stream.convert_fidl_stream, testcase('core_tests', file_name), chunk_size=chunk_size) == expected
+
+
+@pytest.mark.parametrize('file_name', [ '30-StructInheritance.fidl', '80-InterfaceManagingOthers.fidl' ])
+def test_parallel_chunks_match_text_conversion(testcase, read_testcase, file_name):
+    expected = convert(parse_tree.convert_fidl_text, read_testcase('core_tests', file_name))
+    assert convert(stream.convert_fidl_stream, testcase('core_tests', file_name), chunk_size=1, jobs=2) == expected
+
+
+def test_chunks_end_after_top_level_declarations():
+    ends = list(stream.declaration_ends(braces_model))
+    assert [ braces_model[:end].rsplit(b'\n', 1)[-1] for end in ends ] == [
+        b"typeCollection A { struct S { UInt8 a } }", b"interface I { <** { **> attribute UInt8 b }",
+        b'typeCollection C { const String s = "}" }' ]
+
+    # Chunks hold declarations up to the chunk size, and the rest
+    assert [ chunk[:2] for chunk in stream.split_chunks(braces_model, 1) ] == \
+        [ (0, ends[0]), (ends[0], ends[1]), (ends[1], ends[2]), (ends[2], len(braces_model)) ]
+    assert stream.split_chunks(braces_model, ends[1]) == [ (0, ends[1], 1, 1), (ends[1], len(braces_model), 5, 44) ]
+    assert stream.split_chunks(braces_model) == [ (0, len(braces_model), 1, 1) ]
+
+
+def test_errors_are_numbered_as_in_the_file(tmp_path):
+    text = b"package p\ntypeCollection A { struct S { UInt8 a } }\ntypeCollection B {\n  struct U { UInt8 c ; }\n}\n"
+    (tmp_path / 'broken.fidl').write_bytes(text)
+    res = convert(stream.convert_fidl_stream, str(tmp_path / 'broken.fidl'), chunk_size=1)
+    assert "at line 4, column 22" in res
+    assert res == convert(parse_tree.convert_fidl_text, text.decode())
+
+
+def test_diagnostics_match_text_conversion(tmp_path):
+    text = "package p\ntypeCollection A { struct S { UInt8 a } }\ntypeCollection B {\n" \
+           "  struct T { Nope b }\n  struct U { UInt8 c ; }\n}\n"
+    (tmp_path / 'broken.fidl').write_text(text)
+    expected = diagnostics.Diagnostics('broken.fidl')
+    parse_tree.convert_fidl_text(text, diagnostics=expected)
+
+    for jobs in (None, 2):
+        file_diagnostics = diagnostics.Diagnostics('broken.fidl')
+        stream.convert_fidl_stream(str(tmp_path / 'broken.fidl'), diagnostics=file_diagnostics, chunk_size=1, jobs=jobs)
+        assert [ str(diagnostic) for diagnostic in file_diagnostics.sorted() ] == \
+            [ str(diagnostic) for diagnostic in expected.sorted() ]
+
+
+def test_carriage_returns_are_translated(tmp_path, read_testcase):
+    text = read_testcase('core_tests', '30-StructInheritance.fidl')
+    (tmp_path / 'crlf.fidl').write_bytes(text.replace('\n', '\r\n').encode())
+    assert stream.convert_fidl_stream(str(tmp_path / 'crlf.fidl'), chunk_size=1) == parse_tree.convert_fidl_text(text)
+
+
+def test_empty_file(tmp_path):
+    (tmp_path / 'empty.fidl').write_bytes(b'')
+    assert convert(stream.convert_fidl_stream, str(tmp_path / 'empty.fidl')) == convert(parse_tree.convert_fidl_text, '')
+
+
+def test_declared_and_usage_match_text_conversion(testcase, read_testcase):
+    text = read_testcase('core_tests', '75-InterfaceInheritingTypes.fidl')
+    (expected, declared) = ([], [])
+    (text_usage, stream_usage) = (UsageIndex(), UsageIndex())
+    parse_tree.convert_fidl_text(text, usage=text_usage, declared=lambda rule, res, ns: expected.append((rule, res)))
+    stream.convert_fidl_stream(testcase('core_tests', '75-InterfaceInheritingTypes.fidl'), usage=stream_usage,
+                               declared=lambda rule, res, ns: declared.append((rule, res)), chunk_size=1)
+
+    assert declared == expected
+    for type_name in ('BaseInterface', 'BaseInterface.MyStruct', 'BaseInterface.MyTypedef'):
+        assert [ use.to_dict() for use in stream_usage.users(type_name) ] == \
+            [ use.to_dict() for use in text_usage.users(type_name) ] != []
+
+
+def test_parallel_chunks_reject_tracing(testcase):
+    with pytest.raises(Exception, match="not supported when converting chunks in worker processes"):
+        stream.convert_fidl_stream(testcase('core_tests', '01-Minimal.fidl'), jobs=2, declared=lambda *args: None)
+
+
+def test_tool_stream_option_prints_the_same_model(testcase):
+    def run(*args):
+        return subprocess.run([ sys.executable, os.path.join(root, 'fidl_tool.py'), *args,
+                                testcase('core_tests', '80-InterfaceManagingOthers.fidl') ],
+                              capture_output=True, text=True, check=True).stdout
+
+    assert run('-S') == run('-n')
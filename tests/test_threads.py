@@ -0,0 +1,105 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import concurrent.futures
+import glob
+import json
+import os
+import threading
+
+import pytest
+
+from fidl_parser import get_parser, parse_tree, parser
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+threads = 8
+
+
+def core_test_texts():
+    texts = []
+    for file_name in sorted(glob.glob(os.path.join(root, 'testcases', 'core_tests', '*.fidl'))):
+        with open(file_name) as f:
+            texts.append(f.read())
+
+    return texts
+
+
+def convert(conversion, fidl_text):
+    # JSON text of the result, or the error
+    try:
+        return json.dumps(conversion(fidl_text))
+    except Exception as err:
+        return f"{type(err).__name__}: {err}"
+
+
+def tree_less(fidl_text):
+    return parse_tree.convert_fidl_text(fidl_text)
+
+
+def two_phase(fidl_text):
+    return parse_tree.convert_fidl_tree(get_parser().parse(fidl_text))
+
+
+def records(fidl_text):
+    declarations = []
+    parse_tree.convert_fidl_text(fidl_text, declared=lambda rule, res, ns: declarations.append((rule, res)))
+    return declarations
+
+
+@pytest.mark.parametrize('conversion', [ tree_less, two_phase, records ])
+def test_concurrent_conversions_match_serial_ones(conversion):
+    texts = core_test_texts() * 3
+    expected = [ convert(conversion, text) for text in texts ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        assert list(executor.map(lambda text: convert(conversion, text), texts)) == expected
+
+    assert parse_tree.current_conversion.get() is None
+
+
+def test_nested_conversion_restores_the_outer_one(read_testcase):
+    inner_text = read_testcase('core_tests', '11-GlobalStruct.fidl')
+    outer_text = read_testcase('core_tests', '30-StructInheritance.fidl')
+    inner = []
+
+    def declared(rule, res, ns):
+        inner.append(parse_tree.convert_fidl_text(inner_text))
+
+    assert parse_tree.convert_fidl_text(outer_text, declared=declared) == parse_tree.convert_fidl_text(outer_text)
+    assert inner and all(res == parse_tree.convert_fidl_text(inner_text) for res in inner)
+
+
+def test_syntax_error_beside_other_conversions(read_testcase):
+    text = read_testcase('core_tests', '30-StructInheritance.fidl')
+    expected = convert(tree_less, text)
+    texts = [ text, "package p\ntypeCollection T { struct {" ] * 20
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        res = list(executor.map(lambda text: convert(tree_less, text), texts))
+
+    assert res[0::2] == [ expected ] * 20
+    assert all(error.startswith("UnexpectedToken: Unexpected token Token('LBRACE'") for error in res[1::2])
+
+
+def test_parser_is_built_once(monkeypatch):
+    monkeypatch.setattr(parser, '_parsers', {})
+    built = []
+    build_parser = parser.build_parser
+
+    def counting_build_parser(*args, **options):
+        built.append(args)
+        return build_parser(*args, **options)
+
+    monkeypatch.setattr(parser, 'build_parser', counting_build_parser)
+    barrier = threading.Barrier(threads)
+
+    def get():
+        barrier.wait()
+        return parser.get_parser()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        parsers = list(executor.map(lambda _: get(), range(threads)))
+
+    assert len(built) == 1
+    assert all(lark_parser is parsers[0] for lark_parser in parsers)
@@ -0,0 +1,40 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+from fidl_parser import get_parser, parse_tree
+from fidl_parser.tracer import Tracer, TRACE_CALLS, TRACE_STATS
+
+
+def test_tracer_does_not_change_the_result(read_testcase):
+    tree = get_parser().parse(read_testcase('core_tests', '60-Method.fidl'))
+    assert parse_tree.convert_fidl_tree(tree, Tracer(TRACE_STATS)) == parse_tree.convert_fidl_tree(tree)
+
+
+def test_stats_count_helper_calls(read_testcase):
+    tracer = Tracer(TRACE_STATS, log=None)
+    parse_tree.convert_fidl_tree(get_parser().parse(read_testcase('core_tests', '60-Method.fidl')), tracer)
+
+    assert tracer.stats
+    for (name, rule), (count, elapsed) in tracer.stats.items():
+        assert count >= 1 and elapsed >= 0
+
+    assert tracer.report().splitlines()[0].split() == [ 'calls', 'total', 'ms', 'avg', 'us', 'helper(rule)' ]
+    tracer.reset()
+    assert tracer.stats == {}
+
+
+def test_calls_are_logged_by_depth():
+    lines = []
+    tracer = Tracer(TRACE_CALLS, log=lines.append)
+    parse_tree.convert_fidl_tree(get_parser().parse("package p\ninterface I { }\n"), tracer)
+
+    # Each call is logged when entered and when it returns, at the
+    # same depth. The namespace dump follows the calls.
+    calls = [ line for line in lines if line.endswith(')') ]
+    returns = [ line.split(' -> ')[0] for line in lines if ' -> ' in line ]
+    assert calls and sorted(calls) == sorted(returns)
+    assert calls[0] == calls[0].lstrip()
+    assert '  add_datatype(interface)' in calls
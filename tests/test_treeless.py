@@ -0,0 +1,46 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import glob
+import os
+
+import pytest
+
+from fidl_parser import comment, get_parser, parse_tree
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+testcases = sorted(glob.glob(os.path.join(root, 'testcases', '**', '*.fidl'), recursive=True))
+
+
+def convert(func):
+    # The result of func(), or the error it raised
+    try:
+        return func()
+    except Exception as err:
+        return f"{type(err).__name__}: {err}"
+
+
+@pytest.mark.parametrize('file_name', testcases, ids=os.path.basename)
+def test_tree_less_matches_tree_conversion(file_name):
+    with open(file_name) as f:
+        text = f.read()
+
+    def with_tree():
+        (tree, comments) = comment.parse(get_parser(), text)
+        return parse_tree.convert_fidl_tree(tree, comments=comments)
+
+    assert convert(lambda: parse_tree.convert_fidl_text(text)) == convert(with_tree)
+
+
+def test_syntax_error_after_converted_declarations():
+    # lark copies the value stack, holding the converted type
+    # collection, to list the expected tokens
+    text = "package p\ntypeCollection A { struct S { UInt8 a } }\ntypeCollection B {\n  struct U { UInt8 c ; }\n}\n"
+    with pytest.raises(Exception) as err:
+        parse_tree.convert_fidl_text(text)
+
+    assert "at line 4, column 22" in str(err.value)
+    assert "Expected one of" in str(err.value)
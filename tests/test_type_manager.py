@@ -0,0 +1,72 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import sys
+
+from fidl_parser.type_manager import NameSpace, Type
+
+
+def tree():
+    # root.a.b with type T in a and U in b
+    root = NameSpace('root')
+    b = root.add_namespace_path([ 'a', 'b' ])
+    a = root.find_namespace([ 'a' ])
+    a.add_type(Type('T', { 'name': 'T' }))
+    b.add_type(Type('U', { 'name': 'U' }))
+    return (root, a, b)
+
+
+def test_types_are_indexed_by_qualified_name():
+    (root, a, b) = tree()
+    u = root.resolve_type('a.b.U')
+    assert u is b.types['U']
+    assert u.qualified_name == 'a.b.U'
+    assert u.qualified_name is sys.intern('a.b.U')
+    assert root.resolve_type_list([ 'a', 'T' ]) is a.types['T']
+    assert a.resolve_type('b.U') is u
+    assert b.resolve_type('.a.T') is a.types['T']
+    assert root.resolve_type('a.Nope') is None
+
+
+def test_scoped_lookup_searches_enclosing_namespaces():
+    (root, a, b) = tree()
+    assert b.resolve_scoped_type('T') is a.types['T']
+
+    # A type added closer to the scope hides the memoized one
+    closer = Type('T', { 'name': 'T' })
+    b.add_type(closer)
+    assert b.resolve_scoped_type('T') is closer
+
+
+def test_moved_subtree_is_indexed_under_its_new_path():
+    (root, a, b) = tree()
+    other = NameSpace('other')
+    other.add_namespace(NameSpace('x')).add_type(Type('V', { 'name': 'V' }))
+    a.add_namespace(other)
+
+    v = root.resolve_type('a.other.x.V')
+    assert v is not None
+    assert v.qualified_name == 'a.other.x.V'
+    assert v.root is root
+
+
+def test_merged_namespaces_keep_existing_types():
+    (root, a, b) = tree()
+    update = NameSpace('b')
+    update.add_type(Type('W', { 'name': 'W' }))
+    assert a.add_namespace(update) is b
+    assert sorted(b.types) == [ 'U', 'W' ]
+    assert root.resolve_type('a.b.W') is b.types['W']
+
+
+def test_removed_type_is_not_resolved():
+    (root, a, b) = tree()
+    u = b.types['U']
+    assert b.resolve_scoped_type('U') is u
+    assert b.remove_type(u) is u
+    assert root.resolve_type('a.b.U') is None
+    assert b.resolve_scoped_type('U') is None
+    assert b.remove_type(u) is None
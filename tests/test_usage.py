@@ -0,0 +1,72 @@
+# (C) 2022 Magnus Feuer
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+import os
+
+from fidl_parser import parse_tree, usage
+from fidl_parser.project import FidlFile, Project
+
+text = """package org.example
+typeCollection Types {
+  struct Point { Int32 x Int32 y }
+  typedef Position is Point
+  array Path of Position
+  struct Route { Path path }
+}
+interface Navigator {
+  attribute Types.Position current
+  method go { in { Types.Route route } }
+  broadcast arrived { out { Types.Point at } }
+}
+"""
+
+
+def names(usages):
+    return sorted((use.kind, use.qualified_name) for use in usages)
+
+
+def test_users_and_impact():
+    # Names are relative to the package of a single converted file
+    index = usage.UsageIndex()
+    parse_tree.convert_fidl_text(text, usage=index)
+
+    assert names(index.users('Types.Point')) == [
+        ('broadcast', 'Navigator.arrived'),
+        ('typedef', 'Types.Position') ]
+
+    assert names(index.impact('Types.Point')) == [
+        ('array', 'Types.Path'),
+        ('attribute', 'Navigator.current'),
+        ('broadcast', 'Navigator.arrived'),
+        ('method', 'Navigator.go'),
+        ('struct', 'Types.Route'),
+        ('typedef', 'Types.Position') ]
+
+    assert index.users('Types.Unused') == []
+
+
+def test_remove_file_drops_its_users():
+    index = usage.UsageIndex()
+    index.add('T', usage.Usage('method', 'a.I.m', {}, 'a.fidl'))
+    index.add('T', usage.Usage('method', 'b.I.m', {}, 'b.fidl'))
+    index.add('T', usage.Usage('method', 'b.I.m', {}, 'b.fidl'))
+
+    index.remove_file('b.fidl')
+    assert names(index.users('T')) == [ ('method', 'a.I.m') ]
+    index.remove_file('a.fidl')
+    assert index.users('T') == []
+
+
+def test_project_usage_across_files(model):
+    project = Project([ model('client.fidl') ], workers=1).load()
+    service = os.path.normpath(model('service.fidl'))
+
+    assert [ (use.qualified_name, use.file_name) for use in project.usage.users('org.example.Types.Color') ] == \
+        [ ('org.example.Service.move', service) ]
+    assert names(project.usage.users('org.example.Types.Point')) == [
+        ('method', 'org.example.Service.move'),
+        ('struct', 'org.example.Types.Point3') ]
+    assert not hasattr(FidlFile, 'usage')